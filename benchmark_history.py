@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import logging
+# logging.basicConfig has to be before astm import, otherwise logs don't appear
+logging.basicConfig(format='%(asctime)s %(levelname)s [%(name)s] %(message)s', level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+import driver.cnl24lib as cnl24lib
+import os
+import pickle
+import random
+import struct
+import sys
+import time
+
+# Decode throughput benchmark for the history parser.
+# Uses 'history_archive.ngph' (see main.py) or 'history_data.dat' when they exist, otherwise a synthetic 10 day pump history.
+# Run it on two revisions to compare them:
+#   python3 benchmark_history.py [rounds]
+
+HISTORY_DAYS = 10
+BLOCK_SIZE = 2048
+
+# Synthetic events: rtc 2021-02-28, offset like a real pump
+RTC_START = 667872000
+RTC_OFFSET = -1000000
+
+
+def synthetic_event(event_type, rtc, body):
+    return struct.pack('>BBBII', event_type, 0, 0x0B + len(body), rtc, RTC_OFFSET & 0xFFFFFFFF) + body
+
+
+def synthetic_history(days):
+    random.seed(days)
+    events = []
+    bolus_number = 0
+    for minute in range(0, days * 24 * 60, 5):
+        rtc = RTC_START + minute * 60
+        events.append(synthetic_event(cnl24lib.NGPHistoryEvent.EVENT_TYPE.PLGM_CONTROLLER_STATE, rtc, bytes(20)))
+        if minute % 30 == 0:
+            readings = b''
+            for i in range(6):
+                readings += struct.pack('>HHBhBB', random.randint(40, 400), random.randint(0, 5000), 0, random.randint(-300, 300), 0, 0)
+            events.append(synthetic_event(cnl24lib.NGPHistoryEvent.EVENT_TYPE.SENSOR_GLUCOSE_READINGS_EXTENDED, rtc,
+                                          struct.pack('>BBH', 5, 6, 120) + readings))
+        if minute % 60 == 0:
+            events.append(synthetic_event(cnl24lib.NGPHistoryEvent.EVENT_TYPE.BASAL_SEGMENT_START, rtc, struct.pack('>BBI', 1, 2, 8500)))
+        if minute % 240 == 0:
+            bolus_number = (bolus_number + 1) & 0xFF
+            amount = random.randint(1, 100) * 500
+            events.append(synthetic_event(cnl24lib.NGPHistoryEvent.EVENT_TYPE.BOLUS_WIZARD_ESTIMATE, rtc - 60, bytes(0x2A)))
+            events.append(synthetic_event(cnl24lib.NGPHistoryEvent.EVENT_TYPE.NORMAL_BOLUS_PROGRAMMED, rtc,
+                                          struct.pack('>BBBII', 1, bolus_number, 0, amount, 0)))
+            events.append(synthetic_event(cnl24lib.NGPHistoryEvent.EVENT_TYPE.NORMAL_BOLUS_DELIVERED, rtc + 60,
+                                          struct.pack('>BBBIII', 1, bolus_number, 0, amount, amount, 0)))
+        if minute % (24 * 60) == 0:
+            events.append(synthetic_event(cnl24lib.NGPHistoryEvent.EVENT_TYPE.DAILY_TOTALS, rtc, bytes(0x61)))
+            events.append(synthetic_event(cnl24lib.NGPHistoryEvent.EVENT_TYPE.ALARM_NOTIFICATION, rtc, struct.pack('>H', 104) + bytes(16)))
+
+    blocks = []
+    block = b''
+    for event in events:
+        if len(block) + len(event) > BLOCK_SIZE - 4:
+            blocks.append(block)
+            block = b''
+        block += event
+    if block:
+        blocks.append(block)
+    return blocks
+
+
+def load_blocks(mt):
+    if os.path.exists('history_archive.ngph'):
+        return 'history_archive.ngph', cnl24lib.HistoryArchive().read_blocks(cnl24lib.HistoryDataType.PUMP_DATA)
+    if os.path.exists('history_data.dat'):
+        with open('history_data.dat', 'rb') as input_file:
+            history_pages = pickle.load(input_file)
+        blocks = []
+        for segment in history_pages:
+            blocks += mt.decode_pump_segment(segment, cnl24lib.HistoryDataType.PUMP_DATA)
+        return 'history_data.dat', blocks
+    return 'synthetic {0} days'.format(HISTORY_DAYS), synthetic_history(HISTORY_DAYS)
+
+
+if __name__ == '__main__':
+
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    mt = cnl24lib.Medtronic600SeriesDriver()
+    source, blocks = load_blocks(mt)
+    size = sum(len(block) for block in blocks)
+
+    best = None
+    events = []
+    for i in range(rounds):
+        start = time.perf_counter()
+        events = mt.decode_events(blocks)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    print("# History: {0}, {1} blocks, {2} bytes, {3} events".format(source, len(blocks), size, len(events)))
+    print("# decode_events: best of {0}: {1:.3f} s, {2:.0f} events/s, {3:.0f} KB/s".format(
+        rounds, best, len(events) / best, size / 1024 / best))
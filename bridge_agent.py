@@ -0,0 +1,31 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import logging
+# logging.basicConfig has to be before astm import, otherwise logs don't appear
+logging.basicConfig(format='%(asctime)s %(levelname)s [%(name)s] %(message)s', level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+import driver.cnl24lib as cnl24lib
+import sys
+
+# Agent for the machine the CNL is plugged into (e.g. the Pi next to the pump): forwards the USB frames
+# to the driver on another machine, over TCP or a Unix socket.
+#   python3 bridge_agent.py [port | unix socket path]
+# There, instead of mt.open_device():
+#   mt.open_device(cnl24lib.SocketTransport(('agent host', port)))
+
+BRIDGE_PORT = 8624
+
+if __name__ == '__main__':
+
+    address = ('0.0.0.0', BRIDGE_PORT)
+    if len(sys.argv) > 1:
+        address = ('0.0.0.0', int(sys.argv[1])) if sys.argv[1].isdigit() else sys.argv[1]
+
+    bridge = cnl24lib.TransportBridge(address)
+    logger.info("Bridge on {0}".format(address))
+    try:
+        bridge.serve()
+    except KeyboardInterrupt:
+        pass
@@ -5,19 +5,43 @@ import logging
 logging.basicConfig(format='%(asctime)s %(levelname)s [%(name)s] %(message)s', level=logging.WARNING)
 logger = logging.getLogger(__name__)
 
-import hid
 import binascii
+import bisect
+import collections
+import concurrent.futures
+import itertools
+import json
+import mmap
+import operator
+import os
+import queue
+import select
+import socket
 import struct
 import astm
 import re
 import hashlib
+import heapq
+import io
 import sqlite3
+import threading
+import time
 import crc16
 import Crypto.Cipher.AES
 import datetime
 from dateutil import tz
 import lzo
 from datetime import timedelta
+try:
+    # Optional, only used by the batch (vectorized) decoders
+    import numpy
+except ImportError:
+    numpy = None
+try:
+    # Optional on Linux, see HidrawTransport
+    import hid
+except ImportError:
+    hid = None
 
 VERSION = "0.1"
 
@@ -494,29 +518,112 @@ class NGPHistoryEvent:
         CLOSED_LOOP_TRANSITION = 0xDF
         GENERATED_SENSOR_GLUCOSE_READINGS_EXTENDED_ITEM = 0xD601  # this is not a pump event, it's generated from single items within SENSOR_GLUCOSE_READINGS_EXTENDED
 
-    def __init__(self, event_data):
-        self.event_data = event_data
+    # Event type -> decoder class, filled once at import time (see the end of the HISTORY section)
+    EVENT_DECODERS = {}
+
+    # Header of every event: type, source, size, rtc, offset
+    # +-----------+-------------+-----------+-------------+----------------+
+    # | byte type | byte source | byte size | BE long rtc | BE long offset |
+    # +-----------+-------------+-----------+-------------+----------------+
+    HEADER = struct.Struct('>BBBII')
+
+    # An event is a view of its record: '_buffer' (bytes or memoryview) and '_pos', the offset of the event.
+    # Fields are read in place, event_data (bytes) is only built when asked for.
+    # decode_record gives every event a memoryview of its record alone, so a field read past the event size raises.
+    # The view keeps the decompressed block alive: 2 KB shared by the events of the block, less than a copy per event.
+    # The header is decoded once in __init__, the timestamp on first use, with '_timestamps', the TimestampEngine
+    # of the decode run the event comes from (None: DateTimeHelper)
+    __slots__ = ('_buffer', '_pos', '_event_type', '_source', '_size', '_rtc', '_offset', '_timestamp', '_timestamps')
+
+    def __init__(self, event_data, pos=0):
+        self._buffer = event_data
+        self._pos = pos
+        self._event_type, self._source, self._size, self._rtc, offset = NGPHistoryEvent.HEADER.unpack_from(event_data, pos)
+        self._offset = offset - 0x100000000 # DateTimeHelper.decode_date_time_offset()
+        self._timestamp = None
+        self._timestamps = None
+
+    @property
+    def event_data(self):
+        return bytes(self._buffer[self._pos:self._pos + self._size])
+
+    def __getstate__(self):
+        # A memoryview can't be pickled (ProcessPoolExecutor): keep only the bytes of this event.
+        # The TimestampEngine stays in the worker process (see decode_history_segment_worker).
+        state = {}
+        for event_class in type(self).__mro__:
+            for name in getattr(event_class, '__slots__', ()):
+                if hasattr(self, name):
+                    state[name] = getattr(self, name)
+        state['_buffer'] = self.event_data
+        state['_pos'] = 0
+        state['_timestamps'] = None
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
 
     @property
     def source(self):
         # No idea what "source" means.
-        return BinaryDataDecoder.read_byte(self.event_data, 0x01)  # self.eventData[0x01];
+        return self._source  # self.eventData[0x01];
 
     @property
     def size(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x02)  # this.eventData[0x02];
+        return self._size  # this.eventData[0x02];
 
     @property
     def event_type(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x00)  # this.eventData[0];
+        return self._event_type  # this.eventData[0];
+
+    @property
+    def rtc(self):
+        return self._rtc
+
+    @property
+    def rtc_offset(self):
+        return self._offset
 
     @property
     def timestamp(self):
-        return DateTimeHelper.decode_date_time(BinaryDataDecoder.read_uint64be(self.event_data, 0x03))
+        if self._timestamp is None:
+            self._timestamp = self.decode_date_time(self._rtc, self._offset)
+        return self._timestamp
+
+    @property
+    def fingerprint(self):
+        # Identifies the raw record (nested events share their record's fingerprint)
+        return NGPHistoryEvent.record_fingerprint(self._buffer, self._pos)
+
+    @staticmethod
+    def record_fingerprint(page, pos):
+        # fingerprint of the raw record at 'pos' of a block, without decoding it
+        return hashlib.sha1(page[pos:pos + page[pos + 2]]).digest()
+
+    @property
+    def epoch_time(self):
+        # Timestamp as epoch seconds, without building a datetime
+        engine = self._timestamps or TimestampEngine()
+        return engine.epoch_time(self._rtc, self._offset)
+
+    def decode_date_time(self, pump_date_time, offset=None):
+        if self._timestamps is None:
+            return DateTimeHelper.decode_date_time(pump_date_time, offset)
+        return self._timestamps.decode_date_time(pump_date_time, offset)
+
+    @staticmethod
+    def decode_record(page, pos, timestamps=None, decoder=None):
+        # The events of the record at 'pos' of 'page' (a memoryview, nested events included), decoded with 'timestamps'
+        if decoder is None:
+            decoder = NGPHistoryEvent.EVENT_DECODERS.get(page[pos], NGPHistoryEvent)
+        event = decoder(page[pos:pos + page[pos + 2]], 0)
+        event._timestamps = timestamps
+        return event.all_nested_events()
 
     @property
     def dynamic_action_requestor(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x01)  # self.eventData[0x01];
+        return self._source  # self.eventData[0x01];
 
     def __str__(self):
         return '{0} 0x{1:X} {2} {3}'.format(self.__class__.__name__, self.event_type, self.timestamp,
@@ -531,180 +638,29 @@ class NGPHistoryEvent:
     def all_nested_events(self):
         yield self.event_instance()
 
-    def post_process(self, history_events):
+    def post_process(self, history_index):
+        # Link this event to related events, 'history_index' is a HistoryEventIndex over the whole history
         pass
 
     def event_instance(self):
-        if self.event_type == NGPHistoryEvent.EVENT_TYPE.BG_READING:
-            return BloodGlucoseReadingEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.NORMAL_BOLUS_DELIVERED:
-            return NormalBolusDeliveredEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.SENSOR_GLUCOSE_READINGS_EXTENDED:
-            return SensorGlucoseReadingsEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.BOLUS_WIZARD_ESTIMATE:
-            return BolusWizardEstimateEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.BASAL_SEGMENT_START:
-            return BasalSegmentStartEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.INSULIN_DELIVERY_STOPPED:
-            return InsulinDeliveryStoppedEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.INSULIN_DELIVERY_RESTARTED:
-            return InsulinDeliveryRestartedEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.PLGM_CONTROLLER_STATE:
-            return PLGMControllerStateEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.CALIBRATION_COMPLETE:
-            return CalibrationCompleteEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.ALARM_NOTIFICATION:
-            return AlarmNotificationEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.ALARM_CLEARED:
-            return AlarmClearedEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.SENSOR_ALERT_SILENCE_STARTED:
-            return SensorAlertSilenceStartedEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.SENSOR_ALERT_SILENCE_ENDED:
-            return SensorAlertSilenceEndedEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.CALIBRATION_REMINDER_CHANGE:
-            return CalibrationReminderChangeEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.DAILY_TOTALS:
-            return DailyTotalsEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.START_OF_DAY_MARKER:
-            return StartOfDayMarkerEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.END_OF_DAY_MARKER:
-            return EndOfDayMarkerEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.SOURCE_ID_CONFIGURATION:
-            return SourceIdConfigurationEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.NORMAL_BOLUS_PROGRAMMED:
-            return NormalBolusProgrammedEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.NETWORK_DEVICE_CONNECTION:
-            return NetworkDeviceConnectionEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.BASAL_PATTERN_SELECTED:
-            return BasalPatternSelectedEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.TEMP_BASAL_COMPLETE:
-            return TempBasalCompleteEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.CANNULA_FILL_DELIVERED:
-            return CannulaFillDeliveredEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.DUAL_BOLUS_PROGRAMMED:
-            return DualBolusProgrammedEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.TEMP_BASAL_PROGRAMMED:
-            return TempBasalProgrammedEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.DUAL_BOLUS_PART_DELIVERED:
-            return DualBolusPartDeliveredEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.SQUARE_BOLUS_PROGRAMMED:
-            return SquareBolusProgrammedEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.SQUARE_BOLUS_DELIVERED:
-            return SquareBolusDeliveredEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.OLD_BASAL_PATTERN:
-            return OldBasalPatternEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.NEW_BASAL_PATTERN:
-            return NewBasalPatternEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.LOW_RESERVOIR:
-            return LowReservoirEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.DISPLAY_OPTION_CHANGE:
-            return DisplayOptionChangeEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.AIRPLANE_MODE:
-            return AirplaneModeEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.TIME_RESET:
-            return TimeResetEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.USER_TIME_DATE_CHANGE:
-            return UserTimeDateChangeEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.AUDIO_VIBRATE_MODE_CHANGE:
-            return AudioVibrateModeChangeEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.EXERCISE_EVENT_MARKER:
-            return ExerciseEventMarkerEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.INJECTION_EVENT_MARKER:
-            return InjectionEventMarkerEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.FOOD_EVENT_MARKER:
-            return FoodEventMarkerEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.OTHER_EVENT_MARKER:
-            return OtherEventMarkerEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.SET_CHANGE_REMINDER_CHANGE:
-            return SetChangeReminderChangeEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.BG_REMINDER_OPTION_CHANGE:
-            return BGReminderChangeEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.LOW_RESERVOIR_REMINDER_CHANGE:
-            return LowReservoirReminderChangeEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.PERSONAL_REMINDER_CHANGE:
-            return PersonalReminderChangeEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.MISSED_MEAL_BOLUS_REMINDER_CHANGE:
-            return MissedMealBolusReminderChangeEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.GLUCOSE_SENSOR_CHANGE:
-            return GlucoseSensorChangeEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.BATTERY_INSERTED:
-            return BatteryInsertedEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.BATTERY_REMOVED:
-            return BatteryRemovedEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.MISSED_MEAL_BOLUS_REMINDER_EXPIRED:
-            return MissedMealBolusReminderExpiredEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.SENSOR_CALIBRATION_REJECTED:
-            return SensorCalibrationRejectedEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.SELF_TEST_REQUESTED:
-            return SelfTestRequestedEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.SELF_TEST_RESULTS:
-            return SelfTestResultsEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.REWIND:
-            return RewindEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.USER_SETTINGS_RESET_TO_DEFAULTS:
-            return UserSettingsResetToDefaultsEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.STARTUP_WIZARD_START_END:
-            return StartupWizardStartEndEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.LANGUAGE_CHANGE:
-            return LanguageChangeEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.TIME_FORMAT_CHANGE:
-            return TimeFormatChangeEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.OLD_BOLUS_WIZARD_INSULIN_TO_CARB_RATIOS:
-            return OldBolusWizardInsulinToCarbEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.NEW_BOLUS_WIZARD_INSULIN_TO_CARB_RATIOS:
-            return NewBolusWizardInsulinToCarbEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.OLD_BOLUS_WIZARD_INSULIN_SENSITIVITY:
-            return OldBolusWizardInsulinSensitivityEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.NEW_BOLUS_WIZARD_INSULIN_SENSITIVITY:
-            return NewBolusWizardInsulinSensitivityEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.OLD_BOLUS_WIZARD_BG_TARGETS:
-            return OldBolusWizardBgTargetsEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.NEW_BOLUS_WIZARD_BG_TARGETS:
-            return NewBolusWizardBgTargetsEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.SQUARE_BOLUS_OPTION_CHANGE:
-            return SquareBolusOptionChangeEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.DUAL_BOLUS_OPTION_CHANGE:
-            return DualBolusOptionChangeEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.BOLUS_INCREMENT_CHANGE:
-            return BolusIncrementChangeEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.MAX_BASAL_RATE_CHANGE:
-            return MaxBasalRateChangeEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.MAX_BOLUS_CHANGE:
-            return MaxBolusChangeEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.EASY_BOLUS_OPTION_CHANGE:
-            return EasyBolusOptionChangeEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.AUTO_SUSPEND_CHANGE:
-            return AutoSuspendChangeEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.BOLUS_DELIVERY_RATE_CHANGE:
-            return BolusDeliveredRateCangeEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.OLD_PRESET_TEMP_BASAL:
-            return OldPresetTempBasalEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.NEW_PRESET_TEMP_BASAL:
-            return NewPresetTempBasalEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.OLD_PRESET_BOLUS:
-            return OldPresetBolusEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.NEW_PRESET_BOLUS:
-            return NewPresetBolusEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.BOLUS_CANCELED:
-            return BolusCanceledEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.NEW_HIGH_SENSOR_WARNING_LEVELS:
-            return NewHighSensorWarningLevelEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.OLD_HIGH_SENSOR_WARNING_LEVELS:
-            return OldHighSensorWarningLevelEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.NEW_LOW_SENSOR_WARNING_LEVELS:
-            return NewLowSensorWarningLevelEvent(self.event_data)
-        elif self.event_type == NGPHistoryEvent.EVENT_TYPE.OLD_LOW_SENSOR_WARNING_LEVELS:
-            return OldLowSensorWarningLevelEvent(self.event_data)
-        # elif self.event_type == NGPHistoryEvent.EVENT_TYPE.CLOSED_LOOP_BG_READING:
-        #     return ClosedLoopBloodGlucoseReadingEvent(self.eventData)
-
+        decoder = NGPHistoryEvent.EVENT_DECODERS.get(self.event_type)
+        if decoder is None or isinstance(self, decoder):
+            return self
+        event = decoder(self._buffer, self._pos)
+        event._timestamps = self._timestamps
+        return event
 
-        return self
+    @staticmethod
+    def register_event_decoder(event_type, decoder):
+        # Add (or replace) the class used to decode events of 'event_type', e.g. for a CLOSED_LOOP_* event
+        NGPHistoryEvent.EVENT_DECODERS[event_type] = decoder
+        return decoder
 
 
 class BloodGlucoseReadingEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} BG:{1} ({9}), Source:{2} ({7}), bgUnits:{8} ({3}), "
@@ -717,7 +673,7 @@ class BloodGlucoseReadingEvent(NGPHistoryEvent):
     @property
     def bg_value(self):
         # bgValue is always in mg/dL.
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x0C)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x0C)
 
     @property
     def bg_value_mmol(self):
@@ -725,7 +681,7 @@ class BloodGlucoseReadingEvent(NGPHistoryEvent):
 
     @property
     def bg_source(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0E)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0E)
 
     @property
     def bg_source_name(self):
@@ -733,7 +689,7 @@ class BloodGlucoseReadingEvent(NGPHistoryEvent):
 
     @property
     def bg_units(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0B) & 1
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B) & 1
 
     @property
     def bg_units_name(self):
@@ -741,7 +697,7 @@ class BloodGlucoseReadingEvent(NGPHistoryEvent):
 
     @property
     def calibration_flag(self):
-        return (BinaryDataDecoder.read_byte(self.event_data, 0x0B) & 2) == 2
+        return (BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B) & 2) == 2
 
     @property
     def meter_serial_number(self):
@@ -755,10 +711,11 @@ class BloodGlucoseReadingEvent(NGPHistoryEvent):
             return False
 
 class BolusDeliveredEvent(NGPHistoryEvent):
+    __slots__ = ('canceled', 'programmedEvent', 'canceledEvent')
 
     @property
     def bolus_source(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0B)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B)
 
     @property
     def bolus_source_name(self):
@@ -766,19 +723,20 @@ class BolusDeliveredEvent(NGPHistoryEvent):
 
     @property
     def bolus_number(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0C)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0C)
 
     @property
     def preset_bolus_number(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0D)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0D)
 
     @property
     def preset_bolus_number_name(self):
         return NGPConstants.BOLUS_PRESET_NAME[self.preset_bolus_number]
 
 class NormalBolusDeliveredEvent(BolusDeliveredEvent):
-    def __init__(self, event_data):
-        BolusDeliveredEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        BolusDeliveredEvent.__init__(self, event_data, pos)
         self.canceled = False
 
     def __str__(self):
@@ -791,39 +749,38 @@ class NormalBolusDeliveredEvent(BolusDeliveredEvent):
 
     @property
     def programmed_amount(self):
-        return BinaryDataDecoder.read_uint32be(self.event_data, 0x0E) / 10000.0
+        return BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x0E) / 10000.0
 
     @property
     def delivered_amount(self):
-        return BinaryDataDecoder.read_uint32be(self.event_data, 0x12) / 10000.0
+        return BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x12) / 10000.0
 
     @property
     def active_insulin(self):
-        return BinaryDataDecoder.read_uint32be(self.event_data, 0x16) / 10000.0
-
-    def post_process(self, history_events):
-        matches = [x for x in history_events
-                   if isinstance(x, NormalBolusProgrammedEvent)
-                   and x.bolus_number == self.bolus_number
-                   and x.timestamp < self.timestamp
-                   and self.timestamp - x.timestamp < timedelta(minutes=5)]
+        return BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x16) / 10000.0
+
+    def post_process(self, history_index):
+        window = timedelta(minutes=5)
+        matches = [x for x in history_index.find(NormalBolusProgrammedEvent, self.timestamp - window, self.timestamp, self.bolus_number)
+                   if x.timestamp < self.timestamp
+                   and self.timestamp - x.timestamp < window]
         if len(matches) == 1:
             self.programmedEvent = matches[0]
 
-        matches = [x for x in history_events
-                   if isinstance(x, BolusCanceledEvent)
-                   and x.bolus_number == self.bolus_number
-                   and x.timestamp <= self.timestamp
-                   and self.timestamp - x.timestamp <= timedelta(minutes=5)]
+        window = timedelta(minutes=5)
+        matches = [x for x in history_index.find(BolusCanceledEvent, self.timestamp - window, self.timestamp, self.bolus_number)
+                   if x.timestamp <= self.timestamp
+                   and self.timestamp - x.timestamp <= window]
         if len(matches) == 1:
             self.canceledEvent = matches[0]
             self.canceled = True
 
 class BolusProgrammedEvent(NGPHistoryEvent):
+    __slots__ = ('bolusWizardEvent',)
 
     @property
     def bolus_source(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0B)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B)
 
     @property
     def bolus_source_name(self):
@@ -831,19 +788,20 @@ class BolusProgrammedEvent(NGPHistoryEvent):
 
     @property
     def bolus_number(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0C)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0C)
 
     @property
     def preset_bolus_number(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0D)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0D)
 
     @property
     def preset_bolus_number_name(self):
         return NGPConstants.BOLUS_PRESET_NAME[self.preset_bolus_number]
 
 class NetworkDeviceConnectionEvent (NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return '{0} OldStatus:{1}, NewStatus:{2}, Value1:{3}, Serial:{4}'.format(NGPHistoryEvent.__shortstr__(self),
@@ -852,23 +810,24 @@ class NetworkDeviceConnectionEvent (NGPHistoryEvent):
 
     @property
     def flag1(self):
-        return (BinaryDataDecoder.read_byte(self.event_data, 0x0B) & 0x01) == 1
+        return (BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B) & 0x01) == 1
 
     @property
     def value1(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0C)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0C)
 
     @property
     def flag2(self):
-        return (BinaryDataDecoder.read_byte(self.event_data, 0x0D) & 0x01) == 1
+        return (BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0D) & 0x01) == 1
 
     @property
     def serial(self):
         return (self.event_data[0x0E:]).decode('utf-8')[::-1]
 
 class BasalPatternSelectedEvent (NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return '{0} oldPatternNumber:{1} ({2}), newPatternNumber:{3} ({4})'.format(NGPHistoryEvent.__shortstr__(self),
@@ -877,11 +836,11 @@ class BasalPatternSelectedEvent (NGPHistoryEvent):
 
     @property
     def old_pattern_number(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0B)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B)
 
     @property
     def new_pattern_number(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0C)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0C)
 
     @property
     def old_pattern_name(self):
@@ -892,8 +851,9 @@ class BasalPatternSelectedEvent (NGPHistoryEvent):
         return NGPConstants.BASAL_PATTERN_NAME[self.new_pattern_number]
 
 class TempBasalCompleteEvent (NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} Preset:{1} ({2}), Type:{3} ({9}), "
@@ -904,7 +864,7 @@ class TempBasalCompleteEvent (NGPHistoryEvent):
 
     @property
     def preset(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0B)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B)
 
     @property
     def preset_name(self):
@@ -912,7 +872,7 @@ class TempBasalCompleteEvent (NGPHistoryEvent):
 
     @property
     def type(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0C)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0C)
 
     @property
     def type_name(self):
@@ -920,27 +880,28 @@ class TempBasalCompleteEvent (NGPHistoryEvent):
 
     @property
     def rate(self):
-        return BinaryDataDecoder.read_uint32be(self.event_data, 0x0D) / 10000.0
+        return BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x0D) / 10000.0
 
     @property
     def percentage_of_rate(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x11)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x11)
 
     @property
     def duration(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x12)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x12)
 
     @property
     def canceled(self):
-        return (BinaryDataDecoder.read_byte(self.event_data, 0x14) & 0x01) == 1
+        return (BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x14) & 0x01) == 1
 
     @property
     def duration_left(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x15)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x15)
 
 class CannulaFillDeliveredEvent (NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} Type:{4} (1), Delivered:{2}, "
@@ -950,7 +911,7 @@ class CannulaFillDeliveredEvent (NGPHistoryEvent):
 
     @property
     def type(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0B)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B)
 
     @property
     def type_name(self):
@@ -958,15 +919,16 @@ class CannulaFillDeliveredEvent (NGPHistoryEvent):
 
     @property
     def delivered(self):
-        return BinaryDataDecoder.read_uint32be(self.event_data, 0x0C) / 10000.0
+        return BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x0C) / 10000.0
 
     @property
     def remaining(self):
-        return BinaryDataDecoder.read_uint32be(self.event_data, 0x10) / 10000.0
+        return BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x10) / 10000.0
 
 class NormalBolusProgrammedEvent(BolusProgrammedEvent):
-    def __init__(self, event_data):
-        BolusProgrammedEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        BolusProgrammedEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} Source:{1} ({2}), Bolus number:{3}, Preset:{4} ({7}), "
@@ -977,26 +939,27 @@ class NormalBolusProgrammedEvent(BolusProgrammedEvent):
 
     @property
     def programmed_amount(self):
-        return BinaryDataDecoder.read_uint32be(self.event_data, 0x0E) / 10000.0
+        return BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x0E) / 10000.0
 
     @property
     def active_insulin(self):
-        return BinaryDataDecoder.read_uint32be(self.event_data, 0x12) / 10000.0
+        return BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x12) / 10000.0
 
-    def post_process(self, history_events):
-        matches = [x for x in history_events
-                   if isinstance(x, BolusWizardEstimateEvent)
-                   and x.timestamp < self.timestamp
+    def post_process(self, history_index):
+        window = timedelta(minutes=5)
+        matches = [x for x in history_index.find(BolusWizardEstimateEvent, self.timestamp - window, self.timestamp)
+                   if x.timestamp < self.timestamp
                    and x.programmed == False
-                   and self.timestamp - x.timestamp < timedelta(minutes=5)
+                   and self.timestamp - x.timestamp < window
                    and x.final_estimate == self.programmed_amount]
         if len(matches) == 1:
             self.bolusWizardEvent = matches[0]
             self.bolusWizardEvent.programmed = True
 
 class DualBolusProgrammedEvent(BolusProgrammedEvent):
-    def __init__(self, event_data):
-        BolusProgrammedEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        BolusProgrammedEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} Source:{1} ({2}), Bolus number:{3}, Preset:{4} ({9}), "
@@ -1009,30 +972,30 @@ class DualBolusProgrammedEvent(BolusProgrammedEvent):
 
     @property
     def normal_programmed_amount(self):
-        return BinaryDataDecoder.read_uint32be(self.event_data, 0x0E) / 10000.0
+        return BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x0E) / 10000.0
 
     @property
     def square_programmed_amount(self):
-        return BinaryDataDecoder.read_uint32be(self.event_data, 0x12) / 10000.0
+        return BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x12) / 10000.0
 
     @property
     def programmed_duration(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x16)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x16)
 
     @property
     def active_insulin(self):
-        return BinaryDataDecoder.read_uint32be(self.event_data, 0x18) / 10000.0
+        return BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x18) / 10000.0
 
     @property
     def programmed_amount(self):
         return round(self.normal_programmed_amount + self.square_programmed_amount, 1)
 
-    def post_process(self, history_events):
-        matches = [x for x in history_events
-                   if isinstance(x, BolusWizardEstimateEvent)
-                   and x.timestamp < self.timestamp
+    def post_process(self, history_index):
+        window = timedelta(minutes=5)
+        matches = [x for x in history_index.find(BolusWizardEstimateEvent, self.timestamp - window, self.timestamp)
+                   if x.timestamp < self.timestamp
                    and x.programmed == False
-                   and self.timestamp - x.timestamp < timedelta(minutes=5)
+                   and self.timestamp - x.timestamp < window
                    and x.final_estimate == self.programmed_amount]
         if len(matches) == 1:
             self.bolusWizardEvent = matches[0]
@@ -1040,8 +1003,9 @@ class DualBolusProgrammedEvent(BolusProgrammedEvent):
 
 
 class DualBolusPartDeliveredEvent(BolusDeliveredEvent):
-    def __init__(self, event_data):
-        BolusDeliveredEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        BolusDeliveredEvent.__init__(self, event_data, pos)
         self.canceled = False
 
     def __str__(self):
@@ -1058,19 +1022,19 @@ class DualBolusPartDeliveredEvent(BolusDeliveredEvent):
 
     @property
     def normal_programmed_amount(self):
-        return BinaryDataDecoder.read_uint32be(self.event_data, 0x0E) / 10000.0
+        return BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x0E) / 10000.0
 
     @property
     def square_programmed_amount(self):
-        return BinaryDataDecoder.read_uint32be(self.event_data, 0x12) / 10000.0
+        return BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x12) / 10000.0
 
     @property
     def delivered_amount(self):
-        return BinaryDataDecoder.read_uint32be(self.event_data, 0x16) / 10000.0
+        return BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x16) / 10000.0
 
     @property
     def bolus_part(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x1A)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x1A)
 
     @property
     def bolus_part_name(self):
@@ -1078,37 +1042,36 @@ class DualBolusPartDeliveredEvent(BolusDeliveredEvent):
 
     @property
     def programmed_duration(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x1B)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x1B)
 
     @property
     def delivered_duration(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x1D)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x1D)
 
     @property
     def active_insulin(self):
-        return BinaryDataDecoder.read_uint32be(self.event_data, 0x1F) / 10000.0
-
-    def post_process(self, history_events):
-        matches = [x for x in history_events
-                   if isinstance(x, DualBolusProgrammedEvent)
-                   and x.bolus_number == self.bolus_number
-                   and x.timestamp < self.timestamp
-                   and self.timestamp - x.timestamp < timedelta(minutes=(self.programmed_duration + 1))]
+        return BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x1F) / 10000.0
+
+    def post_process(self, history_index):
+        window = timedelta(minutes=(self.programmed_duration + 1))
+        matches = [x for x in history_index.find(DualBolusProgrammedEvent, self.timestamp - window, self.timestamp, self.bolus_number)
+                   if x.timestamp < self.timestamp
+                   and self.timestamp - x.timestamp < window]
         if len(matches) == 1:
             self.programmedEvent = matches[0]
 
-        matches = [x for x in history_events
-                   if isinstance(x, BolusCanceledEvent)
-                   and x.bolus_number == self.bolus_number
-                   and x.timestamp <= self.timestamp
-                   and self.timestamp - x.timestamp <= timedelta(minutes=self.programmed_duration)]
+        window = timedelta(minutes=self.programmed_duration)
+        matches = [x for x in history_index.find(BolusCanceledEvent, self.timestamp - window, self.timestamp, self.bolus_number)
+                   if x.timestamp <= self.timestamp
+                   and self.timestamp - x.timestamp <= window]
         if len(matches) == 1:
             self.canceledEvent = matches[0]
             self.canceled = True
 
 class SquareBolusProgrammedEvent(BolusProgrammedEvent):
-    def __init__(self, event_data):
-        BolusProgrammedEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        BolusProgrammedEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} Source:{1} ({2}), Bolus number:{3}, Preset:{4} ({8}), "
@@ -1121,30 +1084,31 @@ class SquareBolusProgrammedEvent(BolusProgrammedEvent):
 
     @property
     def programmed_amount(self):
-        return BinaryDataDecoder.read_uint32be(self.event_data, 0x0E) / 10000.0
+        return BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x0E) / 10000.0
 
     @property
     def programmed_duration(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x12)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x12)
 
     @property
     def active_insulin(self):
-        return BinaryDataDecoder.read_uint32be(self.event_data, 0x14) / 10000.0
+        return BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x14) / 10000.0
 
-    def post_process(self, history_events):
-        matches = [x for x in history_events
-                   if isinstance(x, BolusWizardEstimateEvent)
-                   and x.timestamp < self.timestamp
+    def post_process(self, history_index):
+        window = timedelta(minutes=5)
+        matches = [x for x in history_index.find(BolusWizardEstimateEvent, self.timestamp - window, self.timestamp)
+                   if x.timestamp < self.timestamp
                    and x.programmed == False
-                   and self.timestamp - x.timestamp < timedelta(minutes=5)
+                   and self.timestamp - x.timestamp < window
                    and x.final_estimate == self.programmed_amount]
         if len(matches) == 1:
             self.bolusWizardEvent = matches[0]
             self.bolusWizardEvent.programmed = True
 
 class SquareBolusDeliveredEvent(BolusDeliveredEvent):
-    def __init__(self, event_data):
-        BolusDeliveredEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        BolusDeliveredEvent.__init__(self, event_data, pos)
         self.canceled = False
 
     def __str__(self):
@@ -1160,45 +1124,44 @@ class SquareBolusDeliveredEvent(BolusDeliveredEvent):
 
     @property
     def programmed_amount(self):
-        return BinaryDataDecoder.read_uint32be(self.event_data, 0x0E) / 10000.0
+        return BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x0E) / 10000.0
 
     @property
     def delivered_amount(self):
-        return BinaryDataDecoder.read_uint32be(self.event_data, 0x12) / 10000.0
+        return BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x12) / 10000.0
 
     @property
     def programmed_duration(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x16)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x16)
 
     @property
     def delivered_duration(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x18)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x18)
 
     @property
     def active_insulin(self):
-        return BinaryDataDecoder.read_uint32be(self.event_data, 0x1A) / 10000.0
-
-    def post_process(self, history_events):
-        matches = [x for x in history_events
-                   if isinstance(x, SquareBolusProgrammedEvent)
-                   and x.bolus_number == self.bolus_number
-                   and x.timestamp < self.timestamp
-                   and self.timestamp - x.timestamp < timedelta(minutes=(self.programmed_duration + 1))]
+        return BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x1A) / 10000.0
+
+    def post_process(self, history_index):
+        window = timedelta(minutes=(self.programmed_duration + 1))
+        matches = [x for x in history_index.find(SquareBolusProgrammedEvent, self.timestamp - window, self.timestamp, self.bolus_number)
+                   if x.timestamp < self.timestamp
+                   and self.timestamp - x.timestamp < window]
         if len(matches) == 1:
             self.programmedEvent = matches[0]
 
-        matches = [x for x in history_events
-                   if isinstance(x, BolusCanceledEvent)
-                   and x.bolus_number == self.bolus_number
-                   and x.timestamp <= self.timestamp
-                   and self.timestamp - x.timestamp <= timedelta(minutes=self.programmed_duration)]
+        window = timedelta(minutes=self.programmed_duration)
+        matches = [x for x in history_index.find(BolusCanceledEvent, self.timestamp - window, self.timestamp, self.bolus_number)
+                   if x.timestamp <= self.timestamp
+                   and self.timestamp - x.timestamp <= window]
         if len(matches) == 1:
             self.canceledEvent = matches[0]
             self.canceled = True
 
 class TempBasalProgrammedEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} Preset:{1} ({2}), Type:{3} ({4}), Rate:{5}, "
@@ -1210,7 +1173,7 @@ class TempBasalProgrammedEvent(NGPHistoryEvent):
     @property
     def preset(self):
         # NGPConstants.TEMP_BASAL_TYPE
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0B)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B)
 
     @property
     def preset_name(self):
@@ -1219,7 +1182,7 @@ class TempBasalProgrammedEvent(NGPHistoryEvent):
 
     @property
     def type(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0C)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0C)
 
     @property
     def type_name(self):
@@ -1227,21 +1190,22 @@ class TempBasalProgrammedEvent(NGPHistoryEvent):
 
     @property
     def rate(self):
-        return BinaryDataDecoder.read_uint32be(self.event_data, 0x0D) / 10000.0
+        return BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x0D) / 10000.0
 
     @property
     def percentage_of_rate(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x11)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x11)
 
     @property
     def duration(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x12)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x12)
 
 class BasalPatternEvent(NGPHistoryEvent):
+    __slots__ = ()
 
     @property
     def pattern_number(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0B)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B)
 
     @property
     def pattern_name(self):
@@ -1249,15 +1213,15 @@ class BasalPatternEvent(NGPHistoryEvent):
 
     @property
     def number_of_segments(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0C)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0C)
 
     @property
     def segments(self):
         segments = {}
         pos = 0x0D
         for i in range(self.number_of_segments):
-            rate = BinaryDataDecoder.read_uint32be(self.event_data, pos) / 10000.0
-            start = (BinaryDataDecoder.read_byte(self.event_data, pos + 4) * 30)
+            rate = BinaryDataDecoder.read_uint32be(self._buffer, self._pos + pos) / 10000.0
+            start = (BinaryDataDecoder.read_byte(self._buffer, self._pos + pos + 4) * 30)
             time = str(timedelta(minutes=start))
             seg = {
                 "rate" : rate,
@@ -1269,8 +1233,9 @@ class BasalPatternEvent(NGPHistoryEvent):
         return segments
 
 class OldBasalPatternEvent(BasalPatternEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return '{0} Pattern:{1} ({2}), SegmentsNumber:{3}, Segments:{4}'.format(NGPHistoryEvent.__shortstr__(self),
@@ -1278,8 +1243,9 @@ class OldBasalPatternEvent(BasalPatternEvent):
                                                                     self.number_of_segments,self.segments)
 
 class NewBasalPatternEvent(BasalPatternEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return '{0} Pattern:{1} ({2}), SegmentsNumber:{3}, Segments:{4}'.format(NGPHistoryEvent.__shortstr__(self),
@@ -1287,8 +1253,9 @@ class NewBasalPatternEvent(BasalPatternEvent):
                                                                     self.number_of_segments,self.segments)
 
 class LowReservoirEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} Type:{1}, Hours:{2}, Minutes:{3}, Units:{4}").format(NGPHistoryEvent.__shortstr__(self),
@@ -1297,24 +1264,25 @@ class LowReservoirEvent(NGPHistoryEvent):
 
     @property
     def warning_type(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0B)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B)
 
     # TODO change time format
     @property
     def hours_remaining(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0C)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0C)
 
     @property
     def minutes_remaining(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0D)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0D)
 
     @property
     def units_remaining(self):
-        return BinaryDataDecoder.read_uint32be(self.event_data, 0x0E) / 10000.0
+        return BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x0E) / 10000.0
 
 class DisplayOptionChangeEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} OldBrightness:{1}, NewBrightness:{2}, OldBacklight:{3} Sec, NewBacklight:{4} Sec").format(
@@ -1323,25 +1291,26 @@ class DisplayOptionChangeEvent(NGPHistoryEvent):
 
     @property
     def old_brightness_level(self):
-        return "Auto" if BinaryDataDecoder.read_byte(self.event_data, 0x0B) == 0 else BinaryDataDecoder.read_byte(self.event_data, 0x0B)
+        return "Auto" if BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B) == 0 else BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B)
 
     # TODO change time format
     @property
     def old_backlight_seconds(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0D)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0D)
 
     @property
     def new_brightness_level(self):
-        return "Auto" if BinaryDataDecoder.read_byte(self.event_data, 0x0F) == 0 else BinaryDataDecoder.read_byte(self.event_data, 0x0F)
+        return "Auto" if BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0F) == 0 else BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0F)
 
     # TODO change time format
     @property
     def new_backlight_seconds(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x11)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x11)
 
 class AudioVibrateModeChangeEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} OldVolumeLevel:{1}, NewVolumeLevel:{2}, OldMode:{3} ({4}), NewMode:{5} ({6})").format(
@@ -1350,7 +1319,7 @@ class AudioVibrateModeChangeEvent(NGPHistoryEvent):
 
     @property
     def old_mode(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0B)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B)
 
     @property
     def old_mode_name(self):
@@ -1358,11 +1327,11 @@ class AudioVibrateModeChangeEvent(NGPHistoryEvent):
 
     @property
     def old_volume_level(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0C)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0C)
 
     @property
     def new_mode(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0D)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0D)
 
     @property
     def new_mode_name(self):
@@ -1370,11 +1339,12 @@ class AudioVibrateModeChangeEvent(NGPHistoryEvent):
 
     @property
     def new_volume_level(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0E)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0E)
 
 class ExerciseEventMarkerEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} DateTime:{1}, Duration:{2}").format(
@@ -1383,15 +1353,16 @@ class ExerciseEventMarkerEvent(NGPHistoryEvent):
 
     @property
     def timestamp(self):
-        return DateTimeHelper.decode_date_time(BinaryDataDecoder.read_uint64be(self.event_data, 0x0B))
+        return self.decode_date_time(BinaryDataDecoder.read_uint64be(self._buffer, self._pos + 0x0B))
 
     @property
     def duration_minutes(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x13)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x13)
 
 class InjectionEventMarkerEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} DateTime:{1}, Injection:{2} U").format(
@@ -1400,15 +1371,16 @@ class InjectionEventMarkerEvent(NGPHistoryEvent):
 
     @property
     def timestamp(self):
-        return DateTimeHelper.decode_date_time(BinaryDataDecoder.read_uint64be(self.event_data, 0x0B))
+        return self.decode_date_time(BinaryDataDecoder.read_uint64be(self._buffer, self._pos + 0x0B))
 
     @property
     def injection(self):
-        return BinaryDataDecoder.read_uint32be(self.event_data, 0x13) / 10000.0
+        return BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x13) / 10000.0
 
 class FoodEventMarkerEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} DateTime:{1}, Type:{2} ({3}), Carb:{4}").format(
@@ -1417,12 +1389,12 @@ class FoodEventMarkerEvent(NGPHistoryEvent):
 
     @property
     def timestamp(self):
-        return DateTimeHelper.decode_date_time(BinaryDataDecoder.read_uint64be(self.event_data, 0x0B))
+        return self.decode_date_time(BinaryDataDecoder.read_uint64be(self._buffer, self._pos + 0x0B))
 
     @property
     def carb_units(self):
         # See NGPUtil.NGPConstants.CARB_UNITS
-        return BinaryDataDecoder.read_byte(self.event_data, 0x13)  # carbUnits
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x13)  # carbUnits
 
     @property
     def carb_units_name(self):
@@ -1431,20 +1403,22 @@ class FoodEventMarkerEvent(NGPHistoryEvent):
 
     @property
     def carb_input(self):
-        carbs = BinaryDataDecoder.read_uint16be(self.event_data, 0x14)  # carbInput
+        carbs = BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x14)  # carbInput
         return carbs if self.carb_units == NGPConstants.CARB_UNITS.GRAMS else carbs / 10.0
 
 class OtherEventMarkerEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0}").format(
                 NGPHistoryEvent.__shortstr__(self))
 
 class SetChangeReminderChangeEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} OldStatus:{1} ({2}), NewStatus:{3} ({4}), OldDays:{5}, NewDays:{6}").format(
@@ -1453,11 +1427,11 @@ class SetChangeReminderChangeEvent(NGPHistoryEvent):
 
     @property
     def old_status(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0B)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B)
 
     @property
     def new_status(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0D)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0D)
 
     @property
     def old_status_name(self):
@@ -1468,15 +1442,16 @@ class SetChangeReminderChangeEvent(NGPHistoryEvent):
 
     @property
     def old_days(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0C)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0C)
 
     @property
     def new_days(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0E)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0E)
 
 class BGReminderChangeEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} OldStatus:{1} ({2}), NewStatus:{3} ({4})").format(
@@ -1485,11 +1460,11 @@ class BGReminderChangeEvent(NGPHistoryEvent):
 
     @property
     def old_status(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0B)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B)
 
     @property
     def new_status(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0C)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0C)
 
     @property
     def old_status_name(self):
@@ -1499,8 +1474,9 @@ class BGReminderChangeEvent(NGPHistoryEvent):
         return "On" if self.new_status == 1 else "Off"
 
 class LowReservoirReminderChangeEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} OldUnits:{1}, NewUnits:{2}, OldType:{3}({4}), NewType:{5} ({6}), OldMinutes:{7}, NewMinutes:{8}").format(
@@ -1509,27 +1485,27 @@ class LowReservoirReminderChangeEvent(NGPHistoryEvent):
 
     @property
     def new_units(self):
-        return BinaryDataDecoder.read_uint32be(self.event_data, 0x15) / 10000.0
+        return BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x15) / 10000.0
 
     @property
     def old_units(self):
-        return BinaryDataDecoder.read_uint32be(self.event_data, 0x0E) / 10000.0
+        return BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x0E) / 10000.0
 
     @property
     def new_type(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x12)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x12)
 
     @property
     def old_type(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0B)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B)
 
     @property
     def new_minutes(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x13)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x13)
 
     @property
     def old_minutes(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x0C)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x0C)
 
     @property
     def new_type_name(self):
@@ -1540,8 +1516,9 @@ class LowReservoirReminderChangeEvent(NGPHistoryEvent):
         return "Time" if self.old_type == 1 else "Units"
 
 class PersonalReminderChangeEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} Reminder:{1}, IsReminder:{2}, InList:{3}, OldEnable:{4}, NewEnable:{5}, OldTime:{6}, NewTime:{7}").format(
@@ -1551,7 +1528,7 @@ class PersonalReminderChangeEvent(NGPHistoryEvent):
 
     @property
     def reminder(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0B)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B)
 
     @property
     def reminder_name(self):
@@ -1564,11 +1541,11 @@ class PersonalReminderChangeEvent(NGPHistoryEvent):
 
     @property
     def old_status_enable(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0F)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0F)
 
     @property
     def new_status_enable(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x13)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x13)
 
     @property
     def old_status_enable_name(self):
@@ -1580,30 +1557,31 @@ class PersonalReminderChangeEvent(NGPHistoryEvent):
 
     @property
     def new_minutes(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x11)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x11)
 
     @property
     def old_minutes(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x0D)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x0D)
 
     @property
     def is_reminder(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0C)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0C)
     @property
     def is_reminder_name(self):
         return "Yes" if self.new_status_enable == 1 else "No"
 
     @property
     def in_list(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x10)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x10)
 
     @property
     def in_list_name(self):
         return "Yes" if self.new_status_enable == 1 else "No"
 
 class MissedMealBolusReminderChangeEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} Reminder:{1}, IsReminder:{2}, InList:{3}, OldEnable:{4}, NewEnable:{5}, OldTime:{6}-{7}, NewTime:{8}-{9}").format(
@@ -1614,7 +1592,7 @@ class MissedMealBolusReminderChangeEvent(NGPHistoryEvent):
 
     @property
     def reminder(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0B)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B)
 
     @property
     def reminder_name(self):
@@ -1627,27 +1605,27 @@ class MissedMealBolusReminderChangeEvent(NGPHistoryEvent):
 
     @property
     def new_start_minutes(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x13)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x13)
 
     @property
     def new_end_minutes(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x15)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x15)
 
     @property
     def old_start_minutes(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x0D)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x0D)
 
     @property
     def old_end_minutes(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x0F)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x0F)
 
     @property
     def old_status_enable(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x11)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x11)
 
     @property
     def new_status_enable(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x17)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x17)
 
     @property
     def old_status_enable_name(self):
@@ -1659,139 +1637,151 @@ class MissedMealBolusReminderChangeEvent(NGPHistoryEvent):
 
     @property
     def is_reminder(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0C)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0C)
     @property
     def is_reminder_name(self):
         return "Yes" if self.new_status_enable == 1 else "No"
 
     @property
     def in_list(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x12)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x12)
 
     @property
     def in_list_name(self):
         return "Yes" if self.new_status_enable == 1 else "No"
 
 class GlucoseSensorChangeEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0}").format(NGPHistoryEvent.__shortstr__(self))
 
 class BatteryInsertedEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0}").format(NGPHistoryEvent.__shortstr__(self))
 
 class BatteryRemovedEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0}").format(NGPHistoryEvent.__shortstr__(self))
 
 class AirplaneModeEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} Status:{1} ({2})").format(NGPHistoryEvent.__shortstr__(self),self.switch_name, self.switch)
 
     @property
     def switch(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0B)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B)
 
     @property
     def switch_name(self):
         return "On" if self.switch == 1 else "Off"
 
 class MissedMealBolusReminderExpiredEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} Status:{1} ({2})").format(NGPHistoryEvent.__shortstr__(self),self.switch_name, self.switch)
 
     @property
     def switch(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0B)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B)
 
     @property
     def switch_name(self):
         return "On" if self.switch == 1 else "Off"
 
 class SensorCalibrationRejectedEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} Status:{1} ({2})").format(NGPHistoryEvent.__shortstr__(self),self.switch_name, self.switch)
 
     @property
     def switch(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0B)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B)
 
     @property
     def switch_name(self):
         return "On" if self.switch == 1 else "Off"
 
 class SelfTestResultsEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} Status:{1} ({2})").format(NGPHistoryEvent.__shortstr__(self),self.switch_name, self.switch)
 
     @property
     def switch(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0B)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B)
 
     @property
     def switch_name(self):
         return "Ok" if self.switch == 1 else "Error"
 
 class SelfTestRequestedEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0}").format(NGPHistoryEvent.__shortstr__(self))
 
 class RewindEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0}").format(NGPHistoryEvent.__shortstr__(self))
 
 class UserSettingsResetToDefaultsEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0}").format(NGPHistoryEvent.__shortstr__(self))
 
 class StartupWizardStartEndEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} Status: {1} ({2})").format(NGPHistoryEvent.__shortstr__(self), self.status_name, self.status)
 
     @property
     def status(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0B)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B)
 
     @property
     def status_name(self):
         return "End" if self.status == 1 else "Start"
 
 class LanguageChangeEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} Old:{1} ({2}), New:{3} ({4})").format(
@@ -1801,11 +1791,11 @@ class LanguageChangeEvent(NGPHistoryEvent):
 
     @property
     def old_number(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0B)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B)
 
     @property
     def new_number(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0C)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0C)
 
     @property
     def old_language(self):
@@ -1816,8 +1806,9 @@ class LanguageChangeEvent(NGPHistoryEvent):
         return NGPConstants.LANGUAGE_PUMP_NAME[self.new_number]
 
 class TimeFormatChangeEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} Old:{1} ({2}), New:{3} ({4})").format(
@@ -1827,11 +1818,11 @@ class TimeFormatChangeEvent(NGPHistoryEvent):
 
     @property
     def old_number(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0B)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B)
 
     @property
     def new_number(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0C)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0C)
 
     @property
     def old_time_format_name(self):
@@ -1842,10 +1833,11 @@ class TimeFormatChangeEvent(NGPHistoryEvent):
         return "12h" if self.new_number == 0 else "24h"
 
 class BolusWizardInsulinToCarbEvent(NGPHistoryEvent):
+    __slots__ = ()
 
     @property
     def carb_units(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0B) # 0=grams 1=exchanges
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B) # 0=grams 1=exchanges
 
     @property
     def carb_units_name(self):
@@ -1853,15 +1845,15 @@ class BolusWizardInsulinToCarbEvent(NGPHistoryEvent):
 
     @property
     def number_of_segments(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0C)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0C)
 
     @property
     def segments(self):
         segments = {}
         pos = 0x0D
         for i in range(self.number_of_segments):
-            start = (BinaryDataDecoder.read_byte(self.event_data, pos) * 30)
-            amount_tmp = BinaryDataDecoder.read_uint32be(self.event_data, pos + 1)
+            start = (BinaryDataDecoder.read_byte(self._buffer, self._pos + pos) * 30)
+            amount_tmp = BinaryDataDecoder.read_uint32be(self._buffer, self._pos + pos + 1)
             amount = amount_tmp / 10.0 if (self.carb_units == NGPConstants.CARB_UNITS.GRAMS) else amount_tmp / 1000.0
 
             time = str(timedelta(minutes=start))
@@ -1875,8 +1867,9 @@ class BolusWizardInsulinToCarbEvent(NGPHistoryEvent):
         return segments
 
 class OldBolusWizardInsulinToCarbEvent(BolusWizardInsulinToCarbEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return '{0} Units:{1} ({2}), SegmentsNumbers:{3}, Segments:{4}'.format(NGPHistoryEvent.__shortstr__(self),
@@ -1884,8 +1877,9 @@ class OldBolusWizardInsulinToCarbEvent(BolusWizardInsulinToCarbEvent):
                                                                                 self.number_of_segments, self.segments)
 
 class NewBolusWizardInsulinToCarbEvent(BolusWizardInsulinToCarbEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return '{0} Units:{1} ({2}), SegmentsNumbers:{3}, Segments:{4}'.format(NGPHistoryEvent.__shortstr__(self),
@@ -1893,10 +1887,11 @@ class NewBolusWizardInsulinToCarbEvent(BolusWizardInsulinToCarbEvent):
                                                                                 self.number_of_segments, self.segments)
 
 class BolusWizardInsulinSensitivityEvent(NGPHistoryEvent):
+    __slots__ = ()
 
     @property
     def bg_units(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0B) # 0=mgdl 1=mmol
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B) # 0=mgdl 1=mmol
 
     @property
     def bg_units_name(self):
@@ -1904,15 +1899,15 @@ class BolusWizardInsulinSensitivityEvent(NGPHistoryEvent):
 
     @property
     def number_of_segments(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0C)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0C)
 
     @property
     def segments(self):
         segments = {}
         pos = 0x0D
         for i in range(self.number_of_segments):
-            start = (BinaryDataDecoder.read_byte(self.event_data, pos) * 30)
-            amount_tmp = BinaryDataDecoder.read_uint16be(self.event_data, pos + 1)
+            start = (BinaryDataDecoder.read_byte(self._buffer, self._pos + pos) * 30)
+            amount_tmp = BinaryDataDecoder.read_uint16be(self._buffer, self._pos + pos + 1)
             amount = amount_tmp if self.bg_units == NGPConstants.BG_UNITS.MG_DL else amount_tmp / 10.0
 
             time = str(timedelta(minutes=start))
@@ -1926,8 +1921,9 @@ class BolusWizardInsulinSensitivityEvent(NGPHistoryEvent):
         return segments
 
 class OldBolusWizardInsulinSensitivityEvent(BolusWizardInsulinSensitivityEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return '{0} Units:{1} ({2}), SegmentsNumbers:{3}, Segments:{4}'.format(NGPHistoryEvent.__shortstr__(self),
@@ -1935,8 +1931,9 @@ class OldBolusWizardInsulinSensitivityEvent(BolusWizardInsulinSensitivityEvent):
                                                                                self.number_of_segments, self.segments)
 
 class NewBolusWizardInsulinSensitivityEvent(BolusWizardInsulinSensitivityEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return '{0} Units:{1} ({2}), SegmentsNumbers:{3}, Segments:{4}'.format(NGPHistoryEvent.__shortstr__(self),
@@ -1944,10 +1941,11 @@ class NewBolusWizardInsulinSensitivityEvent(BolusWizardInsulinSensitivityEvent):
                                                                                self.number_of_segments, self.segments)
 
 class BolusWizardBgTargetsEvent(NGPHistoryEvent):
+    __slots__ = ()
 
     @property
     def bg_units(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0B) # 0=mgdl 1=mmol
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B) # 0=mgdl 1=mmol
 
     @property
     def bg_units_name(self):
@@ -1955,17 +1953,17 @@ class BolusWizardBgTargetsEvent(NGPHistoryEvent):
 
     @property
     def number_of_segments(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0C)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0C)
 
     @property
     def segments(self):
         segments = {}
         pos = 0x0D
         for i in range(self.number_of_segments):
-            start = (BinaryDataDecoder.read_byte(self.event_data, pos) * 30)
-            high_tmp = BinaryDataDecoder.read_uint16be(self.event_data, pos + 1)
+            start = (BinaryDataDecoder.read_byte(self._buffer, self._pos + pos) * 30)
+            high_tmp = BinaryDataDecoder.read_uint16be(self._buffer, self._pos + pos + 1)
             high = high_tmp if self.bg_units == NGPConstants.BG_UNITS.MG_DL else high_tmp / 10.0
-            low_tmp = BinaryDataDecoder.read_uint16be(self.event_data, pos + 1)
+            low_tmp = BinaryDataDecoder.read_uint16be(self._buffer, self._pos + pos + 1)
             low = low_tmp if self.bg_units == NGPConstants.BG_UNITS.MG_DL else low_tmp / 10.0
 
             time = str(timedelta(minutes=start))
@@ -1980,8 +1978,9 @@ class BolusWizardBgTargetsEvent(NGPHistoryEvent):
         return segments
 
 class OldBolusWizardBgTargetsEvent(BolusWizardBgTargetsEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return '{0} Units:{1} ({2}), SegmentsNumbers:{3}, Segments:{4}'.format(NGPHistoryEvent.__shortstr__(self),
@@ -1989,8 +1988,9 @@ class OldBolusWizardBgTargetsEvent(BolusWizardBgTargetsEvent):
                                                                                self.number_of_segments, self.segments)
 
 class NewBolusWizardBgTargetsEvent(BolusWizardBgTargetsEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return '{0} Units:{1} ({2}), SegmentsNumbers:{3}, Segments:{4}'.format(NGPHistoryEvent.__shortstr__(self),
@@ -1998,13 +1998,14 @@ class NewBolusWizardBgTargetsEvent(BolusWizardBgTargetsEvent):
                                                                                self.number_of_segments, self.segments)
 
 class BolusOptionChangeEvent(NGPHistoryEvent):
+    __slots__ = ()
     @property
     def old_status(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0B)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B)
 
     @property
     def new_status(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0C)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0C)
 
     @property
     def old_status_name(self):
@@ -2015,8 +2016,9 @@ class BolusOptionChangeEvent(NGPHistoryEvent):
         return "Off" if self.new_status == 0 else "On"
 
 class SquareBolusOptionChangeEvent(BolusOptionChangeEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} Old Status:{1} ({2}), New Status:{3} ({4})").format(
@@ -2026,8 +2028,9 @@ class SquareBolusOptionChangeEvent(BolusOptionChangeEvent):
         )
 
 class DualBolusOptionChangeEvent(BolusOptionChangeEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} Old Status:{1} ({2}), New Status:{3} ({4})").format(
@@ -2037,8 +2040,9 @@ class DualBolusOptionChangeEvent(BolusOptionChangeEvent):
         )
 
 class BolusIncrementChangeEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} Old Status:{1} ({2}), New Status:{3} ({4})").format(
@@ -2049,11 +2053,11 @@ class BolusIncrementChangeEvent(NGPHistoryEvent):
 
     @property
     def old_status(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0B)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B)
 
     @property
     def new_status(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0C)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0C)
 
     @property
     def old_status_name(self):
@@ -2064,8 +2068,9 @@ class BolusIncrementChangeEvent(NGPHistoryEvent):
         return NGPConstants.BOLUS_STEP_SIZE_NAME[self.new_status]
 
 class MaxBasalRateChangeEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} Old Rate:{1}, New Rate:{2}").format(
@@ -2074,15 +2079,16 @@ class MaxBasalRateChangeEvent(NGPHistoryEvent):
 
     @property
     def old_max_basal_rate(self):
-        return (BinaryDataDecoder.read_uint32be(self.event_data, 0x0B) / 10000.0 )
+        return (BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x0B) / 10000.0 )
 
     @property
     def new_max_basal_rate(self):
-        return (BinaryDataDecoder.read_uint32be(self.event_data, 0x0F) / 10000.0 )
+        return (BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x0F) / 10000.0 )
 
 class MaxBolusChangeEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} Old Rate:{1}, New Rate:{2}").format(
@@ -2091,15 +2097,16 @@ class MaxBolusChangeEvent(NGPHistoryEvent):
 
     @property
     def old_max_bolus(self):
-        return (BinaryDataDecoder.read_uint32be(self.event_data, 0x0B) / 10000.0 )
+        return (BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x0B) / 10000.0 )
 
     @property
     def new_max_bolus(self):
-        return (BinaryDataDecoder.read_uint32be(self.event_data, 0x0F) / 10000.0 )
+        return (BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x0F) / 10000.0 )
 
 class EasyBolusOptionChangeEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} Old state:{1} ({2}), New state:{3} ({4}), Old step:{5}, New step:{6}").format(
@@ -2111,11 +2118,11 @@ class EasyBolusOptionChangeEvent(NGPHistoryEvent):
 
     @property
     def old_status(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0B)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B)
 
     @property
     def new_status(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0C)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0C)
 
     @property
     def old_status_name(self):
@@ -2127,15 +2134,16 @@ class EasyBolusOptionChangeEvent(NGPHistoryEvent):
 
     @property
     def old_bolus_step(self):
-        return (BinaryDataDecoder.read_uint32be(self.event_data, 0x0D) / 10000.0 )
+        return (BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x0D) / 10000.0 )
 
     @property
     def new_bolus_step(self):
-        return (BinaryDataDecoder.read_uint32be(self.event_data, 0x11) / 10000.0 )
+        return (BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x11) / 10000.0 )
 
 class AutoSuspendChangeEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} Old state:{1} ({2}), New state:{3} ({4}), Old time:{5} ({7}), New time:{6} ({8})").format(
@@ -2148,11 +2156,11 @@ class AutoSuspendChangeEvent(NGPHistoryEvent):
 
     @property
     def old_status(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0B)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B)
 
     @property
     def new_status(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0D)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0D)
 
     @property
     def old_status_name(self):
@@ -2164,11 +2172,11 @@ class AutoSuspendChangeEvent(NGPHistoryEvent):
 
     @property
     def old_time_minutes(self):
-        return (BinaryDataDecoder.read_byte(self.event_data, 0x0C) * 60 )
+        return (BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0C) * 60 )
 
     @property
     def new_time_minutes(self):
-        return (BinaryDataDecoder.read_byte(self.event_data, 0x0E) * 60 )
+        return (BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0E) * 60 )
 
     @property
     def old_time(self):
@@ -2179,8 +2187,9 @@ class AutoSuspendChangeEvent(NGPHistoryEvent):
         return str(timedelta(minutes=self.new_time_minutes))
 
 class BolusDeliveredRateCangeEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} Old state:{1} ({2}), New state:{3} ({4})").format(
@@ -2191,11 +2200,11 @@ class BolusDeliveredRateCangeEvent(NGPHistoryEvent):
 
     @property
     def old_status(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0B)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B)
 
     @property
     def new_status(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0C)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0C)
 
     @property
     def old_status_name(self):
@@ -2206,10 +2215,11 @@ class BolusDeliveredRateCangeEvent(NGPHistoryEvent):
         return "Standard" if self.new_status == 0 else "Fast"
 
 class PresetTempBasalEvent(NGPHistoryEvent):
+    __slots__ = ()
 
     @property
     def preset(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0B)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B)
 
     @property
     def preset_name(self):
@@ -2217,7 +2227,7 @@ class PresetTempBasalEvent(NGPHistoryEvent):
 
     @property
     def enable(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0C)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0C)
 
     @property
     def enable_name(self):
@@ -2225,7 +2235,7 @@ class PresetTempBasalEvent(NGPHistoryEvent):
 
     @property
     def type(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0D)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0D)
 
     @property
     def type_name(self):
@@ -2233,23 +2243,24 @@ class PresetTempBasalEvent(NGPHistoryEvent):
 
     @property
     def rate(self):
-        return BinaryDataDecoder.read_uint32be(self.event_data, 0x0E)
+        return BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x0E)
 
     @property
     def perc(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x12)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x12)
 
     @property
     def duration_minutes(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x13)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x13)
 
     @property
     def duration(self):
         return str(timedelta(minutes=self.duration_minutes))
 
 class OldPresetTempBasalEvent(PresetTempBasalEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} Preset:{1} ({2}), State:{3} ({4}), Percent\Rate:{5}, Rate:{6}, Perc:{7}, Duration:{8} ({9})").format(
@@ -2259,8 +2270,9 @@ class OldPresetTempBasalEvent(PresetTempBasalEvent):
             self.type_name, self.rate, self.perc, self.duration, self.duration_minutes)
 
 class NewPresetTempBasalEvent(PresetTempBasalEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} Preset:{1} ({2}), State:{3} ({4}), Percent\Rate:{5}, Rate:{6}, Perc:{7}, Duration:{8} ({9})").format(
@@ -2270,10 +2282,11 @@ class NewPresetTempBasalEvent(PresetTempBasalEvent):
             self.type_name, self.rate, self.perc, self.duration, self.duration_minutes)
 
 class PresetBolusEvent(NGPHistoryEvent):
+    __slots__ = ()
 
     @property
     def preset(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0B)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B)
 
     @property
     def preset_name(self):
@@ -2281,7 +2294,7 @@ class PresetBolusEvent(NGPHistoryEvent):
 
     @property
     def type(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0C)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0C)
 
     @property
     def type_name(self):
@@ -2289,23 +2302,24 @@ class PresetBolusEvent(NGPHistoryEvent):
 
     @property
     def now_rate(self):
-        return (BinaryDataDecoder.read_uint32be(self.event_data, 0x0D) / 10000.0)
+        return (BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x0D) / 10000.0)
 
     @property
     def square_rate(self):
-        return (BinaryDataDecoder.read_uint32be(self.event_data, 0x11) / 10000.0)
+        return (BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x11) / 10000.0)
 
     @property
     def duration_minutes(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x15)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x15)
 
     @property
     def duration(self):
         return str(timedelta(minutes=self.duration_minutes))
 
 class OldPresetBolusEvent(PresetBolusEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} Preset Bolus:{1} ({2}), Type:{3} ({4}), Now rate:{5}, Square rate:{6}, Duration:{7} ({8})").format(
@@ -2315,8 +2329,9 @@ class OldPresetBolusEvent(PresetBolusEvent):
             self.now_rate, self.square_rate, self.duration, self.duration_minutes)
 
 class NewPresetBolusEvent(PresetBolusEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} Preset Bolus:{1} ({2}), Type:{3} ({4}), Now rate:{5}, Square rate:{6}, Duration:{7} ({8})").format(
@@ -2326,10 +2341,11 @@ class NewPresetBolusEvent(PresetBolusEvent):
             self.now_rate, self.square_rate, self.duration, self.duration_minutes)
 
 class LowSensorWarningLevelEvent(NGPHistoryEvent):
+    __slots__ = ()
 
     @property
     def low_settings(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0C)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0C)
 
     @property
     def low_settings_name(self):
@@ -2337,7 +2353,7 @@ class LowSensorWarningLevelEvent(NGPHistoryEvent):
 
     @property
     def snooze(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0D)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0D)
 
     @property
     def snooze_duration(self):
@@ -2345,22 +2361,22 @@ class LowSensorWarningLevelEvent(NGPHistoryEvent):
 
     @property
     def count(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0E)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0E)
 
     @property
     def lists(self):
         segments = {}
         pos = 0x0F
         for i in range(self.count):
-            start_time = BinaryDataDecoder.read_uint16be(self.event_data, pos)
+            start_time = BinaryDataDecoder.read_uint16be(self._buffer, self._pos + pos)
             start_time_str = str(timedelta(minutes=start_time))
-            low_bg_value = BinaryDataDecoder.read_byte(self.event_data, pos + 0x02) / 10.0
+            low_bg_value = BinaryDataDecoder.read_byte(self._buffer, self._pos + pos + 0x02) / 10.0
 
-            alert_on_low = (BinaryDataDecoder.read_byte(self.event_data, pos + 0x03) & 1) == 1
-            alert_before_low = (BinaryDataDecoder.read_byte(self.event_data, pos + 0x03) & 2) == 2
-            suspend_on_low = (BinaryDataDecoder.read_byte(self.event_data, pos + 0x03) & 4) == 4
-            suspend_before_low = (BinaryDataDecoder.read_byte(self.event_data, pos + 0x03) & 8) == 8
-            resume_basal_alert = (BinaryDataDecoder.read_byte(self.event_data, pos + 0x03) & 16) == 16
+            alert_on_low = (BinaryDataDecoder.read_byte(self._buffer, self._pos + pos + 0x03) & 1) == 1
+            alert_before_low = (BinaryDataDecoder.read_byte(self._buffer, self._pos + pos + 0x03) & 2) == 2
+            suspend_on_low = (BinaryDataDecoder.read_byte(self._buffer, self._pos + pos + 0x03) & 4) == 4
+            suspend_before_low = (BinaryDataDecoder.read_byte(self._buffer, self._pos + pos + 0x03) & 8) == 8
+            resume_basal_alert = (BinaryDataDecoder.read_byte(self._buffer, self._pos + pos + 0x03) & 16) == 16
 
             seg = {
                 "start_time_minutes" : start_time,
@@ -2377,8 +2393,9 @@ class LowSensorWarningLevelEvent(NGPHistoryEvent):
         return segments
 
 class NewLowSensorWarningLevelEvent(LowSensorWarningLevelEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} LowSettings:{1} ({2}), Snooze:{3} ({4}), Count:{5}, List:{6}").format(
@@ -2387,8 +2404,9 @@ class NewLowSensorWarningLevelEvent(LowSensorWarningLevelEvent):
             self.snooze_duration, self.snooze, self.count, self.lists)
 
 class OldLowSensorWarningLevelEvent(LowSensorWarningLevelEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} LowSettings:{1} ({2}), Snooze:{3} ({4}), Count:{5}, List:{6}").format(
@@ -2397,10 +2415,11 @@ class OldLowSensorWarningLevelEvent(LowSensorWarningLevelEvent):
             self.snooze_duration, self.snooze, self.count, self.lists)
 
 class HiSensorWarningLevelEvent(NGPHistoryEvent):
+    __slots__ = ()
 
     @property
     def high_settings(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0C)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0C)
 
     @property
     def high_settings_name(self):
@@ -2408,7 +2427,7 @@ class HiSensorWarningLevelEvent(NGPHistoryEvent):
 
     @property
     def snooze(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0D)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0D)
 
     @property
     def snooze_duration(self):
@@ -2416,25 +2435,25 @@ class HiSensorWarningLevelEvent(NGPHistoryEvent):
 
     @property
     def count(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0E)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0E)
 
     @property
     def lists(self):
         segments = {}
         pos = 0x0F
         for i in range(self.count):
-            start_time = BinaryDataDecoder.read_uint16be(self.event_data, pos)
+            start_time = BinaryDataDecoder.read_uint16be(self._buffer, self._pos + pos)
             start_time_str = str(timedelta(minutes=start_time))
-            hi_bg_value = BinaryDataDecoder.read_uint16be(self.event_data, pos + 0x02) / 10.0
+            hi_bg_value = BinaryDataDecoder.read_uint16be(self._buffer, self._pos + pos + 0x02) / 10.0
 
-            alert_before_high = (BinaryDataDecoder.read_byte(self.event_data, pos + 0x04) & 2) == 2
-            time_before_high = BinaryDataDecoder.read_byte(self.event_data, pos + 0x05)
+            alert_before_high = (BinaryDataDecoder.read_byte(self._buffer, self._pos + pos + 0x04) & 2) == 2
+            time_before_high = BinaryDataDecoder.read_byte(self._buffer, self._pos + pos + 0x05)
             time_before_high_stf = str(timedelta(minutes=time_before_high))
-            alert_on_high = (BinaryDataDecoder.read_byte(self.event_data, pos + 0x04) & 1) == 1
-            rise_alert = (BinaryDataDecoder.read_byte(self.event_data, pos + 0x04) & 4) == 4
+            alert_on_high = (BinaryDataDecoder.read_byte(self._buffer, self._pos + pos + 0x04) & 1) == 1
+            rise_alert = (BinaryDataDecoder.read_byte(self._buffer, self._pos + pos + 0x04) & 4) == 4
 
-            rise_limit = BinaryDataDecoder.read_byte(self.event_data, pos + 0x06)
-            rise_limit_custom = BinaryDataDecoder.read_uint16be(self.event_data, pos + 0x07) / 1000.0
+            rise_limit = BinaryDataDecoder.read_byte(self._buffer, self._pos + pos + 0x06)
+            rise_limit_custom = BinaryDataDecoder.read_uint16be(self._buffer, self._pos + pos + 0x07) / 1000.0
 
             if rise_limit == 0x01:
                 rise_limit_txt = "1 arrows up"
@@ -2465,8 +2484,9 @@ class HiSensorWarningLevelEvent(NGPHistoryEvent):
         return segments
 
 class NewHighSensorWarningLevelEvent(HiSensorWarningLevelEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} HighSettings:{1} ({2}), Snooze:{3} ({4}), Count:{5}, List:{6}").format(
@@ -2475,8 +2495,9 @@ class NewHighSensorWarningLevelEvent(HiSensorWarningLevelEvent):
             self.snooze_duration, self.snooze, self.count, self.lists)
 
 class OldHighSensorWarningLevelEvent(HiSensorWarningLevelEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} HighSettings:{1} ({2}), Snooze:{3} ({4}), Count:{5}, List:{6}").format(
@@ -2485,8 +2506,9 @@ class OldHighSensorWarningLevelEvent(HiSensorWarningLevelEvent):
             self.snooze_duration, self.snooze, self.count, self.lists)
 
 class BolusCanceledEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} Canceled type:{1} ({2}), Bolus number:{3}, Unknown:{4}").format(
@@ -2494,7 +2516,7 @@ class BolusCanceledEvent(NGPHistoryEvent):
 
     @property
     def canceled_type(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0B)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B)
 
     @property
     def canceled_type_name(self):
@@ -2502,127 +2524,137 @@ class BolusCanceledEvent(NGPHistoryEvent):
 
     @property
     def bolus_number(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0C)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0C)
 
     @property
     def unknown(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0D)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0D)
 
 class TimeResetEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} NewDate:{1}").format(NGPHistoryEvent.__shortstr__(self),self.date)
 
     @property
     def datetime(self):
-        return BinaryDataDecoder.read_uint64be(self.event_data, 0x0B)
+        return BinaryDataDecoder.read_uint64be(self._buffer, self._pos + 0x0B)
 
     @property
     def date(self):
-        return DateTimeHelper.decode_date_time(self.datetime)
+        return self.decode_date_time(self.datetime)
 
     @property
     def offset(self):
         return DateTimeHelper.decode_date_time_offset(self.datetime)
 
 class UserTimeDateChangeEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return ("{0} NewDate:{1}").format(NGPHistoryEvent.__shortstr__(self),self.date)
 
     @property
     def datetime(self):
-        return BinaryDataDecoder.read_uint64be(self.event_data, 0x0B)
+        return BinaryDataDecoder.read_uint64be(self._buffer, self._pos + 0x0B)
 
     @property
     def date(self):
-        return DateTimeHelper.decode_date_time(self.datetime)
+        return self.decode_date_time(self.datetime)
 
     @property
     def offset(self):
         return DateTimeHelper.decode_date_time_offset(self.datetime)
 
 class SensorGlucoseReadingsEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return '{0}'.format(NGPHistoryEvent.__shortstr__(self))
 
     @property
     def minutes_between_readings(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0B) # minutesBetweenReadings
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B) # minutesBetweenReadings
 
     @property
     def number_of_readings(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0C)  # numberOfReadings
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0C)  # numberOfReadings
 
     @property
     def predicted_sg(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x0D)  # predictedSg
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x0D)  # predictedSg
+
+    # One 9 byte record per reading, the first record is the oldest reading:
+    # +--------------------------+-----------+---------------+----------------------+-------------------+--------------------+
+    # | BE short sg (+vctr bits) | BE short  | byte vctr     | BE short             | byte              | byte               |
+    # | bits 0-9 sg, 10-11 vctr  | isig*100  | (low 8 bits)  | rate of change * 100 | sensor status     | reading status     |
+    # +--------------------------+-----------+---------------+----------------------+-------------------+--------------------+
+    READING = struct.Struct('>HHBhBB')
 
     def all_nested_events(self):
+        minutes_between_readings = self.minutes_between_readings
+        predicted_sg = self.predicted_sg
+        dynamic_action_requestor = self.dynamic_action_requestor
         pos = 0x0F
         for i in range(self.number_of_readings - 1, -1, -1):
 
-            timestamp = self.timestamp - timedelta(minutes=i * self.minutes_between_readings)
-            sg = BinaryDataDecoder.read_uint16be(self.event_data, pos + 0x00) & 0x03FF
-            isig = BinaryDataDecoder.read_uint16be(self.event_data, pos + 0x02) / 100.0
+            rtc = self._rtc - i * minutes_between_readings * 60
+            timestamp = self.decode_date_time(rtc, self._offset)
+            sg, isig, vctr, rate_of_change, sensor_status, reading_status = \
+                SensorGlucoseReadingsEvent.READING.unpack_from(self._buffer, self._pos + pos)
 
             # TODO Fixme "vctr" ???
             # vctr = NumberHelper.make32BitIntFromNBitSignedInt((((payload_decoded[0] >> 0x02) & 0x03) << 8) | payload_decoded[3], 10) / 100.0
             # vctrraw = NumberHelper.make32BitIntFromNBitSignedInt((((payload_decoded[0] >> 0x02) & 0x03) << 8) | payload_decoded[4] & 0x000000FF)
             # vctrraw = (((payload_decoded[0] >> 0x02) & 0x03) << 8) | payload_decoded[3] & 0x000000FF
-            vctrraw = (((self.event_data[pos] >> 2 & 3) << 8) | self.event_data[pos + 4] & 0x000000FF)
+            vctrraw = (((sg >> 10) & 3) << 8) | vctr
             if ((vctrraw & 0x0200) != 0):
                 vctrraw |= 0xFFFFFE00
                 # vctrraw = vctrraw & 0xFFFFFE00
-            vctr = vctrraw / 100.0
-
-            rate_of_change = float( struct.unpack( '>h', self.event_data[(pos + 0x05) : (pos + 0x07)] )[0] ) / 100
-            sensor_status = BinaryDataDecoder.read_byte(self.event_data, 0x07)
-            reading_status = BinaryDataDecoder.read_byte(self.event_data, 0x08)
-
-            backfilled_data = (reading_status & 1) == 1
-            settings_changed = (reading_status & 2) == 2
-            noisy_data = sensor_status == 1
-            discard_data = sensor_status == 2
-            sensor_error = sensor_status == 3
 
+            sg &= 0x03FF
             sensor_exception = 0x0300
             if sg >= 0x0300:
                 sensor_exception = sg
                 sg = 0
 
-            sensor_exception_text = NGPConstants.SENSOR_EXCEPTIONS_NAME[sensor_exception]
-
-            yield SensorGlucoseReading(event_data = self.event_data,
+            reading = SensorGlucoseReading(event_data = self._buffer,
+                                       pos = self._pos,
                                        timestamp = timestamp,
-                                       dynamic_action_requestor = self.dynamic_action_requestor,
+                                       dynamic_action_requestor = dynamic_action_requestor,
                                        sg = sg,
-                                       predicted_sg = self.predicted_sg,
-                                       noisy_data = noisy_data,
-                                       discard_data = discard_data,
-                                       sensor_error = sensor_error,
-                                       backfilled_data = backfilled_data,
-                                       settings_changed = settings_changed,
-                                       isig = isig,
-                                       rate_of_change = rate_of_change,
-                                       vctr = vctr,
-                                       sensor_exception_text = sensor_exception_text
+                                       predicted_sg = predicted_sg,
+                                       noisy_data = sensor_status == 1,
+                                       discard_data = sensor_status == 2,
+                                       sensor_error = sensor_status == 3,
+                                       backfilled_data = (reading_status & 1) == 1,
+                                       settings_changed = (reading_status & 2) == 2,
+                                       isig = isig / 100.0,
+                                       rate_of_change = rate_of_change / 100.0,
+                                       vctr = vctrraw / 100.0,
+                                       sensor_exception_text = NGPConstants.SENSOR_EXCEPTIONS_NAME[sensor_exception],
+                                       rtc = rtc
                                        )
-            pos = pos +9
+            reading._timestamps = self._timestamps
+            yield reading
+            pos = pos + 9
 
 class SensorGlucoseReading(NGPHistoryEvent):
+    __slots__ = ('_dynamicActionRequestor', 'sg', 'predictedSg', 'isig', 'vctr', 'rateOfChange',
+                 'backfilledData', 'settingsChanged', 'noisyData', 'discardData', 'sensorError', 'sensorExceptionText')
     def __init__(self, event_data, timestamp, dynamic_action_requestor, sg, predicted_sg=0, isig=0, vctr=0, rate_of_change=0.0,
                  backfilled_data=False, settings_changed=False, noisy_data=False, discard_data=False, sensor_error=False,
-                 sensor_exception_text=""):
-        super().__init__(event_data)
-        self.eventData = event_data
+                 sensor_exception_text="", pos=0, rtc=None):
+        # event_data/pos: the parent SENSOR_GLUCOSE_READINGS_EXTENDED event, rtc: the time of this reading
+        super().__init__(event_data, pos)
+        if rtc is not None:
+            self._rtc = rtc
         self._timestamp = timestamp
         self._dynamicActionRequestor = dynamic_action_requestor
         self.sg = sg
@@ -2653,6 +2685,10 @@ class SensorGlucoseReading(NGPHistoryEvent):
             round(self.sg / NGPConstants.BG_UNITS.MMOLXLFACTOR, 1),
         )
 
+    @property
+    def eventData(self):
+        return self.event_data
+
     @property
     def source(self):
         return self._dynamicActionRequestor
@@ -2676,9 +2712,107 @@ class SensorGlucoseReading(NGPHistoryEvent):
     def event_instance(self):
         return self
 
+class SensorGlucoseReadings(object):
+    # Columnar (numpy) decoding of the readings of SENSOR_GLUCOSE_READINGS_EXTENDED events:
+    # one array per field, one element per reading, oldest reading first within each event.
+    # The 9 byte records are read with a structured dtype straight from the event buffers,
+    # see SensorGlucoseReadingsEvent.READING for the layout.
+    READING_DTYPE = None if numpy is None else numpy.dtype([
+        ('sg', '>u2'), ('isig', '>u2'), ('vctr', 'u1'), ('rate_of_change', '>i2'), ('sensor_status', 'u1'), ('reading_status', 'u1')])
+
+    def __init__(self, events_data, timestamps=None):
+        # events_data: raw SENSOR_GLUCOSE_READINGS_EXTENDED events (bytes-like), timestamps: TimestampEngine to use
+        if numpy is None:
+            raise ImportError("SensorGlucoseReadings needs numpy")
+        self.timestamps = timestamps or TimestampEngine()
+
+        self.events_data = list(events_data)
+        records = []
+        event_indexes = []
+        rtcs = []
+        offsets = []
+        dynamic_action_requestors = []
+        predicted_sgs = []
+        for event_index, event_data in enumerate(self.events_data):
+            rtc, offset = NGPHistoryEvent.HEADER.unpack_from(event_data)[3:]
+            minutes_between_readings = event_data[0x0B]
+            number_of_readings = event_data[0x0C]
+            records.append(numpy.frombuffer(event_data, SensorGlucoseReadings.READING_DTYPE, number_of_readings, 0x0F))
+            rtcs.append(rtc - numpy.arange(number_of_readings - 1, -1, -1, dtype=numpy.int64) * (minutes_between_readings * 60))
+            offsets.append(numpy.full(number_of_readings, offset - 0x100000000, dtype=numpy.int64))
+            event_indexes.append(numpy.full(number_of_readings, event_index, dtype=numpy.int32))
+            dynamic_action_requestors.append(numpy.full(number_of_readings, event_data[0x01], dtype=numpy.uint8))
+            predicted_sgs.append(numpy.full(number_of_readings, BinaryDataDecoder.read_uint16be(event_data, 0x0D), dtype=numpy.uint16))
+
+        if records:
+            reading = numpy.concatenate(records)
+            self.event_index = numpy.concatenate(event_indexes)
+            self.rtc = numpy.concatenate(rtcs)
+            self.rtc_offset = numpy.concatenate(offsets)
+            self.dynamic_action_requestor = numpy.concatenate(dynamic_action_requestors)
+            self.predicted_sg = numpy.concatenate(predicted_sgs)
+        else:
+            reading = numpy.zeros(0, SensorGlucoseReadings.READING_DTYPE)
+            self.event_index = numpy.zeros(0, numpy.int32)
+            self.rtc = numpy.zeros(0, numpy.int64)
+            self.rtc_offset = numpy.zeros(0, numpy.int64)
+            self.dynamic_action_requestor = numpy.zeros(0, numpy.uint8)
+            self.predicted_sg = numpy.zeros(0, numpy.uint16)
+
+        # Epoch seconds, see date_times() for datetimes
+        self.timestamp = self.timestamps.epoch_times(self.rtc, self.rtc_offset)
+
+        sg = reading['sg'].astype(numpy.uint32)
+        vctr = ((sg >> 10) & 3) << 8 | reading['vctr']
+        # Same (unsigned) sign extension as SensorGlucoseReadingsEvent.all_nested_events
+        self.vctr = numpy.where(vctr & 0x0200, vctr | 0xFFFFFE00, vctr) / 100.0
+        sg &= 0x03FF
+        self.sensor_exception = numpy.where(sg >= 0x0300, sg, 0x0300).astype(numpy.uint16)
+        self.sg = numpy.where(sg >= 0x0300, 0, sg).astype(numpy.uint16)
+        self.isig = reading['isig'] / 100.0
+        self.rate_of_change = reading['rate_of_change'] / 100.0
+
+        sensor_status = reading['sensor_status']
+        reading_status = reading['reading_status']
+        self.noisy_data = sensor_status == 1
+        self.discard_data = sensor_status == 2
+        self.sensor_error = sensor_status == 3
+        self.backfilled_data = (reading_status & 1) == 1
+        self.settings_changed = (reading_status & 2) == 2
+
+    def __len__(self):
+        return len(self.sg)
+
+    def date_times(self):
+        return self.timestamps.decode_many(self.rtc, self.rtc_offset)
+
+    def __getitem__(self, i):
+        # The reading as a SensorGlucoseReading
+        return SensorGlucoseReading(event_data = self.events_data[self.event_index[i]],
+                                    timestamp = self.timestamps.decode_date_time(int(self.rtc[i]), int(self.rtc_offset[i])),
+                                    dynamic_action_requestor = int(self.dynamic_action_requestor[i]),
+                                    sg = int(self.sg[i]),
+                                    predicted_sg = int(self.predicted_sg[i]),
+                                    noisy_data = bool(self.noisy_data[i]),
+                                    discard_data = bool(self.discard_data[i]),
+                                    sensor_error = bool(self.sensor_error[i]),
+                                    backfilled_data = bool(self.backfilled_data[i]),
+                                    settings_changed = bool(self.settings_changed[i]),
+                                    isig = float(self.isig[i]),
+                                    rate_of_change = float(self.rate_of_change[i]),
+                                    vctr = float(self.vctr[i]),
+                                    sensor_exception_text = NGPConstants.SENSOR_EXCEPTIONS_NAME[int(self.sensor_exception[i])],
+                                    rtc = int(self.rtc[i])
+                                    )
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
 class BolusWizardEstimateEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ('programmed',)
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
         self.programmed = False
 
     def __str__(self):
@@ -2726,7 +2860,7 @@ class BolusWizardEstimateEvent(NGPHistoryEvent):
     @property
     def bg_units(self):
         # See NGPUtil.NGPConstants.BG_UNITS
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0B)  # bgUnits
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B)  # bgUnits
 
     @property
     def bg_units_name(self):
@@ -2736,7 +2870,7 @@ class BolusWizardEstimateEvent(NGPHistoryEvent):
     @property
     def carb_units(self):
         # See NGPUtil.NGPConstants.CARB_UNITS
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0C)  # carbUnits
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0C)  # carbUnits
 
     @property
     def carb_units_name(self):
@@ -2744,61 +2878,61 @@ class BolusWizardEstimateEvent(NGPHistoryEvent):
 
     @property
     def bg_input(self):
-        bg_input = BinaryDataDecoder.read_uint16be(self.event_data, 0x0D)  # bgInput
+        bg_input = BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x0D)  # bgInput
         return bg_input if self.bg_units == NGPConstants.BG_UNITS.MG_DL else bg_input / 10.0
 
     @property
     def carb_input(self):
-        carbs = BinaryDataDecoder.read_uint16be(self.event_data, 0x0F)  # carbInput
+        carbs = BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x0F)  # carbInput
         return carbs if self.carb_units == NGPConstants.CARB_UNITS.GRAMS else carbs / 10.0
 
     @property
     def isf(self):
-        isf = BinaryDataDecoder.read_uint16be(self.event_data, 0x11)  # isf
+        isf = BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x11)  # isf
         return isf if self.bg_units == NGPConstants.BG_UNITS.MG_DL else isf / 10.0
 
     @property
     def carb_ratio(self):
-        carb_ratio = BinaryDataDecoder.read_uint32be(self.event_data, 0x13)  # carbRatio
+        carb_ratio = BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x13)  # carbRatio
         return carb_ratio / 10.0 if (self.carb_units == NGPConstants.CARB_UNITS.GRAMS) else carb_ratio / 1000.0
 
     @property
     def low_bg_target(self):
-        bg_target = BinaryDataDecoder.read_uint16be(self.event_data, 0x17)  # lowBgTarget
+        bg_target = BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x17)  # lowBgTarget
         return bg_target if self.bg_units == NGPConstants.BG_UNITS.MG_DL else bg_target / 10.0
 
     @property
     def high_bg_target(self):
-        bg_target = BinaryDataDecoder.read_uint16be(self.event_data, 0x19) # highBgTarget
+        bg_target = BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x19) # highBgTarget
         return bg_target if self.bg_units == NGPConstants.BG_UNITS.MG_DL else bg_target / 10.0
 
     @property
     def correction_estimate(self):  # correctionEstimate
-        return ((BinaryDataDecoder.read_byte(self.event_data, 0x1B) << 8) |
-                (BinaryDataDecoder.read_byte(self.event_data, 0x1C) << 8) |
-                (BinaryDataDecoder.read_byte(self.event_data, 0x1D) << 8) |
-                BinaryDataDecoder.read_byte(self.event_data, 0x1E)) / 10000.0
+        return ((BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x1B) << 8) |
+                (BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x1C) << 8) |
+                (BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x1D) << 8) |
+                BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x1E)) / 10000.0
 
     @property
     def food_estimate(self):
-        return BinaryDataDecoder.read_uint32be(self.event_data, 0x1F) / 10000.0 # foodEstimate
+        return BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x1F) / 10000.0 # foodEstimate
 
     @property
     def active_insulin(self):
-        return BinaryDataDecoder.read_uint32be(self.event_data, 0x23) / 10000.0 # iob
+        return BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x23) / 10000.0 # iob
 
     @property
     def active_insulin_correction(self):
-        return BinaryDataDecoder.read_uint32be(self.event_data, 0x27) / 10000.0 # iobAdjustment
+        return BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x27) / 10000.0 # iobAdjustment
 
     @property
     def bolus_wizard_estimate(self):
-        return BinaryDataDecoder.read_uint32be(self.event_data, 0x2B) / 10000.0 # bolusWizardEstimate
+        return BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x2B) / 10000.0 # bolusWizardEstimate
 
     @property
     def bolus_step_size(self):
         # See NGPUtil.NGPConstants.BOLUS_STEP_SIZE
-        return BinaryDataDecoder.read_byte(self.event_data, 0x2F)  # bolusStepSize
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x2F)  # bolusStepSize
 
     @property
     def bolus_step_size_name(self):
@@ -2807,15 +2941,16 @@ class BolusWizardEstimateEvent(NGPHistoryEvent):
 
     @property
     def estimate_modified_by_user(self):
-        return (BinaryDataDecoder.read_uint32be(self.event_data, 0x30) & 0x01) == 0x01 # estimateModifiedByUser
+        return (BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x30) & 0x01) == 0x01 # estimateModifiedByUser
 
     @property
     def final_estimate(self):
-        return BinaryDataDecoder.read_uint32be(self.event_data, 0x31) / 10000.0 # finalEstimate
+        return BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x31) / 10000.0 # finalEstimate
 
 class BasalSegmentStartEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return "{0} Basal Rate:{1}, Pattern#:{4} ({2}), Segment#:{3}".format(NGPHistoryEvent.__shortstr__(self),
@@ -2826,25 +2961,26 @@ class BasalSegmentStartEvent(NGPHistoryEvent):
 
     @property
     def rate(self):
-        return BinaryDataDecoder.read_uint32be(self.event_data, 0x0D) / 10000.0
+        return BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x0D) / 10000.0
 
     @property
     def pattern_number(self):
         # See NGPUtil.NGPConstants.CARB_UNITS
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0B)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B)
 
     @property
     def segment_number(self):
         # See NGPUtil.NGPConstants.CARB_UNITS
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0C)  # return this.eventData[0x0C]
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0C)  # return this.eventData[0x0C]
 
     @property
     def pattern_name(self):
         return NGPConstants.BASAL_PATTERN_NAME[self.pattern_number]
 
 class InsulinDeliveryStoppedEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return '{0} Reason: {2} ({1})'.format(NGPHistoryEvent.__shortstr__(self),
@@ -2854,7 +2990,7 @@ class InsulinDeliveryStoppedEvent(NGPHistoryEvent):
     @property
     def suspend_reason(self):
         # See NGPUtil.NGPConstants.SUSPEND_REASON
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0B)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B)
 
     @property
     def suspend_reason_text(self):
@@ -2862,8 +2998,9 @@ class InsulinDeliveryStoppedEvent(NGPHistoryEvent):
         return NGPConstants.SUSPEND_REASON_NAME[self.suspend_reason]
 
 class InsulinDeliveryRestartedEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return '{0} Reason: {2} ({1})'.format(NGPHistoryEvent.__shortstr__(self),
@@ -2873,7 +3010,7 @@ class InsulinDeliveryRestartedEvent(NGPHistoryEvent):
     @property
     def resume_reason(self):
         # See See NGPUtil.NGPConstants.RESUME_REASON
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0B)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B)
 
     @property
     def resume_reason_text(self):
@@ -2881,10 +3018,12 @@ class InsulinDeliveryRestartedEvent(NGPHistoryEvent):
         return NGPConstants.RESUME_REASON_NAME[self.resume_reason]
 
 class PLGMControllerStateEvent(NGPHistoryEvent):
+    __slots__ = ()
     def __str__(self):
         return '{0}'.format(NGPHistoryEvent.__str__(self))
 
 class CalibrationCompleteEvent(NGPHistoryEvent):
+    __slots__ = ()
     def __str__(self):
         return '{0} calFactor:{1}, bgTarget:{2} ({3})'.format(NGPHistoryEvent.__shortstr__(self),
                                                           self.cal_factor,
@@ -2892,11 +3031,11 @@ class CalibrationCompleteEvent(NGPHistoryEvent):
 
     @property
     def cal_factor(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x0B) / 100
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x0B) / 100
 
     @property
     def bg_target(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x0D)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x0D)
 
     @property
     def bg_target_mmol(self):
@@ -3335,6 +3474,7 @@ class PumpEvent():
         return string
 
 class AlarmNotificationEvent(NGPHistoryEvent):
+    __slots__ = ('type', 'priority', 'insulin', 'time', 'list', 'bg', 'string')
     def __str__(self):
         return '{0}, Code:{1}, Mode:{2} Extra:{3} History:{4} String:{5}'.format(NGPHistoryEvent.__shortstr__(self),
                                                                                       self.fault_number,
@@ -3343,24 +3483,24 @@ class AlarmNotificationEvent(NGPHistoryEvent):
                                                                                       self.alarm_history,
                                                                                       self.alarm_string)
 
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     @property
     def fault_number(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x0B)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x0B)
 
     @property
     def notification_mode(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x11)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x11)
 
     @property
     def extra_data(self):
-        return (BinaryDataDecoder.read_byte(self.event_data, 0x12) & 2) == 2
+        return (BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x12) & 2) == 2
 
     @property
     def alarm_history(self):
-        return (BinaryDataDecoder.read_byte(self.event_data, 0x12) & 4) == 4
+        return (BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x12) & 4) == 4
 
     @property
     def alarm_data(self):
@@ -3382,30 +3522,32 @@ class AlarmNotificationEvent(NGPHistoryEvent):
         return alarm_str
 
 class AlarmClearedEvent(NGPHistoryEvent):
+    __slots__ = ()
     def __str__(self):
         return '{0}, String: Cleared Event code:{1}'.format(NGPHistoryEvent.__shortstr__(self), self.fault_number)
 
     @property
     def fault_number(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x0B)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x0B)
 
 class SensorAlertSilenceEvent(NGPHistoryEvent):
+    __slots__ = ()
 
     @property
     def high_alerts_only(self):
-        return True if BinaryDataDecoder.read_byte(self.event_data, 0x0B) == 0 else False
+        return True if BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B) == 0 else False
 
     @property
     def high_low_alerts(self):
-        return (BinaryDataDecoder.read_byte(self.event_data, 0x0B) & 1) == 1
+        return (BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B) & 1) == 1
 
     @property
     def all_sensor_alerts(self):
-        return (BinaryDataDecoder.read_byte(self.event_data, 0x0B) & 2) == 2
+        return (BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B) & 2) == 2
 
     @property
     def time_remaining_minutes(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x0C)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x0C)
 
     @property
     def time_remaining_str(self):
@@ -3413,8 +3555,9 @@ class SensorAlertSilenceEvent(NGPHistoryEvent):
 
 
 class SensorAlertSilenceStartedEvent(SensorAlertSilenceEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return '{0} high_alerts_only:{1}, high_low_alerts:{2}, all_sensor_alerts:{3}, Time remaining:{4} ({5})'.format(
@@ -3422,8 +3565,9 @@ class SensorAlertSilenceStartedEvent(SensorAlertSilenceEvent):
             self.time_remaining_str, self.time_remaining_minutes)
 
 class SensorAlertSilenceEndedEvent(SensorAlertSilenceEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return '{0} high_alerts_only:{1}, high_low_alerts:{2}, all_sensor_alerts:{3}, Time remaining:{4} ({5}), Time canceled:{6} ({7}), Canceled type:{8} ({9})'.format(
@@ -3432,7 +3576,7 @@ class SensorAlertSilenceEndedEvent(SensorAlertSilenceEvent):
 
     @property
     def time_canceled_minutes(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x0E)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x0E)
 
     @property
     def time_canceled_str(self):
@@ -3440,15 +3584,16 @@ class SensorAlertSilenceEndedEvent(SensorAlertSilenceEvent):
 
     @property
     def canceled_type(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x10)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x10)
 
     @property
     def canceled_type_name(self):
         return "auto" if self.canceled_type == 1 else "manual"
 
 class CalibrationReminderChangeEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return "{0} OldStatus: {1}({2}), NewStatus: {3}({4}), OldMinutes: {5}, NewMinutes: {6}".format(
@@ -3457,11 +3602,11 @@ class CalibrationReminderChangeEvent(NGPHistoryEvent):
 
     @property
     def old_status(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0C)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0C)
 
     @property
     def new_status(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x12)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x12)
 
     @property
     def old_status_name(self):
@@ -3473,15 +3618,16 @@ class CalibrationReminderChangeEvent(NGPHistoryEvent):
 
     @property
     def old_minutes(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x0D)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x0D)
 
     @property
     def new_minutes(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x13)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x13)
 
 class DailyTotalsEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
     # EventType.DAILY_TOTALS
     # !!!!! Shift 0x0B (Header) !!!!!
     # Data:
@@ -3602,12 +3748,12 @@ class DailyTotalsEvent(NGPHistoryEvent):
 
     @property
     def encoded_datetime(self):
-        return BinaryDataDecoder.read_uint64be(self.event_data, 0x0B)
+        return BinaryDataDecoder.read_uint64be(self._buffer, self._pos + 0x0B)
 
     @property
     def date(self):
         date_time_data = self.encoded_datetime
-        return DateTimeHelper.decode_date_time(date_time_data)
+        return self.decode_date_time(date_time_data)
 
     @property
     def offset(self):
@@ -3616,67 +3762,67 @@ class DailyTotalsEvent(NGPHistoryEvent):
 
     @property
     def duration(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x13)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x13)
 
     @property
     def meter_bg_count(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x15)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x15)
 
     @property
     def meter_bg_average(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x16)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x16)
 
     @property
     def low_meter_bg(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x18)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x18)
 
     @property
     def high_meter_bg(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x1A)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x1A)
 
     @property
     def manually_entered_bg_count(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x1C)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x1C)
 
     @property
     def manually_entered_bg_average(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x1D)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x1D)
 
     @property
     def low_manually_entered_bg(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x1F)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x1F)
 
     @property
     def high_manually_entered_bg(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x21)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x21)
 
     @property
     def bg_average(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x23)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x23)
 
     @property
     def total_insulin(self):
-        return BinaryDataDecoder.read_uint32be(self.event_data, 0x25) / 10000.0
+        return BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x25) / 10000.0
 
     @property
     def basal_insulin(self):
-        return BinaryDataDecoder.read_uint32be(self.event_data, 0x29) / 10000.0
+        return BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x29) / 10000.0
 
     @property
     def basal_percent(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x2D)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x2D)
 
     @property
     def bolus_insulin(self):
-        return BinaryDataDecoder.read_uint32be(self.event_data, 0x2E) / 10000.0
+        return BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x2E) / 10000.0
 
     @property
     def bolus_percent(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x32)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x32)
 
     @property
     def carb_units(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x33)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x33)
 
     @property
     def carb_units_name(self):
@@ -3685,138 +3831,139 @@ class DailyTotalsEvent(NGPHistoryEvent):
 
     @property
     def total_food_input(self):
-        total_food_input = BinaryDataDecoder.read_uint16be(self.event_data, 0x34)
+        total_food_input = BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x34)
         return total_food_input if self.carb_units == NGPConstants.CARB_UNITS.GRAMS else total_food_input / 10.0
 
     @property
     def bolus_wizard_usage_count(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x36)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x36)
 
     @property
     def total_bolus_wizard_insulin_as_food_only_bolus(self):
-        return BinaryDataDecoder.read_uint32be(self.event_data, 0x37) / 10000.0
+        return BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x37) / 10000.0
 
     @property
     def total_bolus_wizard_insulin_as_correction_only_bolus(self):
-        return BinaryDataDecoder.read_uint32be(self.event_data, 0x3B) / 10000.0
+        return BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x3B) / 10000.0
 
     @property
     def total_bolus_wizard_insulin_as_food_and_correction(self):
-        return BinaryDataDecoder.read_uint32be(self.event_data, 0x3F) / 10000.0
+        return BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x3F) / 10000.0
 
     @property
     def total_manual_bolus_insulin(self):
-        return BinaryDataDecoder.read_uint32be(self.event_data, 0x43) / 10000.0
+        return BinaryDataDecoder.read_uint32be(self._buffer, self._pos + 0x43) / 10000.0
 
     @property
     def bolus_wizard_food_only_bolus_count(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x47)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x47)
 
     @property
     def bolus_wizard_correction_only_bolus_count(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x48)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x48)
 
     @property
     def bolus_wizard_food_and_correction_bolus_count(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x49)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x49)
 
     @property
     def manual_bolus_count(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x4A)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x4A)
 
     @property
     def sg_count(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x4B)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x4B)
 
     @property
     def sg_average(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x4D)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x4D)
 
     @property
     def sg_stddev(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x4F)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x4F)
 
     @property
     def sg_duration_above_high(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x51)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x51)
 
     @property
     def percent_above_high(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x53)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x53)
 
     @property
     def sg_duration_within_limit(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x54)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x54)
 
     @property
     def percent_within_limit(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x56)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x56)
 
     @property
     def sg_duration_below_low(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x57)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x57)
 
     @property
     def percent_below_low(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x59)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x59)
 
     @property
     def lgs_suspension_duration(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x5A)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x5A)
 
     @property
     def high_predictive_alerts(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x5C)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x5C)
 
     @property
     def low_predictive_alerts(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x5E)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x5E)
 
     @property
     def low_bg_alerts(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x60)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x60)
 
     @property
     def high_bg_alerts(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x62)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x62)
 
     @property
     def rising_rate_alerts(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x64)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x64)
 
     @property
     def falling_rate_alerts(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x66)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x66)
 
     @property
     def low_glucose_suspend_alerts(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x68)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x68)
 
     @property
     def predictive_low_glucose_suspend_alerts(self):
-        return BinaryDataDecoder.read_uint16be(self.event_data, 0x6A)
+        return BinaryDataDecoder.read_uint16be(self._buffer, self._pos + 0x6A)
 
 class SourceIdConfigurationEvent(NGPHistoryEvent):
-    def __init__(self, event_data):
-        NGPHistoryEvent.__init__(self, event_data)
+    __slots__ = ()
+    def __init__(self, event_data, pos=0):
+        NGPHistoryEvent.__init__(self, event_data, pos)
 
     def __str__(self):
         return '{0} Count:{1}, DeviceList:{2}'.format(NGPHistoryEvent.__shortstr__(self), self.number_of_segments, self.device_list)
 
     @property
     def number_of_segments(self):
-        return BinaryDataDecoder.read_byte(self.event_data, 0x0B)
+        return BinaryDataDecoder.read_byte(self._buffer, self._pos + 0x0B)
 
     @property
     def device_list(self):
         segments = {}
         pos = 0x0C
         for i in range(self.number_of_segments):
-            number = BinaryDataDecoder.read_byte(self.event_data, pos)
+            number = BinaryDataDecoder.read_byte(self._buffer, self._pos + pos)
             sn = (self.event_data[pos + 0x01: pos + 0x0B]).decode('utf-8')[::-1]
             device = self.event_data[pos + 0x13: pos + 0x1B]
-            ver_major = BinaryDataDecoder.read_byte(self.event_data, pos + 0x1B)
-            ver_minor = BinaryDataDecoder.read_byte(self.event_data, pos + 0x1C)
+            ver_major = BinaryDataDecoder.read_byte(self._buffer, self._pos + pos + 0x1B)
+            ver_minor = BinaryDataDecoder.read_byte(self._buffer, self._pos + pos + 0x1C)
             revision = (self.event_data[pos + 0x1D: pos + 0x1E])
 
             if revision[0] == 0:
@@ -3844,13 +3991,274 @@ class SourceIdConfigurationEvent(NGPHistoryEvent):
         return segments
 
 class StartOfDayMarkerEvent(NGPHistoryEvent):
+    __slots__ = ()
     def __str__(self):
         return '{0}'.format(NGPHistoryEvent.__shortstr__(self))
 
 class EndOfDayMarkerEvent(NGPHistoryEvent):
+    __slots__ = ()
     def __str__(self):
         return '{0}'.format(NGPHistoryEvent.__shortstr__(self))
 
+# Decoders for NGPHistoryEvent.event_instance(). One dict lookup instead of comparing against every event type.
+NGPHistoryEvent.EVENT_DECODERS.update({
+    NGPHistoryEvent.EVENT_TYPE.BG_READING: BloodGlucoseReadingEvent,
+    NGPHistoryEvent.EVENT_TYPE.NORMAL_BOLUS_DELIVERED: NormalBolusDeliveredEvent,
+    NGPHistoryEvent.EVENT_TYPE.SENSOR_GLUCOSE_READINGS_EXTENDED: SensorGlucoseReadingsEvent,
+    NGPHistoryEvent.EVENT_TYPE.BOLUS_WIZARD_ESTIMATE: BolusWizardEstimateEvent,
+    NGPHistoryEvent.EVENT_TYPE.BASAL_SEGMENT_START: BasalSegmentStartEvent,
+    NGPHistoryEvent.EVENT_TYPE.INSULIN_DELIVERY_STOPPED: InsulinDeliveryStoppedEvent,
+    NGPHistoryEvent.EVENT_TYPE.INSULIN_DELIVERY_RESTARTED: InsulinDeliveryRestartedEvent,
+    NGPHistoryEvent.EVENT_TYPE.PLGM_CONTROLLER_STATE: PLGMControllerStateEvent,
+    NGPHistoryEvent.EVENT_TYPE.CALIBRATION_COMPLETE: CalibrationCompleteEvent,
+    NGPHistoryEvent.EVENT_TYPE.ALARM_NOTIFICATION: AlarmNotificationEvent,
+    NGPHistoryEvent.EVENT_TYPE.ALARM_CLEARED: AlarmClearedEvent,
+    NGPHistoryEvent.EVENT_TYPE.SENSOR_ALERT_SILENCE_STARTED: SensorAlertSilenceStartedEvent,
+    NGPHistoryEvent.EVENT_TYPE.SENSOR_ALERT_SILENCE_ENDED: SensorAlertSilenceEndedEvent,
+    NGPHistoryEvent.EVENT_TYPE.CALIBRATION_REMINDER_CHANGE: CalibrationReminderChangeEvent,
+    NGPHistoryEvent.EVENT_TYPE.DAILY_TOTALS: DailyTotalsEvent,
+    NGPHistoryEvent.EVENT_TYPE.START_OF_DAY_MARKER: StartOfDayMarkerEvent,
+    NGPHistoryEvent.EVENT_TYPE.END_OF_DAY_MARKER: EndOfDayMarkerEvent,
+    NGPHistoryEvent.EVENT_TYPE.SOURCE_ID_CONFIGURATION: SourceIdConfigurationEvent,
+    NGPHistoryEvent.EVENT_TYPE.NORMAL_BOLUS_PROGRAMMED: NormalBolusProgrammedEvent,
+    NGPHistoryEvent.EVENT_TYPE.NETWORK_DEVICE_CONNECTION: NetworkDeviceConnectionEvent,
+    NGPHistoryEvent.EVENT_TYPE.BASAL_PATTERN_SELECTED: BasalPatternSelectedEvent,
+    NGPHistoryEvent.EVENT_TYPE.TEMP_BASAL_COMPLETE: TempBasalCompleteEvent,
+    NGPHistoryEvent.EVENT_TYPE.CANNULA_FILL_DELIVERED: CannulaFillDeliveredEvent,
+    NGPHistoryEvent.EVENT_TYPE.DUAL_BOLUS_PROGRAMMED: DualBolusProgrammedEvent,
+    NGPHistoryEvent.EVENT_TYPE.TEMP_BASAL_PROGRAMMED: TempBasalProgrammedEvent,
+    NGPHistoryEvent.EVENT_TYPE.DUAL_BOLUS_PART_DELIVERED: DualBolusPartDeliveredEvent,
+    NGPHistoryEvent.EVENT_TYPE.SQUARE_BOLUS_PROGRAMMED: SquareBolusProgrammedEvent,
+    NGPHistoryEvent.EVENT_TYPE.SQUARE_BOLUS_DELIVERED: SquareBolusDeliveredEvent,
+    NGPHistoryEvent.EVENT_TYPE.OLD_BASAL_PATTERN: OldBasalPatternEvent,
+    NGPHistoryEvent.EVENT_TYPE.NEW_BASAL_PATTERN: NewBasalPatternEvent,
+    NGPHistoryEvent.EVENT_TYPE.LOW_RESERVOIR: LowReservoirEvent,
+    NGPHistoryEvent.EVENT_TYPE.DISPLAY_OPTION_CHANGE: DisplayOptionChangeEvent,
+    NGPHistoryEvent.EVENT_TYPE.AIRPLANE_MODE: AirplaneModeEvent,
+    NGPHistoryEvent.EVENT_TYPE.TIME_RESET: TimeResetEvent,
+    NGPHistoryEvent.EVENT_TYPE.USER_TIME_DATE_CHANGE: UserTimeDateChangeEvent,
+    NGPHistoryEvent.EVENT_TYPE.AUDIO_VIBRATE_MODE_CHANGE: AudioVibrateModeChangeEvent,
+    NGPHistoryEvent.EVENT_TYPE.EXERCISE_EVENT_MARKER: ExerciseEventMarkerEvent,
+    NGPHistoryEvent.EVENT_TYPE.INJECTION_EVENT_MARKER: InjectionEventMarkerEvent,
+    NGPHistoryEvent.EVENT_TYPE.FOOD_EVENT_MARKER: FoodEventMarkerEvent,
+    NGPHistoryEvent.EVENT_TYPE.OTHER_EVENT_MARKER: OtherEventMarkerEvent,
+    NGPHistoryEvent.EVENT_TYPE.SET_CHANGE_REMINDER_CHANGE: SetChangeReminderChangeEvent,
+    NGPHistoryEvent.EVENT_TYPE.BG_REMINDER_OPTION_CHANGE: BGReminderChangeEvent,
+    NGPHistoryEvent.EVENT_TYPE.LOW_RESERVOIR_REMINDER_CHANGE: LowReservoirReminderChangeEvent,
+    NGPHistoryEvent.EVENT_TYPE.PERSONAL_REMINDER_CHANGE: PersonalReminderChangeEvent,
+    NGPHistoryEvent.EVENT_TYPE.MISSED_MEAL_BOLUS_REMINDER_CHANGE: MissedMealBolusReminderChangeEvent,
+    NGPHistoryEvent.EVENT_TYPE.GLUCOSE_SENSOR_CHANGE: GlucoseSensorChangeEvent,
+    NGPHistoryEvent.EVENT_TYPE.BATTERY_INSERTED: BatteryInsertedEvent,
+    NGPHistoryEvent.EVENT_TYPE.BATTERY_REMOVED: BatteryRemovedEvent,
+    NGPHistoryEvent.EVENT_TYPE.MISSED_MEAL_BOLUS_REMINDER_EXPIRED: MissedMealBolusReminderExpiredEvent,
+    NGPHistoryEvent.EVENT_TYPE.SENSOR_CALIBRATION_REJECTED: SensorCalibrationRejectedEvent,
+    NGPHistoryEvent.EVENT_TYPE.SELF_TEST_REQUESTED: SelfTestRequestedEvent,
+    NGPHistoryEvent.EVENT_TYPE.SELF_TEST_RESULTS: SelfTestResultsEvent,
+    NGPHistoryEvent.EVENT_TYPE.REWIND: RewindEvent,
+    NGPHistoryEvent.EVENT_TYPE.USER_SETTINGS_RESET_TO_DEFAULTS: UserSettingsResetToDefaultsEvent,
+    NGPHistoryEvent.EVENT_TYPE.STARTUP_WIZARD_START_END: StartupWizardStartEndEvent,
+    NGPHistoryEvent.EVENT_TYPE.LANGUAGE_CHANGE: LanguageChangeEvent,
+    NGPHistoryEvent.EVENT_TYPE.TIME_FORMAT_CHANGE: TimeFormatChangeEvent,
+    NGPHistoryEvent.EVENT_TYPE.OLD_BOLUS_WIZARD_INSULIN_TO_CARB_RATIOS: OldBolusWizardInsulinToCarbEvent,
+    NGPHistoryEvent.EVENT_TYPE.NEW_BOLUS_WIZARD_INSULIN_TO_CARB_RATIOS: NewBolusWizardInsulinToCarbEvent,
+    NGPHistoryEvent.EVENT_TYPE.OLD_BOLUS_WIZARD_INSULIN_SENSITIVITY: OldBolusWizardInsulinSensitivityEvent,
+    NGPHistoryEvent.EVENT_TYPE.NEW_BOLUS_WIZARD_INSULIN_SENSITIVITY: NewBolusWizardInsulinSensitivityEvent,
+    NGPHistoryEvent.EVENT_TYPE.OLD_BOLUS_WIZARD_BG_TARGETS: OldBolusWizardBgTargetsEvent,
+    NGPHistoryEvent.EVENT_TYPE.NEW_BOLUS_WIZARD_BG_TARGETS: NewBolusWizardBgTargetsEvent,
+    NGPHistoryEvent.EVENT_TYPE.SQUARE_BOLUS_OPTION_CHANGE: SquareBolusOptionChangeEvent,
+    NGPHistoryEvent.EVENT_TYPE.DUAL_BOLUS_OPTION_CHANGE: DualBolusOptionChangeEvent,
+    NGPHistoryEvent.EVENT_TYPE.BOLUS_INCREMENT_CHANGE: BolusIncrementChangeEvent,
+    NGPHistoryEvent.EVENT_TYPE.MAX_BASAL_RATE_CHANGE: MaxBasalRateChangeEvent,
+    NGPHistoryEvent.EVENT_TYPE.MAX_BOLUS_CHANGE: MaxBolusChangeEvent,
+    NGPHistoryEvent.EVENT_TYPE.EASY_BOLUS_OPTION_CHANGE: EasyBolusOptionChangeEvent,
+    NGPHistoryEvent.EVENT_TYPE.AUTO_SUSPEND_CHANGE: AutoSuspendChangeEvent,
+    NGPHistoryEvent.EVENT_TYPE.BOLUS_DELIVERY_RATE_CHANGE: BolusDeliveredRateCangeEvent,
+    NGPHistoryEvent.EVENT_TYPE.OLD_PRESET_TEMP_BASAL: OldPresetTempBasalEvent,
+    NGPHistoryEvent.EVENT_TYPE.NEW_PRESET_TEMP_BASAL: NewPresetTempBasalEvent,
+    NGPHistoryEvent.EVENT_TYPE.OLD_PRESET_BOLUS: OldPresetBolusEvent,
+    NGPHistoryEvent.EVENT_TYPE.NEW_PRESET_BOLUS: NewPresetBolusEvent,
+    NGPHistoryEvent.EVENT_TYPE.BOLUS_CANCELED: BolusCanceledEvent,
+    NGPHistoryEvent.EVENT_TYPE.NEW_HIGH_SENSOR_WARNING_LEVELS: NewHighSensorWarningLevelEvent,
+    NGPHistoryEvent.EVENT_TYPE.OLD_HIGH_SENSOR_WARNING_LEVELS: OldHighSensorWarningLevelEvent,
+    NGPHistoryEvent.EVENT_TYPE.NEW_LOW_SENSOR_WARNING_LEVELS: NewLowSensorWarningLevelEvent,
+    NGPHistoryEvent.EVENT_TYPE.OLD_LOW_SENSOR_WARNING_LEVELS: OldLowSensorWarningLevelEvent,
+    # NGPHistoryEvent.EVENT_TYPE.CLOSED_LOOP_BG_READING: ClosedLoopBloodGlucoseReadingEvent,
+})
+
+class HistoryEventFilter(object):
+    # Which history records decode_events / process_pump_history decode: event types to keep ('event_types',
+    # None: all) or to drop ('exclude_event_types') and a time window ('start_date', 'end_date': datetimes or None).
+    # A record is checked on its type/size prefix and header time, before any event object is built.
+    # Nested events (sensor readings) go with their record type; a SENSOR_GLUCOSE_READINGS_EXTENDED record is decoded
+    # if the time range of its readings overlaps the window, accepts() then checks the time of every reading.
+
+    # Events that post_process links with, per event type. process_pump_history decodes them as well
+    # (in a wider time window) and drops them again after post_process.
+    CORRELATION_DEPENDENCIES = {
+        NGPHistoryEvent.EVENT_TYPE.NORMAL_BOLUS_DELIVERED: (NGPHistoryEvent.EVENT_TYPE.NORMAL_BOLUS_PROGRAMMED,
+                                                            NGPHistoryEvent.EVENT_TYPE.BOLUS_CANCELED),
+        NGPHistoryEvent.EVENT_TYPE.DUAL_BOLUS_PART_DELIVERED: (NGPHistoryEvent.EVENT_TYPE.DUAL_BOLUS_PROGRAMMED,
+                                                               NGPHistoryEvent.EVENT_TYPE.BOLUS_CANCELED),
+        NGPHistoryEvent.EVENT_TYPE.SQUARE_BOLUS_DELIVERED: (NGPHistoryEvent.EVENT_TYPE.SQUARE_BOLUS_PROGRAMMED,
+                                                            NGPHistoryEvent.EVENT_TYPE.BOLUS_CANCELED),
+        NGPHistoryEvent.EVENT_TYPE.NORMAL_BOLUS_PROGRAMMED: (NGPHistoryEvent.EVENT_TYPE.BOLUS_WIZARD_ESTIMATE,),
+        NGPHistoryEvent.EVENT_TYPE.DUAL_BOLUS_PROGRAMMED: (NGPHistoryEvent.EVENT_TYPE.BOLUS_WIZARD_ESTIMATE,),
+        NGPHistoryEvent.EVENT_TYPE.SQUARE_BOLUS_PROGRAMMED: (NGPHistoryEvent.EVENT_TYPE.BOLUS_WIZARD_ESTIMATE,),
+        # BolusWizardEstimateEvent.programmed is set by the programmed events
+        NGPHistoryEvent.EVENT_TYPE.BOLUS_WIZARD_ESTIMATE: (NGPHistoryEvent.EVENT_TYPE.NORMAL_BOLUS_PROGRAMMED,
+                                                           NGPHistoryEvent.EVENT_TYPE.DUAL_BOLUS_PROGRAMMED,
+                                                           NGPHistoryEvent.EVENT_TYPE.SQUARE_BOLUS_PROGRAMMED),
+    }
+    # How far (seconds) linked events can be: a dual/square bolus is delivered up to 8 hours + 1 minute
+    # after it was programmed, a wizard estimate is programmed up to 5 minutes later
+    CORRELATION_BEFORE = 8 * 60 * 60 + 60
+    CORRELATION_AFTER = 5 * 60
+
+    # rtc, offset of the event header
+    HEADER_TIME = struct.Struct('>II')
+    # minutes between readings, number of readings of a SENSOR_GLUCOSE_READINGS_EXTENDED record
+    SENSOR_READINGS = struct.Struct('>BB')
+
+    def __init__(self, event_types=None, exclude_event_types=None, start_date=None, end_date=None):
+        self.event_types = None if event_types is None else frozenset(event_types)
+        self.exclude_event_types = frozenset(exclude_event_types or ())
+
+        # The window in pump time (rtc + offset), see DateTimeHelper.decode_date_time
+        offset_from_utc = int((datetime.datetime.utcnow() - datetime.datetime.now()).total_seconds())
+        self.start = None if start_date is None else int(start_date.timestamp()) - DateTimeHelper.baseTime - offset_from_utc
+        self.end = None if end_date is None or end_date == datetime.datetime.max else \
+            int(end_date.timestamp()) - DateTimeHelper.baseTime - offset_from_utc
+
+        wanted = set(self.event_types if self.event_types is not None else HistoryEventFilter.CORRELATION_DEPENDENCIES)
+        wanted -= self.exclude_event_types
+        # Links are chained (delivered -> programmed -> wizard estimate): the window is widened once per link
+        # of the longest chain, until no more dependencies are pulled in
+        self.correlation_depth = max([HistoryEventFilter.dependency_depth(x, frozenset([x])) for x in wanted] or [0])
+        dependencies = set()
+        while wanted:
+            for event_type in HistoryEventFilter.CORRELATION_DEPENDENCIES.get(wanted.pop(), ()):
+                if event_type not in dependencies:
+                    dependencies.add(event_type)
+                    wanted.add(event_type)
+        # Accepted types stay in: their records before 'start' (after 'end') still link to the window
+        self.dependencies = frozenset(dependencies)
+
+    @staticmethod
+    def dependency_depth(event_type, visited):
+        # Links of the longest dependency chain from 'event_type' (each type once)
+        return max([1 + HistoryEventFilter.dependency_depth(x, visited | frozenset([x]))
+                    for x in HistoryEventFilter.CORRELATION_DEPENDENCIES.get(event_type, ()) if x not in visited] or [0])
+
+    def correlation_window(self):
+        # (start, end) in which the dependencies are decoded
+        start = None if self.start is None else self.start - self.correlation_depth * HistoryEventFilter.CORRELATION_BEFORE
+        end = None if self.end is None else self.end + self.correlation_depth * HistoryEventFilter.CORRELATION_AFTER
+        return start, end
+
+    @staticmethod
+    def record_times(page, pos):
+        # (first, last) pump time of the events of the record at 'pos' of 'page': the time range of the
+        # readings of a SENSOR_GLUCOSE_READINGS_EXTENDED record, the header time of any other record
+        rtc, offset = HistoryEventFilter.HEADER_TIME.unpack_from(page, pos + 3)
+        last = rtc + offset - 0x100000000
+        if page[pos] != NGPHistoryEvent.EVENT_TYPE.SENSOR_GLUCOSE_READINGS_EXTENDED:
+            return last, last
+        minutes_between_readings, number_of_readings = HistoryEventFilter.SENSOR_READINGS.unpack_from(page, pos + 0x0B)
+        return last - max(number_of_readings - 1, 0) * minutes_between_readings * 60, last
+
+    def accepts_type(self, event_type):
+        return event_type not in self.exclude_event_types and (self.event_types is None or event_type in self.event_types)
+
+    @staticmethod
+    def in_window(pump_time, start, end):
+        return (start is None or pump_time >= start) and (end is None or pump_time <= end)
+
+    def decodes(self, page, pos, correlation=False):
+        # Decode the record at 'pos' of 'page'? With 'correlation' also the records post_process needs
+        # (accepts() drops the dependencies outside the window again)
+        event_type = page[pos]
+        if correlation and event_type in self.dependencies:
+            start, end = self.correlation_window()
+        elif self.accepts_type(event_type):
+            start, end = self.start, self.end
+        else:
+            return False
+        if start is None and end is None:
+            return True
+        first, last = HistoryEventFilter.record_times(page, pos)
+        return (start is None or last >= start) and (end is None or first <= end)
+
+    def accepts(self, event):
+        # Same test as decodes() (without dependencies), on a decoded event
+        return self.accepts_type(event._event_type) and \
+               HistoryEventFilter.in_window(event._rtc + event._offset, self.start, self.end)
+
+class HistoryEventIndex(object):
+    # Correlation stage for NGPHistoryEvent.post_process.
+    # Events are indexed by class (every class they are an instance of) and by class + bolus number,
+    # sorted by timestamp, so a post_process lookup is a bisect inside its time window
+    # instead of a scan of the whole history.
+    # Events can be added segment by segment. post_process only links an event to earlier (or simultaneous)
+    # events, so an event is post processed as soon as a later event has been added, the rest in finish().
+    # This needs the segments in time order (oldest first), otherwise add them all before finish().
+    def __init__(self):
+        self.history_events = []
+        self._timestamps = {}
+        self._events = {}
+        self._pending = collections.deque()
+        self._newest = None
+
+    def _insert(self, key, timestamp, event):
+        timestamps = self._timestamps.get(key)
+        if timestamps is None:
+            self._timestamps[key] = [timestamp]
+            self._events[key] = [event]
+        elif timestamp >= timestamps[-1]:
+            timestamps.append(timestamp)
+            self._events[key].append(event)
+        else:
+            pos = bisect.bisect_right(timestamps, timestamp)
+            timestamps.insert(pos, timestamp)
+            self._events[key].insert(pos, event)
+
+    def add(self, history_events, post_process=True):
+        for event in history_events:
+            timestamp = event.timestamp
+            bolus_number = getattr(event, 'bolus_number', None)
+            for event_class in type(event).__mro__:
+                if event_class is NGPHistoryEvent:
+                    break
+                self._insert(event_class, timestamp, event)
+                if bolus_number is not None:
+                    self._insert((event_class, bolus_number), timestamp, event)
+            if self._newest is None or timestamp > self._newest:
+                self._newest = timestamp
+            self.history_events.append(event)
+            self._pending.append(event)
+        if post_process:
+            self._post_process(False)
+
+    def finish(self, sort=False):
+        # All events, post processed. sort: in time order instead of history order (a stable sort: history order
+        # is time order except around pump time changes, so it is close to linear)
+        self._post_process(True)
+        if sort:
+            self.history_events.sort(key=operator.attrgetter('timestamp'))
+        return self.history_events
+
+    def _post_process(self, finish):
+        # In history order, like the old full scan did (BolusWizardEstimateEvent.programmed depends on it)
+        while self._pending and (finish or self._pending[0].timestamp < self._newest):
+            self._pending.popleft().post_process(self)
+
+    def find(self, event_class, start, end, bolus_number=None):
+        # Events of 'event_class' with start <= timestamp <= end (and 'bolus_number', if given)
+        key = event_class if bolus_number is None else (event_class, bolus_number)
+        timestamps = self._timestamps.get(key)
+        if timestamps is None:
+            return []
+        return self._events[key][bisect.bisect_left(timestamps, start):bisect.bisect_right(timestamps, end)]
+
 ################# HISTORY ######################
 
 asciiKey= {
@@ -4003,6 +4411,69 @@ class DateTimeHelper(object):
         # print ' ### DateTimeHelper.rtcFromDate rtc:0x{0:x} {0} offset:0x{1:x} {1} epoch_time:0x{2:x} {2}'.format(rtc, offset, epoch_time)
         return rtc
 
+    @staticmethod
+    def date_from_rtc(rtc, offset):
+        # Inverse of rtc_from_date
+        return DateTimeHelper.epoch + timedelta(seconds=rtc + offset + DateTimeHelper.baseTime)
+
+class TimestampEngine(object):
+    # Same conversion as DateTimeHelper.decode_date_time, but for a whole decode run:
+    # the local UTC offset and timezone are looked up once, and the result for every rtc + offset is memoized
+    # (a history has a lot of events with the same timestamp).
+    # With raw_epoch=True decode() and decode_many() return epoch seconds (int) instead of datetimes.
+    def __init__(self, raw_epoch=False):
+        self.raw_epoch = raw_epoch
+        self.offset_from_utc = int((datetime.datetime.utcnow() - datetime.datetime.now()).total_seconds())
+        self.local_tz = tz.tzlocal()
+        self.base_time = DateTimeHelper.baseTime + self.offset_from_utc
+        self._date_times = {}
+
+    @staticmethod
+    def split_date_time(pump_date_time):
+        # 64 bit pump value -> (rtc, offset)
+        return (pump_date_time >> 32) & 0xffffffff, DateTimeHelper.decode_date_time_offset(pump_date_time)
+
+    def epoch_time(self, rtc, offset):
+        epoch_time = self.base_time + rtc + offset
+        return epoch_time if epoch_time > 0 else 0
+
+    def decode_date_time(self, rtc, offset=None):
+        if offset is None:
+            rtc, offset = TimestampEngine.split_date_time(rtc)
+        return self.date_time(self.epoch_time(rtc, offset))
+
+    def date_time(self, epoch_time):
+        result = self._date_times.get(epoch_time)
+        if result is None:
+            result = datetime.datetime.fromtimestamp(epoch_time, self.local_tz)
+            self._date_times[epoch_time] = result
+        return result
+
+    def decode(self, rtc, offset=None):
+        if not self.raw_epoch:
+            return self.decode_date_time(rtc, offset)
+        if offset is None:
+            rtc, offset = TimestampEngine.split_date_time(rtc)
+        return self.epoch_time(rtc, offset)
+
+    def epoch_times(self, rtcs, offsets):
+        # rtcs: sequence of rtc values, offsets: one offset for all of them or a sequence of the same length.
+        # Returns a numpy int64 array when numpy is installed, a list otherwise.
+        if numpy is not None:
+            result = numpy.asarray(rtcs, dtype=numpy.int64) + numpy.asarray(offsets, dtype=numpy.int64) + self.base_time
+            return numpy.maximum(result, 0)
+        if isinstance(offsets, int):
+            return [self.epoch_time(rtc, offsets) for rtc in rtcs]
+        return [self.epoch_time(rtc, offset) for rtc, offset in zip(rtcs, offsets)]
+
+    def decode_many(self, rtcs, offsets):
+        epoch_times = self.epoch_times(rtcs, offsets)
+        if self.raw_epoch:
+            return epoch_times
+        if numpy is not None:
+            epoch_times = epoch_times.tolist()
+        return [self.date_time(epoch_time) for epoch_time in epoch_times]
+
 class NumberHelper(object):
     @staticmethod
     def make_32bit_int_from_nbit_signed_int(signed_value, n_bits):
@@ -4010,21 +4481,736 @@ class NumberHelper(object):
         return (sign | signed_value) & 0xFFFFFFFF
 
 class BinaryDataDecoder(object):
+    UINT64BE = struct.Struct('>Q')
+    UINT32BE = struct.Struct('>I')
+    UINT16BE = struct.Struct('>H')
+    BYTE = struct.Struct('>B')
+
+    # unpack_from: no slice copy, works on bytes and memoryviews
     @staticmethod
     def read_uint64be(bin_data, offset):
-        return struct.unpack('>Q', bin_data[offset:offset + 8])[0]
+        return BinaryDataDecoder.UINT64BE.unpack_from(bin_data, offset)[0]
 
     @staticmethod
     def read_uint32be(bin_data, offset):
-        return struct.unpack('>I', bin_data[offset:offset + 4])[0]
+        return BinaryDataDecoder.UINT32BE.unpack_from(bin_data, offset)[0]
 
     @staticmethod
     def read_uint16be(bin_data, offset):
-        return struct.unpack('>H', bin_data[offset:offset + 2])[0]
+        return BinaryDataDecoder.UINT16BE.unpack_from(bin_data, offset)[0]
 
     @staticmethod
     def read_byte(bin_data, offset):
-        return struct.unpack('>B', bin_data[offset:offset + 1])[0]
+        return BinaryDataDecoder.BYTE.unpack_from(bin_data, offset)[0]
+
+class HistoryChunkPlan( object ):
+    # Splits a history request into time chunks that each take about 'target_seconds' to transfer, newest chunk first
+    # (recent data is usable right away). The size comes from the ReadHistoryInfo length of the range (bytes of
+    # history per second of pump time) and the measured transfer rate, which is updated after every chunk.
+    # The whole range is complete only when every chunk was received.
+    TARGET_SECONDS = 20
+    INITIAL_BYTES_PER_SECOND = 2048.0
+    MIN_CHUNK_S = 30 * 60
+    MAX_CHUNK_S = 10 * 24 * 60 * 60 # a single history request can't go further
+    # Weight of the last chunk in the transfer rate
+    RATE_SMOOTHING = 0.5
+
+    def __init__(self, date_start, date_end, history_length, target_seconds=TARGET_SECONDS, bytes_per_second=None, now=None):
+        self.date_start = date_start
+        self.date_end = date_end
+        self.target_seconds = target_seconds
+        self.bytes_per_second = bytes_per_second or HistoryChunkPlan.INITIAL_BYTES_PER_SECOND
+        # datetime.max: up to now
+        self.newest = min(date_end, now or datetime.datetime.now())
+        span = (self.newest - date_start).total_seconds()
+        self.density = history_length / span if span > 0 else 0.0
+        # (start, end) of every chunk handed out, newest first
+        self.chunks = []
+        self.completed = []
+        self.failed = []
+        self._next_end = date_end
+
+    def chunk_seconds(self):
+        if self.density <= 0:
+            return HistoryChunkPlan.MAX_CHUNK_S
+        seconds = self.target_seconds * self.bytes_per_second / self.density
+        return min(max(seconds, HistoryChunkPlan.MIN_CHUNK_S), HistoryChunkPlan.MAX_CHUNK_S)
+
+    def next_chunk(self):
+        # (start, end) of the next older chunk, None when the range is covered
+        if self._next_end < self.date_start:
+            return None
+        end = self._next_end
+        start = max(self.date_start, min(end, self.newest) - timedelta(seconds=self.chunk_seconds()))
+        # Request times are whole seconds, both ends included
+        self._next_end = start - timedelta(seconds=1)
+        self.chunks.append((start, end))
+        return start, end
+
+    def chunk_done(self, chunk, elapsed):
+        # 'elapsed': seconds the transfer of 'chunk' took
+        self.completed.append(chunk)
+        history_bytes = self.density * (min(chunk[1], self.newest) - chunk[0]).total_seconds()
+        if elapsed > 0 and history_bytes > 0:
+            rate = history_bytes / elapsed
+            self.bytes_per_second += HistoryChunkPlan.RATE_SMOOTHING * (rate - self.bytes_per_second)
+
+    def chunk_failed(self, chunk):
+        self.failed.append(chunk)
+
+    @property
+    def complete(self):
+        return self._next_end < self.date_start and not self.failed and len(self.completed) == len(self.chunks)
+
+    def __str__(self):
+        return "Chunks:{0}, Completed:{1}, Failed:{2}, Complete:{3}, {4:.0f} bytes/s".format(
+            len(self.chunks), len(self.completed), len(self.failed), self.complete, self.bytes_per_second)
+
+class SensorGapDetector( object ):
+    # Finds the missing sensor readings of a local SG series: missing 5 minute slots between two readings and
+    # SENSOR_GLUCOSE_GAP events. Gaps closer than 'merge_seconds' are merged, so the backfill requests
+    # a few rtc windows instead of the whole day.
+    # Readings and gap events: anything with an 'rtc' (SensorGlucoseReading, NGPHistoryEvent, StoredHistoryEvent).
+    READING_INTERVAL_S = 5 * 60
+    # A reading later than that after the previous one leaves a gap
+    MAX_READING_DELAY_S = READING_INTERVAL_S * 3 // 2
+    MERGE_S = 30 * 60
+    # A SENSOR_GLUCOSE_READINGS_EXTENDED record has the readings before its rtc: the records of a gap can be up to
+    # that much later than the gap
+    RECORD_SPAN_S = 60 * 60
+
+    def __init__(self, merge_seconds=MERGE_S):
+        self.merge_seconds = merge_seconds
+
+    def gaps(self, readings, gap_events=()):
+        # (from_rtc, to_rtc) of every gap, not merged
+        rtcs = sorted(set(x.rtc for x in readings))
+        gaps = [(previous + 1, rtc - 1) for previous, rtc in zip(rtcs, rtcs[1:])
+                if rtc - previous > SensorGapDetector.MAX_READING_DELAY_S]
+        # A gap event covers the reading slot before it
+        gaps += [(x.rtc - SensorGapDetector.READING_INTERVAL_S, x.rtc) for x in gap_events]
+        return sorted(gaps)
+
+    def windows(self, readings, gap_events=(), tried=()):
+        # Gaps merged into the smallest set of rtc windows to request. tried: (from_rtc, to_rtc) windows requested
+        # before, the gaps inside one of them are left out (the pump had nothing for them)
+        windows = []
+        for from_rtc, to_rtc in self.gaps(readings, gap_events):
+            if any(first <= from_rtc and to_rtc <= last for first, last in tried):
+                continue
+            if windows and from_rtc - windows[-1][1] <= self.merge_seconds:
+                windows[-1] = (windows[-1][0], max(windows[-1][1], to_rtc))
+            else:
+                windows.append((from_rtc, to_rtc))
+        return windows
+
+class PumpSettingsCache( object ):
+    # Pump settings (basal patterns, bolus wizard carb ratios, BG targets, sensitivity) per pump serial.
+    # They rarely change: an entry is used until its TTL expires or the history has a change event for it
+    # (apply_history). Medtronic600SeriesDriver.get_pump_settings reads the stale ones again.
+    BASAL_PATTERNS = 'basal_patterns'
+    CARB_RATIOS = 'carb_ratios'
+    BG_TARGETS = 'bg_targets'
+    SENSITIVITY = 'sensitivity'
+    ALL = (BASAL_PATTERNS, CARB_RATIOS, BG_TARGETS, SENSITIVITY)
+    BOLUS_WIZARD = (CARB_RATIOS, BG_TARGETS, SENSITIVITY)
+
+    INVALIDATED_BY = {
+        NGPHistoryEvent.EVENT_TYPE.NEW_BASAL_PATTERN: (BASAL_PATTERNS,),
+        NGPHistoryEvent.EVENT_TYPE.BASAL_PATTERN_SELECTED: (BASAL_PATTERNS,),
+        NGPHistoryEvent.EVENT_TYPE.NEW_BOLUS_WIZARD_INSULIN_TO_CARB_RATIOS: (CARB_RATIOS,),
+        NGPHistoryEvent.EVENT_TYPE.NEW_BOLUS_WIZARD_BG_TARGETS: (BG_TARGETS,),
+        NGPHistoryEvent.EVENT_TYPE.NEW_BOLUS_WIZARD_INSULIN_SENSITIVITY: (SENSITIVITY,),
+        NGPHistoryEvent.EVENT_TYPE.BOLUS_WIZARD_SETTINGS_CHANGE: BOLUS_WIZARD,
+        NGPHistoryEvent.EVENT_TYPE.USER_SETTINGS_RESET_TO_DEFAULTS: ALL,
+    }
+
+    TTL_S = 24 * 60 * 60
+    # Pump and computer clocks differ: a change event up to that long before a read invalidates it too
+    CLOCK_MARGIN_S = 15 * 60
+
+    def __init__(self, path = 'read_minimed.sqlite3', ttl = TTL_S):
+        self.ttl = ttl
+        self.conn = sqlite3.connect( path, check_same_thread=False )
+        self.c = self.conn.cursor()
+        self.c.execute( '''CREATE TABLE IF NOT EXISTS pump_settings ( pump_serial INTEGER, name TEXT, fetched REAL, data TEXT,
+                           PRIMARY KEY ( pump_serial, name ) )''' )
+        self.conn.commit()
+
+    def get(self, pump_serial, name):
+        # The cached value, None if there is none or it expired
+        self.c.execute( 'SELECT fetched, data FROM pump_settings WHERE pump_serial = ? AND name = ?', (pump_serial, name) )
+        row = self.c.fetchone()
+        if row is None or time.time() - row[0] > self.ttl:
+            return None
+        return json.loads(row[1])
+
+    def put(self, pump_serial, name, value):
+        self.c.execute( 'INSERT OR REPLACE INTO pump_settings VALUES ( ?, ?, ?, ? )', (pump_serial, name, time.time(), json.dumps(value)) )
+        self.conn.commit()
+
+    def invalidate(self, pump_serial, names = ALL):
+        self.c.executemany( 'DELETE FROM pump_settings WHERE pump_serial = ? AND name = ?', [(pump_serial, name) for name in names] )
+        self.conn.commit()
+
+    def stale(self, pump_serial, names = ALL):
+        return [name for name in names if self.get(pump_serial, name) is None]
+
+    def apply_history(self, pump_serial, history_events):
+        # Drops the entries read before a change event of 'history_events' (decoded or stored events)
+        self.c.execute( 'SELECT name, fetched FROM pump_settings WHERE pump_serial = ?', (pump_serial,) )
+        fetched = dict(self.c.fetchall())
+        invalid = set()
+        for event in history_events:
+            for name in PumpSettingsCache.INVALIDATED_BY.get(event.event_type, ()):
+                if name in fetched and event.timestamp.timestamp() > fetched[name] - PumpSettingsCache.CLOCK_MARGIN_S:
+                    invalid.add(name)
+        if invalid:
+            logger.info("# Pump settings changed: {0}".format(sorted(invalid)))
+            self.invalidate(pump_serial, invalid)
+        return invalid
+
+class HistorySyncState( object ):
+    # Incremental history sync: per pump serial and history type the rtc of the newest decoded record
+    # (the high-water mark) and the fingerprints of the records near it, to drop them when the next sync overlaps.
+    # Also the sensor gap windows backfill_sensor_gaps has requested: a gap the pump can't fill (warm-up, no sensor,
+    # SENSOR_GLUCOSE_GAP) is only requested once. They are kept BACKFILL_TTL_S, longer than the backfill looks back.
+    BACKFILL_TTL_S = 2 * 24 * 60 * 60
+
+    def __init__(self, path = 'read_minimed.sqlite3'):
+        self.conn = sqlite3.connect( path, check_same_thread=False )
+        self.c = self.conn.cursor()
+        self.c.execute( '''CREATE TABLE IF NOT EXISTS history_sync ( pump_serial INTEGER, history_type INTEGER, last_rtc INTEGER,
+                           fingerprints BLOB, PRIMARY KEY ( pump_serial, history_type ) )''' )
+        self.c.execute( '''CREATE TABLE IF NOT EXISTS sensor_backfill ( pump_serial INTEGER, from_rtc INTEGER, to_rtc INTEGER, tried REAL,
+                           PRIMARY KEY ( pump_serial, from_rtc, to_rtc ) )''' )
+        self.conn.commit()
+
+    def load(self, pump_serial, history_type):
+        # (last rtc, set of fingerprints), (None, empty set) before the first sync
+        self.c.execute( 'SELECT last_rtc, fingerprints FROM history_sync WHERE pump_serial = ? AND history_type = ?', (pump_serial, history_type))
+        row = self.c.fetchone()
+        if row is None:
+            return None, set()
+        fingerprints = row[1]
+        return row[0], set(fingerprints[i:i + 20] for i in range(0, len(fingerprints), 20))
+
+    def save(self, pump_serial, history_type, last_rtc, fingerprints):
+        self.c.execute( 'INSERT OR REPLACE INTO history_sync VALUES ( ?, ?, ?, ? )',
+                        (pump_serial, history_type, last_rtc, b''.join(sorted(fingerprints))))
+        self.conn.commit()
+
+    def backfilled_windows(self, pump_serial):
+        # [(from_rtc, to_rtc)] of the sensor gap windows requested in the last BACKFILL_TTL_S
+        self.c.execute( 'DELETE FROM sensor_backfill WHERE tried < ?', (time.time() - HistorySyncState.BACKFILL_TTL_S,) )
+        self.conn.commit()
+        self.c.execute( 'SELECT from_rtc, to_rtc FROM sensor_backfill WHERE pump_serial = ?', (pump_serial,) )
+        return [ tuple(row) for row in self.c.fetchall() ]
+
+    def add_backfilled_window(self, pump_serial, from_rtc, to_rtc):
+        self.c.execute( 'INSERT OR REPLACE INTO sensor_backfill VALUES ( ?, ?, ?, ? )', (pump_serial, from_rtc, to_rtc, time.time()) )
+        self.conn.commit()
+
+class HistoryJournal( object ):
+    # Checkpoints of history downloads, so that an interrupted get_pump_history only requests what is still missing.
+    # Per pump serial, history type and requested rtc range (an entry): the completed segments and the packets
+    # of the segment that was in flight. A download uses the entries of every range that overlaps its own
+    # (the chunks of iter_pump_history_chunked start from 'now', so a retry rarely requests the same range).
+    # Entries older than MAX_AGE_S are dropped: the pump has moved on, a new download is cheaper.
+    MAX_AGE_S = 2 * 24 * 3600
+
+    def __init__(self, path = 'history_journal.sqlite3', max_age = MAX_AGE_S):
+        self.conn = sqlite3.connect( path, check_same_thread=False )
+        self.c = self.conn.cursor()
+        self.c.execute( "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'sessions'" )
+        row = self.c.fetchone()
+        if row is not None and 'created' not in row[0]:
+            # Journals of earlier versions: only in-flight downloads, not worth migrating
+            logger.info("History journal {0}: dropping the entries of an earlier version".format(path))
+            self.c.execute( 'DROP TABLE segments' )
+            self.c.execute( 'DROP TABLE sessions' )
+        self.c.execute( '''CREATE TABLE IF NOT EXISTS segments ( pump_serial INTEGER, history_type INTEGER, from_rtc INTEGER, to_rtc INTEGER,
+                           number INTEGER, data BLOB, created REAL, PRIMARY KEY ( pump_serial, history_type, from_rtc, to_rtc, number ) )''' )
+        self.c.execute( '''CREATE TABLE IF NOT EXISTS sessions ( pump_serial INTEGER, history_type INTEGER, from_rtc INTEGER, to_rtc INTEGER,
+                           session_size INTEGER, packet_size INTEGER, packets_to_fetch INTEGER, segments BLOB, data BLOB, created REAL,
+                           PRIMARY KEY ( pump_serial, history_type, from_rtc, to_rtc ) )''' )
+        self.conn.commit()
+        self.purge(max_age)
+
+    def purge(self, max_age = MAX_AGE_S):
+        # Drops the entries of downloads that didn't complete within max_age seconds
+        created = time.time() - max_age
+        self.c.execute( '''DELETE FROM segments WHERE ( pump_serial, history_type, from_rtc, to_rtc ) IN
+                           ( SELECT pump_serial, history_type, from_rtc, to_rtc FROM segments GROUP BY pump_serial, history_type, from_rtc, to_rtc
+                             HAVING MAX( created ) < ? )''', ( created, ) )
+        self.c.execute( 'DELETE FROM sessions WHERE created < ?', ( created, ) )
+        self.conn.commit()
+
+    def entries(self, pump_serial, history_type, from_rtc, to_rtc):
+        # Keys (pump serial, history type, from rtc, to rtc) of the entries whose range overlaps from_rtc..to_rtc, oldest first
+        self.c.execute( '''SELECT pump_serial, history_type, from_rtc, to_rtc, MIN( created ) FROM
+                           ( SELECT pump_serial, history_type, from_rtc, to_rtc, created FROM segments
+                             UNION ALL SELECT pump_serial, history_type, from_rtc, to_rtc, created FROM sessions )
+                           WHERE pump_serial = ? AND history_type = ? AND from_rtc <= ? AND to_rtc >= ?
+                           GROUP BY pump_serial, history_type, from_rtc, to_rtc ORDER BY MIN( created )''',
+                        ( pump_serial, history_type, to_rtc, from_rtc ) )
+        return [ tuple(row[0:4]) for row in self.c.fetchall() ]
+
+    def segments(self, key):
+        self.c.execute( 'SELECT data FROM segments WHERE pump_serial = ? AND history_type = ? AND from_rtc = ? AND to_rtc = ? ORDER BY number', key )
+        return [ row[0] for row in self.c.fetchall() ]
+
+    def add_segment(self, key, segment):
+        self.c.execute( 'SELECT COUNT(*) FROM segments WHERE pump_serial = ? AND history_type = ? AND from_rtc = ? AND to_rtc = ?', key )
+        number = self.c.fetchone()[0]
+        self.c.execute( 'INSERT INTO segments VALUES ( ?, ?, ?, ?, ?, ?, ? )', key + ( number, bytes(segment), time.time() ) )
+        # The segment is complete now, it isn't in flight any more
+        self.c.execute( 'DELETE FROM sessions WHERE pump_serial = ? AND history_type = ? AND from_rtc = ? AND to_rtc = ?', key )
+        self.conn.commit()
+
+    def save_session(self, key, session):
+        if session is None or session.segments_filled == 0 or session.payload_complete():
+            return
+        self.c.execute( 'INSERT OR REPLACE INTO sessions VALUES ( ?, ?, ?, ?, ?, ?, ?, ?, ?, ? )',
+                        key + ( session.session_size, session.packet_size, session.packets_to_fetch,
+                                bytes(session.segments), bytes(session.response), time.time() ) )
+        self.conn.commit()
+
+    def load_session(self, pump_serial, history_type, from_rtc, to_rtc):
+        # (session_size, packet_size, packets_to_fetch, segments, data) of the newest in-flight segment of an overlapping
+        # entry, None if there is none. MultipacketSession.restore checks it against the packets the pump sends again.
+        self.c.execute( '''SELECT session_size, packet_size, packets_to_fetch, segments, data FROM sessions
+                           WHERE pump_serial = ? AND history_type = ? AND from_rtc <= ? AND to_rtc >= ?
+                           ORDER BY created DESC LIMIT 1''', ( pump_serial, history_type, to_rtc, from_rtc ) )
+        return self.c.fetchone()
+
+    def clear(self, key):
+        self.c.execute( 'DELETE FROM segments WHERE pump_serial = ? AND history_type = ? AND from_rtc = ? AND to_rtc = ?', key )
+        self.c.execute( 'DELETE FROM sessions WHERE pump_serial = ? AND history_type = ? AND from_rtc = ? AND to_rtc = ?', key )
+        self.conn.commit()
+
+ArchivedSegment = collections.namedtuple('ArchivedSegment', ['pump_serial', 'history_type', 'min_rtc', 'max_rtc', 'min_time',
+                                                               'max_time', 'uncompressed_size', 'crc', 'blocks', 'data_pos', 'size'])
+
+class HistoryArchive( object ):
+    # Append-only file of the history segments as received from the pump (still LZO compressed).
+    # File: MAGIC, then per segment
+    # +---------------+----------------------------------------------+---------------------+
+    # | SEGMENT_HEADER | block_count * BLOCK_INDEX (one per 2048 byte | segment             |
+    # |               | block of the uncompressed segment)            | (segment_size bytes) |
+    # +---------------+----------------------------------------------+---------------------+
+    # Times: rtc, and pump time (rtc + offset, like HistoryEventFilter) of the oldest and newest event.
+    # Readers mmap the file and only decompress the segments, and only parse the blocks, that overlap a time range.
+    MAGIC = b'NGPHIST1'
+    SEGMENT_MARKER = b'SEGM'
+    # marker, pump serial, history type, min/max rtc, min/max pump time, segment size, uncompressed size, block count, CCITT of the segment
+    SEGMENT_HEADER = struct.Struct('>4sIBIIiiIIHH')
+    # min/max rtc, min/max pump time
+    BLOCK_INDEX = struct.Struct('>IIii')
+
+    def __init__(self, path = 'history_archive.ngph'):
+        self.path = path
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            with open(path, 'wb') as archive_file:
+                archive_file.write(HistoryArchive.MAGIC)
+        self.file = open(path, 'rb')
+        self.map = None
+        self.index = []
+        # End of the last complete segment
+        self.end = 0
+        self.scan()
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.file.close()
+
+    def remap(self):
+        # (Re)map the whole file, after appends
+        if self.map is not None:
+            self.map.close()
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def scan(self):
+        # Reads the segment headers and block indexes (the segments themselves aren't touched)
+        self.remap()
+        if self.map[0:len(HistoryArchive.MAGIC)] != HistoryArchive.MAGIC:
+            raise InvalidMessageError('Not a history archive: {0}'.format(self.path))
+        self.index = []
+        pos = len(HistoryArchive.MAGIC)
+        while pos + HistoryArchive.SEGMENT_HEADER.size <= len(self.map):
+            marker, pump_serial, history_type, min_rtc, max_rtc, min_time, max_time, size, uncompressed_size, block_count, crc = \
+                HistoryArchive.SEGMENT_HEADER.unpack_from(self.map, pos)
+            data_pos = pos + HistoryArchive.SEGMENT_HEADER.size + block_count * HistoryArchive.BLOCK_INDEX.size
+            if marker != HistoryArchive.SEGMENT_MARKER or data_pos + size > len(self.map):
+                # A torn append: everything before it is still good
+                logger.warning("History archive {0}: incomplete segment at {1}, ignored".format(self.path, pos))
+                break
+            blocks = [HistoryArchive.BLOCK_INDEX.unpack_from(self.map, pos + HistoryArchive.SEGMENT_HEADER.size + i * HistoryArchive.BLOCK_INDEX.size)
+                      for i in range(block_count)]
+            self.index.append(ArchivedSegment(pump_serial, history_type, min_rtc, max_rtc, min_time, max_time,
+                                              uncompressed_size, crc, blocks, data_pos, size))
+            pos = data_pos + size
+        self.end = pos
+
+    @staticmethod
+    def block_times(block):
+        # (min rtc, max rtc, min pump time, max pump time) of the events of a decoded block
+        # (the pump times include the sensor readings, see HistoryEventFilter.record_times)
+        rtcs = []
+        times = []
+        pos = 0
+        while pos < len(block):
+            rtcs.append(HistoryEventFilter.HEADER_TIME.unpack_from(block, pos + 3)[0])
+            times.extend(HistoryEventFilter.record_times(block, pos))
+            pos += block[pos + 2] # event size
+        if not rtcs:
+            return 0, 0, 0, 0
+        return min(rtcs), max(rtcs), min(times), max(times)
+
+    def append(self, pump_serial, history_type, segment):
+        # Adds a segment (as received, see Medtronic600SeriesDriver.iter_pump_history); it is checked and indexed first
+        segment = bytes(segment)
+        decoded_blocks = Medtronic600SeriesDriver.decode_pump_segment(segment, history_type)
+        blocks = [HistoryArchive.block_times(block) for block in decoded_blocks]
+        used = [x for x, block in zip(blocks, decoded_blocks) if len(block)] or [(0, 0, 0, 0)]
+        header = HistoryArchive.SEGMENT_HEADER.pack(HistoryArchive.SEGMENT_MARKER, pump_serial, history_type,
+                                                    min(x[0] for x in used), max(x[1] for x in used),
+                                                    min(x[2] for x in used), max(x[3] for x in used),
+                                                    len(segment), struct.unpack_from('>I', segment, 7)[0], len(blocks),
+                                                    MedtronicMessage.calculate_ccitt(segment))
+        # After the last complete segment: a torn append is overwritten
+        with open(self.path, 'r+b') as archive_file:
+            archive_file.seek(self.end)
+            archive_file.write(header + b''.join(HistoryArchive.BLOCK_INDEX.pack(*x) for x in blocks) + segment)
+            archive_file.truncate()
+        self.scan()
+
+    def segments(self, history_type=None, pump_serial=None, start=None, end=None):
+        # Index entries of the segments with events between start and end (pump time, None: open)
+        return [x for x in self.index
+                if (history_type is None or x.history_type == history_type)
+                and (pump_serial is None or x.pump_serial == pump_serial)
+                and (start is None or x.max_time >= start) and (end is None or x.min_time <= end)]
+
+    def segment_data(self, entry):
+        data = self.map[entry.data_pos:entry.data_pos + entry.size]
+        if MedtronicMessage.calculate_ccitt(data) != entry.crc:
+            raise InvalidMessageError('Unexpected checksum in archived segment')
+        return data
+
+    def read_blocks(self, history_type=HistoryDataType.PUMP_DATA, pump_serial=None, start=None, end=None):
+        # Decoded blocks with events between start and end (pump time), oldest segment first.
+        # Overlapping polls archive the same records again, and the last block of a poll grows until the next one:
+        # each record is returned once. A block with records returned before comes back with only its new records.
+        decoded_blocks = []
+        # fingerprint -> most copies of the record in one block so far
+        seen = collections.Counter()
+        for entry in self.segments(history_type, pump_serial, start, end):
+            wanted = [i for i, (min_rtc, max_rtc, min_time, max_time) in enumerate(entry.blocks)
+                      if (start is None or max_time >= start) and (end is None or min_time <= end)]
+            if not wanted:
+                continue
+            blocks = Medtronic600SeriesDriver.decode_pump_segment(self.segment_data(entry), entry.history_type)
+            for i in wanted:
+                block = bytes(blocks[i])
+                new_block = bytearray()
+                copies = collections.Counter()
+                pos = 0
+                while pos < len(block):
+                    event_size = block[pos + 2]
+                    fingerprint = NGPHistoryEvent.record_fingerprint(block, pos)
+                    copies[fingerprint] += 1
+                    if copies[fingerprint] > seen[fingerprint]:
+                        seen[fingerprint] = copies[fingerprint]
+                        new_block += block[pos:pos + event_size]
+                    pos += event_size
+                if len(new_block) == len(block):
+                    decoded_blocks.append(block)
+                elif new_block:
+                    decoded_blocks.append(bytes(new_block))
+        return decoded_blocks
+
+StoredHistoryEvent = collections.namedtuple('StoredHistoryEvent', ['pump_serial', 'history_type', 'event_type', 'rtc', 'rtc_offset',
+                                                                     'timestamp', 'raw', 'payload'])
+
+class HistoryEventStore( object ):
+    # Decoded history events, queryable by pump, type and time without the radio or re-parsing segments.
+    # One row per event: the raw record, type, rtc, offset, the wall-clock timestamp (epoch seconds) and the
+    # decoded fields as JSON. A sensor reading (GENERATED_SENSOR_GLUCOSE_READINGS_EXTENDED_ITEM) has the raw
+    # record of its SENSOR_GLUCOSE_READINGS_EXTENDED event.
+    BOLUS_DELIVERED_TYPES = (NGPHistoryEvent.EVENT_TYPE.NORMAL_BOLUS_DELIVERED,
+                             NGPHistoryEvent.EVENT_TYPE.SQUARE_BOLUS_DELIVERED,
+                             NGPHistoryEvent.EVENT_TYPE.DUAL_BOLUS_PART_DELIVERED)
+
+    # Fields every event has (own columns) or that are only the raw data again
+    HEADER_FIELDS = frozenset(['event_data', 'eventData', 'source', 'size', 'event_type', 'rtc', 'rtc_offset', 'timestamp',
+                               'fingerprint', 'epoch_time'])
+
+    # Event class -> names of its payload fields
+    payload_fields = {}
+
+    def __init__(self, path = 'history_events.sqlite3'):
+        self.conn = sqlite3.connect( path, check_same_thread=False )
+        self.c = self.conn.cursor()
+        # The retention thread shares the connection
+        self.lock = threading.Lock()
+        # Unique on pump-side values: the timestamp of a record depends on the UTC offset when it was decoded
+        # (a sensor reading has its own rtc, not the one of its record)
+        self.c.execute( '''CREATE TABLE IF NOT EXISTS events ( pump_serial INTEGER, history_type INTEGER, event_type INTEGER,
+                           rtc INTEGER, rtc_offset INTEGER, timestamp REAL, fingerprint BLOB, raw BLOB, payload TEXT,
+                           UNIQUE ( pump_serial, event_type, fingerprint, rtc ) )''' )
+        self.c.execute( "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'events'" )
+        if 'fingerprint, timestamp )' in self.c.fetchone()[0]:
+            # Stores of earlier versions: same columns, keyed on the timestamp
+            logger.info("History event store {0}: rekeying the events on their rtc".format(path))
+            self.c.execute( 'ALTER TABLE events RENAME TO events_old' )
+            self.c.execute( '''CREATE TABLE events ( pump_serial INTEGER, history_type INTEGER, event_type INTEGER,
+                               rtc INTEGER, rtc_offset INTEGER, timestamp REAL, fingerprint BLOB, raw BLOB, payload TEXT,
+                               UNIQUE ( pump_serial, event_type, fingerprint, rtc ) )''' )
+            self.c.execute( 'INSERT OR IGNORE INTO events SELECT * FROM events_old ORDER BY rowid' )
+            self.c.execute( 'DROP TABLE events_old' )
+        self.c.execute( 'CREATE INDEX IF NOT EXISTS events_time ON events ( pump_serial, event_type, timestamp )' )
+        # Decoded blocks of a persistent HistoryBlockCache
+        self.c.execute( '''CREATE TABLE IF NOT EXISTS blocks ( history_type INTEGER, checksum INTEGER, length INTEGER, data BLOB,
+                           PRIMARY KEY ( history_type, checksum, length ) )''' )
+        self.conn.commit()
+        self.retention_thread = None
+        self.retention_stop = threading.Event()
+
+    @staticmethod
+    def event_payload(event):
+        # Decoded fields of the event: its properties and public slots, JSON compatible values
+        # (linked events of post_process are left out)
+        fields = HistoryEventStore.payload_fields.get(type(event))
+        if fields is None:
+            fields = []
+            for event_class in type(event).__mro__:
+                if event_class is NGPHistoryEvent or event_class is object:
+                    continue
+                for name, value in vars(event_class).items():
+                    if name.startswith('_') or name in HistoryEventStore.HEADER_FIELDS or name in fields:
+                        continue
+                    if isinstance(value, property) or name in getattr(event_class, '__slots__', ()):
+                        fields.append(name)
+            HistoryEventStore.payload_fields[type(event)] = fields
+
+        payload = {}
+        for name in fields:
+            try:
+                value = getattr(event, name)
+            except Exception:
+                continue
+            if value is None or isinstance(value, (bool, int, float, str)):
+                payload[name] = value
+            elif isinstance(value, (bytes, bytearray, memoryview)):
+                payload[name] = binascii.hexlify(value).decode()
+            elif isinstance(value, datetime.datetime):
+                payload[name] = value.isoformat()
+            elif isinstance(value, timedelta):
+                payload[name] = value.total_seconds()
+            elif isinstance(value, (list, tuple)):
+                payload[name] = [x if isinstance(x, (bool, int, float, str)) else str(x) for x in value]
+            elif not isinstance(value, NGPHistoryEvent):
+                payload[name] = str(value)
+        return payload
+
+    def add_events(self, pump_serial, history_type, events):
+        # Bulk insert (one transaction), events already in the store are skipped. Returns the number of new rows.
+        rows = [ ( pump_serial, history_type, event.event_type, event.rtc, event.rtc_offset, event.timestamp.timestamp(),
+                   event.fingerprint, event.event_data, json.dumps(HistoryEventStore.event_payload(event)) )
+                 for event in events ]
+        with self.lock:
+            before = self.conn.total_changes
+            self.c.executemany( 'INSERT OR IGNORE INTO events VALUES ( ?, ?, ?, ?, ?, ?, ?, ?, ? )', rows )
+            self.conn.commit()
+            return self.conn.total_changes - before
+
+    def query(self, pump_serial=None, event_types=None, start_date=None, end_date=None, limit=None):
+        # StoredHistoryEvent rows ordered by time; start_date/end_date: datetime (inclusive), event_types: list of EVENT_TYPE
+        where = []
+        args = []
+        if pump_serial is not None:
+            where.append( 'pump_serial = ?' )
+            args.append( pump_serial )
+        if event_types is not None:
+            event_types = list(event_types)
+            where.append( 'event_type IN ( {0} )'.format( ', '.join( '?' * len(event_types) ) ) )
+            args += event_types
+        if start_date is not None:
+            where.append( 'timestamp >= ?' )
+            args.append( start_date.timestamp() )
+        if end_date is not None:
+            where.append( 'timestamp <= ?' )
+            args.append( end_date.timestamp() )
+        sql = 'SELECT * FROM events'
+        if where:
+            sql += ' WHERE ' + ' AND '.join( where )
+        sql += ' ORDER BY timestamp'
+        if limit is not None:
+            sql += ' LIMIT {0:d}'.format( limit )
+
+        timestamps = TimestampEngine()
+        with self.lock:
+            self.c.execute( sql, args )
+            rows = self.c.fetchall()
+        return [ StoredHistoryEvent( row[0], row[1], row[2], row[3], row[4], timestamps.date_time(row[5]), row[7], json.loads(row[8]) )
+                 for row in rows ]
+
+    def boluses(self, pump_serial=None, days=7):
+        # Delivered boluses of the last 'days' days
+        return self.query( pump_serial, HistoryEventStore.BOLUS_DELIVERED_TYPES,
+                           datetime.datetime.now() - timedelta(days=days) )
+
+    def sensor_glucose(self, pump_serial=None, start_date=None, end_date=None):
+        # Sensor readings between start_date and end_date
+        return self.query( pump_serial, [NGPHistoryEvent.EVENT_TYPE.GENERATED_SENSOR_GLUCOSE_READINGS_EXTENDED_ITEM],
+                           start_date, end_date )
+
+    def add_block(self, key, block):
+        # key: (history type, block CCITT, block length)
+        with self.lock:
+            # The newest block of a key (see HistoryBlockCache.get)
+            self.c.execute( 'INSERT OR REPLACE INTO blocks VALUES ( ?, ?, ?, ? )', key + ( bytes(block), ) )
+            self.conn.commit()
+
+    def blocks(self, limit):
+        # (key, block) of the newest 'limit' blocks, oldest first
+        with self.lock:
+            self.c.execute( 'SELECT history_type, checksum, length, data FROM blocks ORDER BY rowid DESC LIMIT ?', ( limit, ) )
+            rows = self.c.fetchall()
+        return [ ( tuple(row[0:3]), row[3] ) for row in reversed(rows) ]
+
+    @staticmethod
+    def decode(stored_event):
+        # The history event of a stored row, parsed from its raw record
+        return NGPHistoryEvent.EVENT_DECODERS.get(stored_event.raw[0], NGPHistoryEvent)(stored_event.raw)
+
+    # Blocks kept for HistoryBlockCache by compact()
+    MAX_BLOCKS = 4096
+
+    def compact(self, max_age=None):
+        # Removes the events older than max_age (timedelta), all but the newest MAX_BLOCKS blocks
+        # and gives the space back to the file system
+        with self.lock:
+            if max_age is not None:
+                self.c.execute( 'DELETE FROM events WHERE timestamp < ?', ( (datetime.datetime.now() - max_age).timestamp(), ) )
+                logger.debug("History store: {0} events removed".format(self.c.rowcount))
+            self.c.execute( 'DELETE FROM blocks WHERE rowid NOT IN ( SELECT rowid FROM blocks ORDER BY rowid DESC LIMIT ? )',
+                            ( HistoryEventStore.MAX_BLOCKS, ) )
+            self.conn.commit()
+            self.c.execute( 'VACUUM' )
+
+    def start_retention(self, max_age=timedelta(days=90), interval=3600):
+        # Background thread: compact(max_age) every 'interval' seconds
+        def retention():
+            while not self.retention_stop.wait(interval):
+                try:
+                    self.compact(max_age)
+                except sqlite3.Error as e:
+                    logger.error("History store compaction failed: {0}".format(e))
+
+        if self.retention_thread is None:
+            self.retention_stop.clear()
+            self.retention_thread = threading.Thread(target=retention, name="history-retention", daemon=True)
+            self.retention_thread.start()
+
+    def stop_retention(self):
+        if self.retention_thread is not None:
+            self.retention_stop.set()
+            self.retention_thread.join()
+            self.retention_thread = None
+
+    def close(self):
+        self.stop_retention()
+        self.conn.close()
+
+class HistoryBlockCache( object ):
+    # LRU cache of parsed history blocks. Overlapping history reads return the same closed blocks again:
+    # a block with a known (history type, CCITT, length) key maps straight to its records (position and decoder).
+    # Different blocks can have the same key (a 16 bit CCITT): a hit is only one if the cached block is the same.
+    # Every decode run gets new event objects: post_process links them, and callers flag them.
+    # With a HistoryEventStore the parsed blocks are saved, warm_up() parses them again in the background
+    # after a restart.
+    def __init__(self, max_blocks=512, store=None):
+        self.max_blocks = max_blocks
+        self.store = store
+        self.blocks = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def get(self, key, page=None):
+        # (page, records) of the cached block; with 'page', None unless the cached block is 'page'
+        with self.lock:
+            entry = self.blocks.get(key)
+            if entry is None or (page is not None and entry[0] != page):
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.blocks.move_to_end(key)
+            return entry
+
+    def put(self, key, events):
+        with self.lock:
+            self.blocks[key] = events
+            self.blocks.move_to_end(key)
+            while len(self.blocks) > self.max_blocks:
+                self.blocks.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.blocks.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def decode_events(self, decoded_blocks, block_keys, history_filter=None, correlation=False, timestamps=None):
+        # Medtronic600SeriesDriver.decode_events of cached blocks; a new block is indexed whole and cached
+        event_list = []
+        for page, key in zip(decoded_blocks, block_keys):
+            entry = self.get(key, page)
+            if entry is None:
+                entry = HistoryBlockCache.index_block(page)
+                self.put(key, entry)
+                if self.store is not None:
+                    self.store.add_block(key, page)
+            page, records = entry
+            for pos, decoder in records:
+                if history_filter is None or history_filter.decodes(page, pos, correlation):
+                    event_list.extend(NGPHistoryEvent.decode_record(page, pos, timestamps, decoder))
+        return event_list
+
+    @staticmethod
+    def index_block(page):
+        # (page, [(pos, decoder) of every record]), like Medtronic600SeriesDriver.parse_block without building the events
+        page = memoryview(bytes(page))
+        records = []
+        pos = 0
+        while pos < len(page):
+            records.append((pos, NGPHistoryEvent.EVENT_DECODERS.get(page[pos], NGPHistoryEvent)))
+            pos += page[pos + 2] # event size
+        return page, records
+
+    def warm_up(self):
+        # Parses the blocks saved in the store in a background thread; returns the thread
+        def warm_up():
+            for key, block in self.store.blocks(self.max_blocks):
+                if key not in self.blocks:
+                    self.put(key, HistoryBlockCache.index_block(block))
+            logger.debug("History block cache: {0} blocks loaded".format(len(self.blocks)))
+
+        thread = threading.Thread(target=warm_up, name="history-block-cache", daemon=True)
+        thread.start()
+        return thread
 
 class Config( object ):
     data = None
@@ -4424,9 +5610,13 @@ class PumpHistoryInfoRequestMessage( MedtronicSendMessage ):
         MedtronicSendMessage.__init__(self, ComDCommand.READ_HISTORY_INFO_REQUEST, session, payload)
 
 class PumpHistoryRequestMessage( MedtronicSendMessage ):
-    def __init__(self, session, date_start, date_end, date_offset, request_type = HistoryDataType.PUMP_DATA):
-        from_rtc = DateTimeHelper.rtc_from_date(date_start, date_offset)
-        to_rtc = DateTimeHelper.rtc_from_date(date_end, date_offset)
+    # from_rtc/to_rtc: request this rtc range instead of date_start..date_end
+    def __init__(self, session, date_start, date_end, date_offset, request_type = HistoryDataType.PUMP_DATA,
+                 from_rtc = None, to_rtc = None):
+        if from_rtc is None:
+            from_rtc = DateTimeHelper.rtc_from_date(date_start, date_offset)
+        if to_rtc is None:
+            to_rtc = DateTimeHelper.rtc_from_date(date_end, date_offset)
         payload = struct.pack( '>BBIIH', request_type, HistoryRangeType.PARTIAL_HISTORY, from_rtc, to_rtc, 0x00 )
         MedtronicSendMessage.__init__(self, ComDCommand.READ_HISTORY_REQUEST, session, payload)
 
@@ -4441,82 +5631,293 @@ class MultipacketResendPacketsMessage( MedtronicSendMessage ):
         MedtronicSendMessage.__init__(self, ComDCommand.MULTIPACKET_RESEND_PACKETS, session, payload)
 
 class MultipacketSession( object ):
-
-    session_size = None
-    packet_size = None
-    last_packet_size = None
-    packets_to_fetch = None
-    response = None
-    segments = None
-    segments_filled = None
-    last_packet_number = None
-
+    # One multipacket session (one segment). All state is per instance, so several transfers can run in one process.
+    # The packets are written straight into a bytearray of session_size, at packet_number * packet_size.
     def __init__(self, settings ):
-        MultipacketSession.session_size = settings.segment_size
-        MultipacketSession.packet_size = settings.packet_size
-        MultipacketSession.last_packet_size = settings.last_packet_size
-        MultipacketSession.packets_to_fetch = settings.packets_to_fetch
-        MultipacketSession.response = [None] * settings.packets_to_fetch
-        # MultipacketSession.response = bytearray(self.session_size + 1)
-        # MultipacketSession.response[0] = settings.com_d_sequence_number # comDSequenceNumber
-        MultipacketSession.segments = [None] * settings.packets_to_fetch
-        MultipacketSession.segments_filled = 0
-        MultipacketSession.last_packet_number = MultipacketSession.packets_to_fetch - 1
+        self.session_size = settings.segment_size
+        self.packet_size = settings.packet_size
+        self.last_packet_size = settings.last_packet_size
+        self.packets_to_fetch = settings.packets_to_fetch
+        self.last_packet_number = self.packets_to_fetch - 1
+
+        size = self.last_packet_number * self.packet_size + self.last_packet_size
+        if size != self.session_size:
+            logger.warning("### MultipacketSession: session size {0}, packets add up to {1}".format(self.session_size, size))
+        self.response = bytearray(size)
+        self._response_view = memoryview(self.response)
+        # One flag per packet: received or not
+        self.segments = bytearray(self.packets_to_fetch)
+        self.segments_filled = 0
+        # Packets of restore(), until the segment is known to be good
+        self.restored = None
         logger.debug("### Start MultipacketSession")
 
+    @property
+    def payload(self):
+        # The reassembled segment, no copy (complete once payload_complete())
+        return self._response_view
 
-    @classmethod
     def payload_complete(self):
-        # logger.debug("### -> payload_complete: segments_filled: {0}, packets_to_fetch: {1}".format(MultipacketSession.segments_filled, MultipacketSession.packets_to_fetch))
-        if MultipacketSession.segments_filled == MultipacketSession.packets_to_fetch:
-            return True
-        else:
-            return False
+        # logger.debug("### -> payload_complete: segments_filled: {0}, packets_to_fetch: {1}".format(self.segments_filled, self.packets_to_fetch))
+        return self.segments_filled == self.packets_to_fetch
 
-    @classmethod
-    def add_segment (sefl, data):
+    def add_segment (self, data):
         packet_number = data.packet_number
         packet_size = data.packet_size
-        payload = data.payload
 
         # logger.debug("### -> add_segment: packet_number: {0}, packet_size: {1}".format(packet_number, packet_size))
 
-        if MultipacketSession.segments[packet_number]:
-            logger.debug("### Got a Repeated Multipacket Segment: {0} of {1}, count: {3} [packetSize={4} {5}/{6}]".format(packet_number+1, MultipacketSession.packets_to_fetch, MultipacketSession.segments_filled, packet_size, MultipacketSession.packet_size, MultipacketSession.last_packet_number, MultipacketSession.last_packet_size))
+        if packet_number > self.last_packet_number:
+            logger.debug("Multipacket Transfer packet number out of range: {0}".format(packet_number))
             return False
 
-        if (packet_number == MultipacketSession.last_packet_number) and (packet_size != MultipacketSession.last_packet_size):
+        if self.segments[packet_number]:
+            logger.debug("### Got a Repeated Multipacket Segment: {0} of {1}, count: {2} [packetSize={3} {4}/{5}]".format(packet_number+1, self.packets_to_fetch, self.segments_filled, packet_size, self.packet_size, self.last_packet_size))
+            return False
+
+        if (packet_number == self.last_packet_number) and (packet_size != self.last_packet_size):
             logger.debug("Multipacket Transfer last packet size mismatch")
             return False
-        elif (packet_number != MultipacketSession.last_packet_number) and (packet_size != MultipacketSession.packet_size):
+        elif (packet_number != self.last_packet_number) and (packet_size != self.packet_size):
             logger.debug("Multipacket Transfer packet size mismatch")
             return False
 
-        MultipacketSession.segments[packet_number] = True
-        MultipacketSession.segments_filled = MultipacketSession.segments_filled + 1
+        position = packet_number * self.packet_size
+        self._response_view[position:position + packet_size] = data.payload
+        self.segments[packet_number] = 1
+        self.segments_filled = self.segments_filled + 1
 
-        logger.info("### Got a Multipacket Segment: {0} of {1}, count: {3} [packetSize={4} {5}/{6}]".format(packet_number+1, MultipacketSession.packets_to_fetch, MultipacketSession.segments_filled, packet_size, MultipacketSession.packet_size, MultipacketSession.last_packet_number, MultipacketSession.last_packet_size))
+        logger.info("### Got a Multipacket Segment: {0} of {1}, count: {2} [packetSize={3} {4}/{5}]".format(packet_number+1, self.packets_to_fetch, self.segments_filled, packet_size, self.packet_size, self.last_packet_size))
+        return True
 
-        # buffer1[pos:pos+len(buffer2)] = buffer2
-        #MultipacketSession.response[(packet_number * MultipacketSession.packet_size) + 1 : packet_size] = payload
-        MultipacketSession.response[packet_number] = payload
+    def restore(self, segments, response):
+        # Packets already received in an earlier (interrupted) transfer of the same segment, see HistoryJournal.
+        # They can be of another segment of the same size: MultipacketTransfer checks the complete segment.
+        self.segments[:] = segments
+        self._response_view[:] = response
+        self.segments_filled = sum(self.segments)
+        self.restored = bytearray(self.segments)
+        logger.info("### MultipacketSession: restored {0} of {1} packets".format(self.segments_filled, self.packets_to_fetch))
+
+    def drop_restored(self):
+        # The restored packets are requested again
+        for packet_number, restored in enumerate(self.restored):
+            if restored:
+                self.segments[packet_number] = 0
+        self.segments_filled = sum(self.segments)
+        self.restored = None
+
+    def same_session(self, session_size, packet_size, packets_to_fetch):
+        return (self.session_size, self.packet_size, self.packets_to_fetch) == (session_size, packet_size, packets_to_fetch)
+
+    def has_segment(self, packet_number):
+        return 0 <= packet_number < self.packets_to_fetch and self.segments[packet_number] == 1
+
+    def missing_ranges(self):
+        # Every gap, not only the first one: [(first packet number, count), ...]
+        ranges = []
+        start = None
+        for packet_number, segment in enumerate(self.segments):
+            if not segment and start is None:
+                start = packet_number
+            elif segment and start is not None:
+                ranges.append((start, packet_number - start))
+                start = None
+        if start is not None:
+            ranges.append((start, self.packets_to_fetch - start))
+        logger.debug("### Request Missing Multipacket Segments: {0}".format(ranges))
+        return ranges
+
+class MultipacketTransferStats(object):
+    def __init__(self):
+        self.segments = 0       # completed multipacket sessions
+        self.packets = 0        # packets received (first time)
+        self.duplicates = 0     # packets received again
+        self.resends = 0        # MULTIPACKET_RESEND_PACKETS requests
+        self.resent_packets = 0 # packets asked for by them
+        self.retries = 0        # receive timeouts
+        self.bytes = 0          # segment bytes
+        self.start_time = time.monotonic()
+        self.elapsed = 0.0
 
-        return True
+    @property
+    def bytes_per_second(self):
+        return self.bytes / self.elapsed if self.elapsed > 0 else 0.0
 
-    @classmethod
-    def missing_segments(sefl):
-        packet_number = 0
-        missing = 0
-        for segment in MultipacketSession.segments:
-            if segment:
-                if missing > 0:
-                    break
-                packet_number = packet_number + 1
-            else:
-                missing = missing + 1
+    def __str__(self):
+        return ("Segments:{0}, Packets:{1}, Duplicates:{2}, Resends:{3} ({4} packets), Retries:{5}, "
+                "Bytes:{6}, Time:{7:.1f}s, {8:.0f} bytes/s").format(self.segments, self.packets, self.duplicates,
+                                                                    self.resends, self.resent_packets, self.retries,
+                                                                    self.bytes, self.elapsed, self.bytes_per_second)
+
+class MultipacketTransfer(object):
+    # Receives the multipacket response of the ComD request that was just sent (history, basal pattern, ...):
+    # acks INITIATE_MULTIPACKET_TRANSFER, collects the packets of every multipacket session, after a timeout asks
+    # again for all missing packet ranges at once, and acks every completed session.
+    # A message of 'end_message_types' (END_HISTORY_TRANSMISSION, READ_BASAL_PATTERN_RESPONSE, ...) ends the transfer,
+    # with 'end_on_high_speed_mode' a HIGH_SPEED_MODE_COMMAND with ehs_mmode != 0 too.
+    # 'resume_session': the first session's packets from an interrupted transfer (HistoryJournal.load_session),
+    # used if the pump announces the same session.
+    def __init__(self, driver, end_message_types, end_on_high_speed_mode=False, resume_session=None):
+        self.driver = driver
+        self.end_message_types = list(end_message_types)
+        self.end_on_high_speed_mode = end_on_high_speed_mode
+        self.resume_session = resume_session
+        self.end_message = None
+        # The session in progress (or the last one)
+        self.multi_packet_session = None
+        self.stats = MultipacketTransferStats()
+
+    @property
+    def completed(self):
+        return self.end_message is not None
+
+    def segments(self):
+        # Generator: every segment (bytearray) as soon as its multipacket session is complete
+        message_types = [ComDCommand.INITIATE_MULTIPACKET_TRANSFER,
+                         ComDCommand.MULTIPACKET_SEGMENT_TRANSMISSION,
+                         ComDCommand.MULTIPACKET_RESEND_PACKETS,
+                         ComDCommand.HIGH_SPEED_MODE_COMMAND,
+                         ComDCommand.NAK_COMMAND] + self.end_message_types
+        multi_packet_session = None
+        expected_segments = 0
+        retry = 0
+
+        try:
+            while self.end_message is None:
+                if multi_packet_session is not None and not multi_packet_session.payload_complete():
+                    if expected_segments < 1:
+                        expected_segments = self.request_missing(multi_packet_session)
+
+                    # timeout adjusted for efficiency and to allow for large gaps of missing segments as the pump will keep sending until done
+                    if multi_packet_session.segments_filled == 0:
+                        # pump may have missed the initial ack, we need to wait the max timeout period
+                        timeout = Medtronic600SeriesDriver.READ_TIMEOUT_MS
+                    else:
+                        timeout = max(Medtronic600SeriesDriver.MULTIPACKET_SEGMENT_MS * expected_segments,
+                                      Medtronic600SeriesDriver.MULTIPACKET_TIMEOUT_MS)
+                    try:
+                        decrypted = self.driver.get_medtronic_message(message_types, timeout)
+                        retry = 0
+                    except Exception as e:
+                        retry = retry + 1
+                        self.stats.retries += 1
+                        self.receive_timeout(multi_packet_session, expected_segments, retry)
+                        expected_segments = 0
+                        continue
+                else:
+                    decrypted = self.driver.get_medtronic_message(message_types)
+
+                if decrypted.message_type == ComDCommand.NAK_COMMAND:
+                    self.driver.clear_message()
+                    # TODO Add decode NAK command
+                    logger.info("## Pump sent a NAK 0x{0:X}:0x{1:X}".format(decrypted.nakcmd, decrypted.nakcode))
+
+                elif decrypted.message_type == ComDCommand.HIGH_SPEED_MODE_COMMAND:
+                    logger.debug("## Multipacket transfer consumed HIGH_SPEED_MODE_COMMAND={0}".format(decrypted.ehs_mmode))
+                    if self.end_on_high_speed_mode and decrypted.ehs_mmode != 0:
+                        self.end_message = decrypted
+
+                elif decrypted.message_type == ComDCommand.INITIATE_MULTIPACKET_TRANSFER:
+                    logger.info("### Multipacket transfer got INITIATE_MULTIPACKET_TRANSFER")
+                    multi_packet_session = MultipacketSession(decrypted)
+                    self.multi_packet_session = multi_packet_session
+                    if self.resume_session is not None:
+                        if multi_packet_session.same_session(*self.resume_session[:3]):
+                            multi_packet_session.restore(*self.resume_session[3:])
+                        self.resume_session = None
+
+                    logger.info("### session_size: {0}".format(multi_packet_session.session_size))
+                    logger.info("### packet_size: {0}".format(multi_packet_session.packet_size))
+                    logger.info("### last_packet_size: {0}".format(multi_packet_session.last_packet_size))
+                    logger.info("### packets_to_fetch: {0}".format(multi_packet_session.packets_to_fetch))
+                    logger.info("### last_packet_number: {0}".format(multi_packet_session.last_packet_number))
+
+                    self.ack(ComDCommand.INITIATE_MULTIPACKET_TRANSFER)
+                    expected_segments = multi_packet_session.packets_to_fetch - multi_packet_session.segments_filled
+                    logger.debug("Start multipacket session")
+
+                elif decrypted.message_type == ComDCommand.MULTIPACKET_SEGMENT_TRANSMISSION:
+                    logger.debug("## Multipacket transfer got MULTIPACKET_SEGMENT_TRANSMISSION")
+                    if multi_packet_session is None:
+                        logger.debug("multipacketSession not initiated before segment received")
+                    elif multi_packet_session.payload_complete() or multi_packet_session.has_segment(decrypted.packet_number):
+                        logger.debug("Multisession - packet not needed")
+                        self.stats.duplicates += 1
+                    elif multi_packet_session.add_segment(decrypted):
+                        expected_segments = expected_segments - 1
+                        self.stats.packets += 1
+
+                        if multi_packet_session.payload_complete() and multi_packet_session.restored is not None:
+                            if not self.valid_segment(multi_packet_session.response):
+                                logger.warning("### Multipacket transfer: the restored packets are of another segment, requesting them again")
+                                multi_packet_session.drop_restored()
+                                expected_segments = 0
+                                continue
+                            multi_packet_session.restored = None
+
+                        if multi_packet_session.payload_complete():
+                            logger.debug("Multisession Complete")
+                            self.ack(ComDCommand.MULTIPACKET_SEGMENT_TRANSMISSION)
+
+                            # The session is done with its buffer: hand it out as is
+                            segment = multi_packet_session.response
+                            self.stats.segments += 1
+                            self.stats.bytes += len(segment)
+                            yield segment
+
+                elif decrypted.message_type in self.end_message_types:
+                    logger.debug("## Multipacket transfer got 0x{0:X}".format(decrypted.message_type))
+                    self.end_message = decrypted
 
-        logger.debug("### Request Missing Multipacket Segments, position: {0} of {1}, missing: {2}".format(packet_number+1, MultipacketSession.packets_to_fetch, missing))
-        return packet_number, missing
+                else:
+                    logger.warning("## Multipacket transfer !!! UNKNOWN MESSAGE !!!")
+                    logger.warning("## Multipacket transfer response.messageType: {0:x}".format(decrypted.message_type))
+        finally:
+            self.stats.elapsed = time.monotonic() - self.stats.start_time
+            logger.info("### Multipacket transfer: {0}".format(self.stats))
+
+    def ack(self, message_type):
+        ack_message = AckMultipacketRequestMessage(self.driver.session, message_type)
+        bayer_ack_message = ContourNextLinkBinaryMessage(CommandType.SEND_MESSAGE, self.driver.session, ack_message.encode())
+        self.driver.send_message(bayer_ack_message.encode())
+        self.driver.read_response0x81()
+
+    def valid_segment(self, segment):
+        # A history segment (the only transfer that resumes) that decodes: its sizes, LZO stream and block CCITTs add up
+        try:
+            self.driver.decode_pump_segment(segment, segment[2])
+        except Exception:
+            return False
+        return True
+
+    def request_missing(self, multi_packet_session):
+        # One MULTIPACKET_RESEND_PACKETS per gap, all sent before waiting for the packets
+        expected_segments = 0
+        for packet_number, missing in multi_packet_session.missing_ranges():
+            logger.debug("Sending MultipacketResendPacketsMessage {0} +{1}".format(packet_number, missing))
+            resend_message = MultipacketResendPacketsMessage(self.driver.session, packet_number, missing)
+            bayer_resend_message = ContourNextLinkBinaryMessage(CommandType.SEND_MESSAGE, self.driver.session, resend_message.encode())
+            self.driver.send_message(bayer_resend_message.encode())
+            self.driver.read_response0x81()
+            self.stats.resends += 1
+            self.stats.resent_packets += missing
+            expected_segments += missing
+        return expected_segments
+
+    def receive_timeout(self, multi_packet_session, expected_segments, retry):
+        logger.error("Multisession timeout: count: {0}/{1} expecting: {2} retry: {3}".format(multi_packet_session.segments_filled, multi_packet_session.packets_to_fetch, expected_segments, retry))
+        if multi_packet_session.segments_filled == 0:
+            error = "Multisession timeout: failed no segments filled"
+        elif (multi_packet_session.segments_filled * 100) / multi_packet_session.packets_to_fetch < 20:
+            error = "Multisession timeout: failed, missed packets > 80%"
+        elif retry >= Medtronic600SeriesDriver.MULTIPACKET_SEGMENT_RETRY:
+            error = "Multisession timeout: retry failed"
+        else:
+            return
+        self.driver.clear_message()
+        logger.error(error)
+        raise TimeoutException(error)
 
 # public abstract class ContourNextLinkBinaryRequestMessage<T> extends ContourNextLinkRequestMessage<T> {
 class ContourNextLinkBinaryMessage(object):
@@ -5216,11 +6617,29 @@ class Medtronic600SeriesDriver( object ):
 
     CHANNELS = [ 0x14, 0x11, 0x0e, 0x17, 0x1a ] # In the order that the CareLink applet requests them
 
+    HISTORY_DECODE_WORKERS = 1 # process_pump_history: parallel segment decoders (0: one per CPU)
+    HISTORY_STREAM_QUEUE_SIZE = 4 # stream_pump_history: received segments waiting to be decoded
+    HISTORY_SYNC_OVERLAP_S = 15 * 60 # sync_pump_history: requested again before the last synced record
+    HISTORY_SYNC_FIRST_S = 24 * 60 * 60 # first sync of a pump
+    HISTORY_SYNC_MAX_S = 10 * 24 * 60 * 60 # never further back than that
+
     session = None
     def __init__(self):
         self.session = MedtronicCnlSession()
         self.device = None
+        # UsbReader of start_usb_reader (None: read_message reads the device itself)
+        self.usb_reader = None
         self.device_info = None
+        # MultipacketTransfer of the last history/basal pattern read (see its 'stats')
+        self.multipacket_transfer = None
+        # HistorySyncState of sync_pump_history (created on first use)
+        self.history_sync = None
+        # HistoryBlockCache: blocks seen before aren't parsed again (not used by decoder processes)
+        self.block_cache = None
+        # HistoryChunkPlan of the last iter_pump_history_chunked
+        self.history_plan = None
+        # PumpSettingsCache of get_pump_settings (created on first use)
+        self.settings_cache = None
 
     @property
     def device_serial(self):
@@ -5257,25 +6676,45 @@ class Medtronic600SeriesDriver( object ):
         else:
             return self.drift
 
-    def open_device(self):
+    def open_device(self, device = None):
+        # device: the CnlTransport to use (HidrawTransport, SocketTransport, tools/cnl24emu.PumpEmulator, ...),
+        # the CNL on local USB if None (hidapi, without it hidraw)
         logger.debug("# Opening device")
-        for d in hid.enumerate(self.USB_VID, self.USB_PID):
-            if d['vendor_id'] == self.USB_VID and d['product_id'] == self.USB_PID:
-                self.device = hid.device()
-                self.device.open(self.USB_VID, self.USB_PID)
-
-                logger.debug("Manufacturer: %s" % self.device.get_manufacturer_string())
-                logger.debug("Product: %s" % self.device.get_product_string())
-                logger.debug("Serial No: %s" % self.device.get_serial_number_string())
-                return True
-        return False
+        if device is None:
+            if hid is not None:
+                device = HidTransport(self.USB_VID, self.USB_PID)
+            else:
+                device = HidrawTransport(self.USB_VID, self.USB_PID)
+        if not device.open():
+            return False
+        self.device = device
+        return True
 
     def close_device(self):
         logger.debug("# Closing device")
+        self.stop_usb_reader()
         self.device.close()
 
+    def start_usb_reader(self, max_messages = 256, poll_ms = 5):
+        # Optional, after open_device: a UsbReader thread reads the CNL from now on (self.usb_reader)
+        self.usb_reader = UsbReader(self.device, max_messages, poll_ms)
+        self.usb_reader.start()
+
+    def stop_usb_reader(self):
+        if self.usb_reader is not None:
+            self.usb_reader.stop()
+            logger.debug("# {0}".format(self.usb_reader))
+            self.usb_reader = None
+
     # protected byte[] read_message(UsbHidDriver mDevice, int timeout) throws IOException, TimeoutException {
     def read_message( self, timeout_ms=READ_TIMEOUT_MS ):
+        if self.usb_reader is not None:
+            return self.usb_reader.get(timeout_ms)
+        return self.assemble_message(self.device, timeout_ms)
+
+    @classmethod
+    def assemble_message( cls, device, timeout_ms, first_frame = None ):
+        # One message from the USB frames of 'device' ('first_frame': its first frame, already read)
         payload = bytearray()
         bytes_read = 0
         payload_size = 0
@@ -5284,15 +6723,18 @@ class Medtronic600SeriesDriver( object ):
 
         logger.debug('# Read message, timeout: {0}'.format(timeout_ms))
 
-        while first or (bytes_read > 0 and payload_size == self.USB_BLOCKSIZE-4 and len(payload) != expected_size):
-            t = timeout_ms if first else 1500
-            logger.debug("timeout = {0}".format(t))
-            data = self.device.read( self.USB_BLOCKSIZE, timeout_ms = t )
+        while first or (bytes_read > 0 and payload_size == cls.USB_BLOCKSIZE-4 and len(payload) != expected_size):
+            if first and first_frame is not None:
+                data = first_frame
+            else:
+                t = timeout_ms if first else 1500
+                logger.debug("timeout = {0}".format(t))
+                data = device.read( cls.USB_BLOCKSIZE, timeout_ms = t )
             first = False
             if data:
                 bytes_read = len(data)
                 payload_size = data[3]
-                if bytearray( data[0:3] ) != self.MAGIC_HEADER :
+                if bytearray( data[0:3] ) != cls.MAGIC_HEADER :
                     logger.error('## Recieved invalid USB packet')
                     break
                     # raise RuntimeError( 'Recieved invalid USB packet')
@@ -5398,7 +6840,7 @@ class Medtronic600SeriesDriver( object ):
             raise UnexpectedMessageException("0x80 response message not a 0x80")
 
         # message and internal payload size correct?
-        if len(payload) != (0x21 + payload[0x1C] & 0x00FF | payload[0x1D] << 8 & 0xFF00):
+        if len(payload) != 0x21 + (payload[0x1C] & 0x00FF | payload[0x1D] << 8 & 0xFF00):
             logger.error("readResponse0x80: message size mismatch")
             self.clear_message()
             raise UnexpectedMessageException("0x80 response message size mismatch")
@@ -5490,7 +6932,7 @@ class Medtronic600SeriesDriver( object ):
             raise UnexpectedMessageException("0x81 response was empty, connection lost")
 
         # message and internal payload size correct?
-        elif len(payload) != (0x21 + payload[0x1C] & 0x00FF | payload[0x1D] << 8 & 0xFF00):
+        elif len(payload) != 0x21 + (payload[0x1C] & 0x00FF | payload[0x1D] << 8 & 0xFF00):
             logger.error("readResponse0x81: message size mismatch")
             self.clear_message()
             raise UnexpectedMessageException("0x81 response message size mismatch")
@@ -5531,7 +6973,10 @@ class Medtronic600SeriesDriver( object ):
         # Split the message into 60 byte chunks
         for packet in [ payload[ i: i+60 ] for i in range( 0, len( payload ), 60 ) ]:
             message = struct.pack( '>3sB', self.MAGIC_HEADER, len( packet ) ) + packet
-            self.device.write( bytearray( message ) )
+            if self.usb_reader is not None:
+                self.usb_reader.write( bytearray( message ) )
+            else:
+                self.device.write( bytearray( message ) )
             # Debugging
             logger.debug("SEND: %s", binascii.hexlify( message ))
 
@@ -5765,6 +7210,31 @@ class Medtronic600SeriesDriver( object ):
         result = self.get_medtronic_message([ComDCommand.READ_BOLUS_WIZARD_SENSITIVITY_FACTORS_RESPONSE])
         return result.sensitivity
 
+    def get_pump_settings(self, names = PumpSettingsCache.ALL, cache = None):
+        # Settings (PumpSettingsCache names -> value) from the cache; only the missing or stale ones are read,
+        # one after the other in the current EHSM session
+        if cache is None:
+            if self.settings_cache is None:
+                self.settings_cache = PumpSettingsCache()
+            cache = self.settings_cache
+        readers = {
+            PumpSettingsCache.BASAL_PATTERNS: self.get_pump_basal_pattern,
+            PumpSettingsCache.CARB_RATIOS: self.get_bolus_wizard_carb_ratios,
+            PumpSettingsCache.BG_TARGETS: self.get_bolus_wizard_targets,
+            PumpSettingsCache.SENSITIVITY: self.get_bolus_wizard_sensitivity,
+        }
+        pump_serial = self.session.pump_serial
+        stale = cache.stale(pump_serial, names)
+        logger.debug("# Get Pump Settings, stale: {0}".format(stale))
+        settings = {}
+        for name in names:
+            if name in stale:
+                settings[name] = readers[name]()
+                cache.put(pump_serial, name, settings[name])
+            else:
+                settings[name] = cache.get(pump_serial, name)
+        return settings
+
     def get_pump_history_info(self, date_start, date_end, request_type = HistoryDataType.PUMP_DATA):
         logger.debug("# Get Pump History Info")
         mt_message = PumpHistoryInfoRequestMessage(self.session, date_start, date_end, self.offset, request_type)
@@ -5774,151 +7244,289 @@ class Medtronic600SeriesDriver( object ):
         response = self.get_medtronic_message([ComDCommand.READ_HISTORY_INFO_RESPONSE])
         return response
 
-    def get_pump_history(self, date_start, date_end, request_type = HistoryDataType.PUMP_DATA):
-        logger.debug("# Get Pump History")
-        expected_segments = 0
-        retry = 0
-        all_segments = []
-        segment = []
-        multi_packet_session = None
-        decrypted = None
+    def get_pump_history(self, date_start, date_end, request_type = HistoryDataType.PUMP_DATA, journal = None):
+        return list(self.iter_pump_history(date_start, date_end, request_type, journal))
 
-        mt_message = PumpHistoryRequestMessage(self.session, date_start, date_end, self.offset, request_type)
+    def iter_pump_history(self, date_start, date_end, request_type = HistoryDataType.PUMP_DATA, journal = None):
+        # Generator: yields every segment as soon as its multipacket session is complete.
+        # journal: HistoryJournal. Segments of an earlier, interrupted download of the same range come first
+        # (from the journal), then only the rtc range they don't cover is requested.
+        from_rtc = DateTimeHelper.rtc_from_date(date_start, self.offset)
+        to_rtc = DateTimeHelper.rtc_from_date(date_end, self.offset)
+        return self.iter_pump_history_range(from_rtc, to_rtc, request_type, journal)
 
-        bayer_message = ContourNextLinkBinaryMessage( CommandType.SEND_MESSAGE, self.session, mt_message.encode() )
-        self.send_message( bayer_message.encode() )
-        self.read_response0x81()
+    def iter_pump_history_range(self, from_rtc, to_rtc, request_type = HistoryDataType.PUMP_DATA, journal = None):
+        # iter_pump_history of an rtc range (both ends included)
+        logger.debug("# Get Pump History")
+        requests = [(from_rtc, to_rtc)]
+        # fingerprint: count of the records yielded from the journal
+        known = collections.Counter()
+        resume_session = None
+
+        if journal is not None:
+            key = (self.session.pump_serial, request_type, from_rtc, to_rtc)
+            entries = journal.entries(*key)
+            # rtc range of the records of every entry: one download, no holes in it
+            covered = []
+            count = 0
+            for entry in entries:
+                segments = journal.segments(entry)
+                rtc_range = self.history_rtc_range(segments, request_type)
+                if rtc_range is not None:
+                    covered.append(rtc_range)
+                # Entries can overlap each other
+                entry_known = collections.Counter(known)
+                for segment in segments:
+                    if any(entry_known.values()):
+                        segment = self.drop_history_records(segment, request_type, entry_known)
+                        if segment is None:
+                            continue
+                    self.history_rtc_range([segment], request_type, known)
+                    count += 1
+                    yield segment
+            if covered:
+                requests = self.missing_rtc_ranges(covered, from_rtc, to_rtc)
+                logger.info("# Get Pump History: {0} segments from the journal, requesting {1}".format(count, requests))
+            resume_session = journal.load_session(*key)
+
+        for request_rtc in requests:
+            mt_message = PumpHistoryRequestMessage(self.session, None, None, self.offset, request_type, *request_rtc)
 
-        transmission_completed = False
-        while transmission_completed != True:
+            bayer_message = ContourNextLinkBinaryMessage( CommandType.SEND_MESSAGE, self.session, mt_message.encode() )
+            self.send_message( bayer_message.encode() )
+            self.read_response0x81()
 
-            if multi_packet_session != None and multi_packet_session.payload_complete() == False:
+            transfer = MultipacketTransfer(self, [ComDCommand.END_HISTORY_TRANSMISSION], resume_session = resume_session)
+            resume_session = None
+            self.multipacket_transfer = transfer
+            try:
+                for segment in transfer.segments():
+                    if any(known.values()):
+                        # The requests overlap the journal segments on their boundary rtc
+                        segment = self.drop_history_records(segment, request_type, known)
+                        if segment is None:
+                            continue
+                    if journal is not None:
+                        journal.add_segment(key, segment)
+                    yield segment
+            except Exception:
+                if journal is not None:
+                    journal.save_session(key, transfer.multi_packet_session)
+                raise
+
+        if journal is not None:
+            for entry in set(entries + [key]):
+                journal.clear(entry)
+
+    def get_pump_history_chunked(self, date_start, date_end, request_type = HistoryDataType.PUMP_DATA, history_info = None,
+                                 journal = None):
+        return list(self.iter_pump_history_chunked(date_start, date_end, request_type, history_info, journal))
+
+    def iter_pump_history_chunked(self, date_start, date_end, request_type = HistoryDataType.PUMP_DATA, history_info = None,
+                                  journal = None):
+        # iter_pump_history in time chunks, newest first, planned by a HistoryChunkPlan (self.history_plan)
+        # from the ReadHistoryInfo of the range ('history_info', requested if None).
+        # The transfer rate of this driver's earlier chunks sizes the first chunk.
+        if history_info is None:
+            history_info = self.get_pump_history_info(date_start, date_end, request_type)
+        bytes_per_second = self.history_plan.bytes_per_second if self.history_plan is not None else None
+        plan = HistoryChunkPlan(date_start, date_end, history_info.length, bytes_per_second=bytes_per_second)
+        self.history_plan = plan
+
+        chunk = plan.next_chunk()
+        while chunk is not None:
+            logger.debug("# Get Pump History chunk {0} - {1}".format(chunk[0], chunk[1]))
+            segments = self.iter_pump_history(chunk[0], chunk[1], request_type, journal)
+            # Only the time spent receiving, not the time the caller spends on the segments
+            elapsed = 0.0
+            try:
                 while True:
-                    if expected_segments < 1:
-                        packet_number, missing = multi_packet_session.missing_segments()
-                        logger.debug("Sending MultipacketResendPacketsMessage")
-                        ack_message = MultipacketResendPacketsMessage(self.session, packet_number, missing)
-                        bayer_ack_message = ContourNextLinkBinaryMessage(CommandType.SEND_MESSAGE, self.session,ack_message.encode())
-                        self.send_message(bayer_ack_message.encode())
-                        self.read_response0x81()
-
-                        expected_segments = missing
-
-                    try:
-                        # timeout adjusted for efficiency and to allow for large gaps of missing segments as the pump will keep sending until done
-                        if multi_packet_session.segments_filled == 0:
-                            # pump may have missed the initial ack, we need to wait the max timeout period
-                            timeout = Medtronic600SeriesDriver.READ_TIMEOUT_MS
-                        else:
-                            timeout = Medtronic600SeriesDriver.MULTIPACKET_SEGMENT_MS * expected_segments
-                            if timeout < Medtronic600SeriesDriver.MULTIPACKET_TIMEOUT_MS:
-                                timeout = Medtronic600SeriesDriver.MULTIPACKET_TIMEOUT_MS
-
-                        decrypted = self.get_medtronic_message([ComDCommand.INITIATE_MULTIPACKET_TRANSFER,
-                                                                ComDCommand.MULTIPACKET_SEGMENT_TRANSMISSION,
-                                                                ComDCommand.MULTIPACKET_RESEND_PACKETS,
-                                                                ComDCommand.END_HISTORY_TRANSMISSION,
-                                                                ComDCommand.HIGH_SPEED_MODE_COMMAND,
-                                                                ComDCommand.NAK_COMMAND], timeout)
-                        retry = 0
-                        break
-                    except:
-                        retry = retry + 1
-                        if multi_packet_session.segments_filled == 0:
-                            self.clear_message()
-                            logger.error("Multisession timeout: failed no segments filled")
-                        elif (multi_packet_session.segments_filled * 100) / multi_packet_session.packets_to_fetch < 20:
-                            self.clear_message()
-                            logger.error("Multisession timeout: failed, missed packets > 80%")
-                        elif retry >= Medtronic600SeriesDriver.MULTIPACKET_SEGMENT_RETRY:
-                            self.clear_message()
-                            logger.error("Multisession timeout: retry failed")
-
-                        logger.error("Multisession timeout: count: {0}/{1} expecting: {2} retry: {3}".format(multi_packet_session.segments_filled, multi_packet_session.packets_to_fetch, expected_segments, retry))
-                        expected_segments = 0
-
-                    if retry > 0:
+                    started = time.monotonic()
+                    segment = next(segments, None)
+                    elapsed += time.monotonic() - started
+                    if segment is None:
                         break
+                    yield segment
+            except Exception:
+                plan.chunk_failed(chunk)
+                raise
+            plan.chunk_done(chunk, elapsed)
+            chunk = plan.next_chunk()
+        logger.info("# Get Pump History: {0}".format(plan))
+
+    def history_rtc_range(self, segments, request_type, fingerprints=None):
+        # (first rtc, last rtc) of the records of 'segments', None if there are none.
+        # fingerprints: if a Counter, the fingerprints of the records are counted in it (see drop_history_records)
+        first = None
+        last = None
+        for segment in segments:
+            for page in self.decode_pump_segment(segment, request_type):
+                pos = 0
+                while pos < len(page):
+                    rtc = NGPHistoryEvent.HEADER.unpack_from(page, pos)[3]
+                    first = rtc if first is None else min(first, rtc)
+                    last = rtc if last is None else max(last, rtc)
+                    if fingerprints is not None:
+                        fingerprints[NGPHistoryEvent.record_fingerprint(page, pos)] += 1
+                    pos += page[pos + 2] # event size
+        return None if first is None else (first, last)
 
+    @staticmethod
+    def missing_rtc_ranges(covered, from_rtc, to_rtc):
+        # Parts of from_rtc..to_rtc outside the 'covered' (first rtc, last rtc) ranges.
+        # The pump logs several records with the same rtc, so the ranges include the first and last rtc of every
+        # covered range: records there can be covered or not yet
+        ranges = []
+        pos = from_rtc
+        for first, last in sorted(covered):
+            if last < pos or first > to_rtc:
+                continue
+            if first > pos:
+                if ranges and ranges[-1][1] == pos:
+                    # (two ranges would both return the records of pos)
+                    ranges[-1] = (ranges[-1][0], first)
+                else:
+                    ranges.append((pos, first))
+            pos = max(pos, last)
+        if pos < to_rtc:
+            if ranges and ranges[-1][1] == pos:
+                ranges[-1] = (ranges[-1][0], to_rtc)
             else:
-                decrypted = self.get_medtronic_message([ComDCommand.INITIATE_MULTIPACKET_TRANSFER,
-                                                               ComDCommand.MULTIPACKET_SEGMENT_TRANSMISSION,
-                                                               ComDCommand.MULTIPACKET_RESEND_PACKETS,
-                                                               ComDCommand.END_HISTORY_TRANSMISSION,
-                                                               ComDCommand.HIGH_SPEED_MODE_COMMAND,
-                                                               ComDCommand.NAK_COMMAND])
-
-
-            if decrypted.message_type == ComDCommand.NAK_COMMAND:
-                self.clear_message()
-                # TODO Add decode NAK command
-                logger.info("## Pump sent a NAK 0x{0:X}:0x{1:X}".format(decrypted.nakcmd, decrypted.nakcode))
-
-
-            if decrypted.message_type == ComDCommand.HIGH_SPEED_MODE_COMMAND:
-                logger.debug("## getPumpHistory consumed HIGH_SPEED_MODE_COMMAND={0}".format(decrypted.ehs_mmode))
-                pass
-            elif decrypted.message_type == ComDCommand.INITIATE_MULTIPACKET_TRANSFER:
-                logger.info("### getPumpHistory got INITIATE_MULTIPACKET_TRANSFER")
-
-                multi_packet_session = MultipacketSession(decrypted)
-
-                logger.info("### session_size: {0}".format(multi_packet_session.session_size))
-                logger.info("### packet_size: {0}".format(multi_packet_session.packet_size))
-                logger.info("### last_packet_size: {0}".format(multi_packet_session.last_packet_size))
-                logger.info("### packets_to_fetch: {0}".format(multi_packet_session.packets_to_fetch))
-                logger.info("### last_packet_number: {0}".format(multi_packet_session.last_packet_number))
-                logger.info("### segments_filled: {0}".format(multi_packet_session.segments_filled))
-
-
-                ack_message = AckMultipacketRequestMessage(self.session, ComDCommand.INITIATE_MULTIPACKET_TRANSFER)
-                bayer_ack_message = ContourNextLinkBinaryMessage(CommandType.SEND_MESSAGE, self.session, ack_message.encode())
-                self.send_message( bayer_ack_message.encode() )
-                self.read_response0x81()
-
-                expected_segments = multi_packet_session.packets_to_fetch
-
-                logger.debug("Start multipacket session")
-
-            elif decrypted.message_type == ComDCommand.MULTIPACKET_SEGMENT_TRANSMISSION:
-                logger.debug("## getPumpHistory got MULTIPACKET_SEGMENT_TRANSMISSION")
-
-                if multi_packet_session == None:
-                    logger.debug("multipacketSession not initiated before segment received")
-                if multi_packet_session.payload_complete():
-                    logger.debug("Multisession Complete - packet not needed")
+                ranges.append((pos, to_rtc))
+        return ranges
+
+    def drop_history_records(self, segment, request_type, fingerprints):
+        # 'segment' without the records counted in 'fingerprints' (a Counter, decremented for every dropped record):
+        # the segment itself if it has none of them, else an uncompressed segment of the remaining records (None if there are none)
+        decoded_blocks = self.decode_pump_segment(segment, request_type)
+        blocks = []
+        dropped = 0
+        for page in decoded_blocks:
+            block = bytearray()
+            pos = 0
+            while pos < len(page):
+                event_size = page[pos + 2]
+                fingerprint = NGPHistoryEvent.record_fingerprint(page, pos)
+                if fingerprints[fingerprint] > 0:
+                    fingerprints[fingerprint] -= 1
+                    dropped += 1
                 else:
-                    if multi_packet_session.add_segment(decrypted):
-                        expected_segments = expected_segments - 1
-
-                    if multi_packet_session.payload_complete():
-                        logger.debug("Multisession Complete")
-                        ack_message = AckMultipacketRequestMessage(self.session, ComDCommand.MULTIPACKET_SEGMENT_TRANSMISSION)
-                        bayer_ack_message = ContourNextLinkBinaryMessage(CommandType.SEND_MESSAGE, self.session, ack_message.encode())
-                        self.send_message( bayer_ack_message.encode() )
-                        self.read_response0x81()
-
-                        # Save current segment
-                        for x in range(len(multi_packet_session.response)):
-                            segment.extend(multi_packet_session.response[x])
-
-                        all_segments.append(bytes(segment))
-                        segment = []
+                    block += page[pos:pos + event_size]
+                pos += event_size
+            if block:
+                blocks.append(bytes(block))
+        if dropped == 0:
+            return segment
+        logger.debug("# Get Pump History: dropped {0} records already received".format(dropped))
+        if not blocks:
+            return None
+        return Medtronic600SeriesDriver.encode_pump_segment(blocks, request_type)
 
-            elif decrypted.message_type == ComDCommand.END_HISTORY_TRANSMISSION:
-                logger.debug("## getPumpHistory got END_HISTORY_TRANSMISSION")
-                transmission_completed = True
-            else:
-                logger.warning("## getPumpHistory !!! UNKNOWN MESSAGE !!!")
-                logger.warning("## getPumpHistory response.messageType: {0:x}".format(decrypted.message_type))
+    @staticmethod
+    def encode_pump_segment(decoded_blocks, history_type=HistoryDataType.PUMP_DATA):
+        # Uncompressed UNMERGED_HISTORY_RESPONSE segment of 'decoded_blocks' (the reverse of decode_pump_segment)
+        block_size_const = 0x0800 # 2048
+        block_payload = bytearray()
+        for block in decoded_blocks:
+            block_payload += block
+            block_payload += bytes(block_size_const - 4 - len(block))
+            block_payload += struct.pack('>HH', len(block), MedtronicMessage.calculate_ccitt(block))
+        return struct.pack('>HBIIB', ComDCommand.UNMERGED_HISTORY_RESPONSE, history_type,
+                           len(block_payload), len(block_payload), 0) + bytes(block_payload)
+
+    def stream_pump_history(self, date_start, date_end, request_type=HistoryDataType.PUMP_DATA, callback=None,
+                            history_filter=None, queue_size=HISTORY_STREAM_QUEUE_SIZE, journal=None, sort=False):
+        # get_pump_history + process_pump_history, overlapped: a background thread decompresses and parses each segment
+        # while the next one is received. At most 'queue_size' received segments wait for the decoder.
+        # callback(events), from the decoder thread: the events of every segment, as soon as they are decoded
+        # (before post_process). Returns all events, post processed, like process_pump_history.
+        # sort: the events in time order (HistoryEventIndex.finish)
+        segments = queue.Queue(queue_size)
+        history_index = HistoryEventIndex()
+        timestamps = TimestampEngine()
+        errors = []
+
+        def decoder():
+            while True:
+                segment = segments.get()
+                if segment is None:
+                    break
+                if errors:
+                    continue # only drain the queue
+                try:
+                    events = Medtronic600SeriesDriver.decode_history_segment(segment, request_type, timestamps, history_filter,
+                                                                             self.block_cache)
+                    history_index.add(events, post_process=False)
+                    if callback is not None:
+                        callback(events)
+                except Exception as e:
+                    logger.error("History decoder failed: {0}".format(e))
+                    errors.append(e)
+
+        decoder_thread = threading.Thread(target=decoder, name="history-decoder", daemon=True)
+        decoder_thread.start()
+        try:
+            for segment in self.iter_pump_history(date_start, date_end, request_type, journal):
+                segments.put(segment)
+        finally:
+            segments.put(None)
+            decoder_thread.join()
+        if errors:
+            raise errors[0]
+
+        history_events = history_index.finish(sort)
+        if history_filter is not None:
+            history_events = [x for x in history_events if history_filter.accepts(x)]
+        return history_events
 
-        if transmission_completed:
-            return all_segments
+    def backfill_sensor_gaps(self, readings, gap_events=(), detector=None, journal=None):
+        # Requests SENSOR_DATA only for the gaps of 'readings' (see SensorGapDetector) and returns the readings
+        # that were missing, flagged as backfilled (backfilledData).
+        # The windows are saved in self.history_sync, the gaps in them aren't requested again.
+        detector = detector or SensorGapDetector()
+        if self.history_sync is None:
+            self.history_sync = HistorySyncState()
+        pump_serial = self.session.pump_serial
+        windows = detector.windows(readings, gap_events, self.history_sync.backfilled_windows(pump_serial))
+        known = set(x.rtc for x in readings)
+        backfilled = []
+        for from_rtc, to_rtc in windows:
+            logger.debug("# Sensor backfill: rtc 0x{0:X} - 0x{1:X}".format(from_rtc, to_rtc))
+            segments = list(self.iter_pump_history_range(from_rtc, to_rtc + SensorGapDetector.RECORD_SPAN_S,
+                                                         HistoryDataType.SENSOR_DATA, journal))
+            self.history_sync.add_backfilled_window(pump_serial, from_rtc, to_rtc)
+            for event in self.process_pump_history(segments, HistoryDataType.SENSOR_DATA):
+                if event.event_type == NGPHistoryEvent.EVENT_TYPE.GENERATED_SENSOR_GLUCOSE_READINGS_EXTENDED_ITEM \
+                        and from_rtc <= event.rtc <= to_rtc and event.rtc not in known:
+                    event.backfilledData = True
+                    known.add(event.rtc)
+                    backfilled.append(event)
+        logger.info("# Sensor backfill: {0} windows, {1} readings".format(len(windows), len(backfilled)))
+        return sorted(backfilled, key=operator.attrgetter('rtc'))
 
-        else:
-            logger.error("Transmission finished, but END_HISTORY_TRANSMISSION did not arrive")
+    @staticmethod
+    def merge_history(*history_events, sort=True):
+        # One time ordered iterator over several event lists (pump and sensor history): a k-way heap merge.
+        # History order is time order except around pump time changes, each list is (stable) sorted first.
+        # sort False: the lists are in time order already (e.g. HistoryEventIndex.finish(sort=True))
+        by_time = operator.attrgetter('timestamp')
+        if sort:
+            history_events = [sorted(events, key=by_time) for events in history_events]
+        return heapq.merge(*history_events, key=by_time)
+
+    def get_combined_history(self, date_start, date_end, history_filter=None, journal=None):
+        # Pump and sensor history in the current EHSM session (between begin_ehsm and finish_ehsm), as one
+        # time ordered iterator. Each history is decoded while it is received (stream_pump_history) and sorted
+        # once, when its index is finished; the merge only interleaves the two.
+        pump_events = self.stream_pump_history(date_start, date_end, HistoryDataType.PUMP_DATA,
+                                               history_filter=history_filter, journal=journal, sort=True)
+        sensor_events = self.stream_pump_history(date_start, date_end, HistoryDataType.SENSOR_DATA,
+                                                 history_filter=history_filter, journal=journal, sort=True)
+        return Medtronic600SeriesDriver.merge_history(pump_events, sensor_events, sort=False)
 
-    def decode_pump_segment(self, encoded_fragmented_segment, history_type=HistoryDataType.PUMP_DATA):
+    @staticmethod
+    def decode_pump_segment(encoded_fragmented_segment, history_type=HistoryDataType.PUMP_DATA, checksums=None):
+        # checksums: if a list, the CCITT of every returned block is appended to it
         decoded_blocks = []
         segment_payload = bytes(encoded_fragmented_segment)
 
@@ -5967,172 +7575,209 @@ class Medtronic600SeriesDriver( object ):
                     raise InvalidMessageError('Unexpected checksum in block')
                 else:
                     decoded_blocks.append(block_data)
+                    if checksums is not None:
+                        checksums.append(block_checksum)
         else:
             logger.error('Unknown history response message type')
             raise InvalidMessageError('Unknown history response message type')
 
         return decoded_blocks
 
-    def decode_events(self, decoded_blocks):
+    @staticmethod
+    def decode_events(decoded_blocks, timestamps=None, history_filter=None, correlation=False, block_cache=None,
+                      block_keys=None):
+        # All events of one decode run share a TimestampEngine (UTC offset looked up once, memoized conversions)
+        # history_filter: HistoryEventFilter, records it rejects are skipped unparsed
+        # (with 'correlation' the records post_process needs are kept too)
+        # block_cache/block_keys: HistoryBlockCache and the key of every block, cached blocks aren't parsed again
+        timestamps = timestamps or TimestampEngine()
+        if block_cache is None:
+            event_list = []
+            for page in decoded_blocks:
+                event_list.extend(Medtronic600SeriesDriver.parse_block(page, history_filter, correlation, timestamps))
+            return event_list
+        return block_cache.decode_events(decoded_blocks, block_keys, history_filter, correlation, timestamps)
+
+    @staticmethod
+    def parse_block(page, history_filter=None, correlation=False, timestamps=None):
+        # The events are views of the page, no copy per event
+        page = memoryview(page)
         event_list = []
+        pos = 0
+        while pos < len(page):
+            if history_filter is None or history_filter.decodes(page, pos, correlation):
+                event_list.extend(NGPHistoryEvent.decode_record(page, pos, timestamps))
+            pos += page[pos + 2] # event size
+        return event_list
+
+    def decode_sensor_readings(self, decoded_blocks, timestamps=None):
+        # Columnar alternative to decode_events for the sensor readings: SensorGlucoseReadings of all
+        # SENSOR_GLUCOSE_READINGS_EXTENDED events in the blocks (needs numpy)
+        events_data = []
         for page in decoded_blocks:
             pos = 0
-
             while pos < len(page):
-                event_size = struct.unpack('>B', page[pos + 2: pos + 3])[0]  # page[pos + 2]
-                event_data = page[pos: pos + event_size]  # page.slice(pos, pos + eventSize)
+                event_size = page[pos + 2]
+                if page[pos] == NGPHistoryEvent.EVENT_TYPE.SENSOR_GLUCOSE_READINGS_EXTENDED:
+                    events_data.append(page[pos: pos + event_size])
                 pos += event_size
-                event_list.extend(NGPHistoryEvent(event_data).event_instance().all_nested_events())
-        return event_list
-
-    def process_pump_history(self, history_segments, history_type=HistoryDataType.PUMP_DATA):
-        history_events = []
-        for segment in history_segments:
-            decoded_blocks = self.decode_pump_segment(segment, history_type)
-            history_events += self.decode_events(decoded_blocks)
-        for event in history_events:
-            event.post_process(history_events)
-        return history_events
-
-    def get_pump_basal_pattern_current_number(self):
-        expected_segments = 0
-        retry = 0
-        all_segments = []
-        segment = []
-        multi_packet_session = None
-        decrypted = None
-
-        transmission_completed = False
-        while transmission_completed != True:
-
-            if multi_packet_session != None and multi_packet_session.payload_complete() == False:
-                while True:
-                    if expected_segments < 1:
-                        packet_number, missing = multi_packet_session.missing_segments()
-                        logger.debug("Sending MultipacketResendPacketsMessage")
-                        ack_message = MultipacketResendPacketsMessage(self.session, packet_number, missing)
-                        bayer_ack_message = ContourNextLinkBinaryMessage(CommandType.SEND_MESSAGE, self.session,ack_message.encode())
-                        self.send_message(bayer_ack_message.encode())
-                        self.read_response0x81()
-
-                        expected_segments = missing
-
-                    try:
-                        # timeout adjusted for efficiency and to allow for large gaps of missing segments as the pump will keep sending until done
-                        if multi_packet_session.segments_filled == 0:
-                            # pump may have missed the initial ack, we need to wait the max timeout period
-                            timeout = Medtronic600SeriesDriver.READ_TIMEOUT_MS
-                        else:
-                            timeout = Medtronic600SeriesDriver.MULTIPACKET_SEGMENT_MS * expected_segments
-                            if timeout < Medtronic600SeriesDriver.MULTIPACKET_TIMEOUT_MS:
-                                timeout = Medtronic600SeriesDriver.MULTIPACKET_TIMEOUT_MS
-
-                        decrypted = self.get_medtronic_message([ComDCommand.INITIATE_MULTIPACKET_TRANSFER,
-                                                                ComDCommand.MULTIPACKET_SEGMENT_TRANSMISSION,
-                                                                ComDCommand.MULTIPACKET_RESEND_PACKETS,
-                                                                ComDCommand.END_HISTORY_TRANSMISSION,
-                                                                ComDCommand.READ_BASAL_PATTERN_RESPONSE,
-                                                                ComDCommand.HIGH_SPEED_MODE_COMMAND,
-                                                                ComDCommand.NAK_COMMAND], timeout)
-                        retry = 0
-                        break
-                    except:
-                        retry = retry + 1
-                        if multi_packet_session.segments_filled == 0:
-                            self.clear_message()
-                            logger.error("Multisession timeout: failed no segments filled")
-                        elif (multi_packet_session.segments_filled * 100) / multi_packet_session.packets_to_fetch < 20:
-                            self.clear_message()
-                            logger.error("Multisession timeout: failed, missed packets > 80%")
-                        elif retry >= Medtronic600SeriesDriver.MULTIPACKET_SEGMENT_RETRY:
-                            self.clear_message()
-                            logger.error("Multisession timeout: retry failed")
-
-                        logger.error("Multisession timeout: count: {0}/{1} expecting: {2} retry: {3}".format(multi_packet_session.segments_filled, multi_packet_session.packets_to_fetch, expected_segments, retry))
-                        expected_segments = 0
+        return SensorGlucoseReadings(events_data, timestamps)
 
-                    if retry > 0:
-                        break
-
-            else:
-                decrypted = self.get_medtronic_message([ComDCommand.INITIATE_MULTIPACKET_TRANSFER,
-                                                               ComDCommand.MULTIPACKET_SEGMENT_TRANSMISSION,
-                                                               ComDCommand.MULTIPACKET_RESEND_PACKETS,
-                                                               ComDCommand.END_HISTORY_TRANSMISSION,
-                                                               ComDCommand.READ_BASAL_PATTERN_RESPONSE,
-                                                               ComDCommand.HIGH_SPEED_MODE_COMMAND,
-                                                               ComDCommand.NAK_COMMAND])
-
-
-            if decrypted.message_type == ComDCommand.NAK_COMMAND:
-                self.clear_message()
-                # TODO Add decode NAK command
-                logger.info("## Pump sent a NAK 0x{0:X}:0x{1:X}".format(decrypted.nakcmd, decrypted.nakcode))
-
-            if decrypted.message_type == ComDCommand.HIGH_SPEED_MODE_COMMAND:
-                logger.debug("## getPumpHistory consumed HIGH_SPEED_MODE_COMMAND={0}".format(decrypted.ehs_mmode))
-                if decrypted.ehs_mmode == 0:
-                    pass
-                else:
-                    transmission_completed = True
-
-            elif decrypted.message_type == ComDCommand.INITIATE_MULTIPACKET_TRANSFER:
-                logger.info("### getPumpHistory got INITIATE_MULTIPACKET_TRANSFER")
-
-                multi_packet_session = MultipacketSession(decrypted)
-
-                logger.info("### session_size: {0}".format(multi_packet_session.session_size))
-                logger.info("### packet_size: {0}".format(multi_packet_session.packet_size))
-                logger.info("### last_packet_size: {0}".format(multi_packet_session.last_packet_size))
-                logger.info("### packets_to_fetch: {0}".format(multi_packet_session.packets_to_fetch))
-                logger.info("### last_packet_number: {0}".format(multi_packet_session.last_packet_number))
-                logger.info("### segments_filled: {0}".format(multi_packet_session.segments_filled))
-
-
-                ack_message = AckMultipacketRequestMessage(self.session, ComDCommand.INITIATE_MULTIPACKET_TRANSFER)
-                bayer_ack_message = ContourNextLinkBinaryMessage(CommandType.SEND_MESSAGE, self.session, ack_message.encode())
-                self.send_message( bayer_ack_message.encode() )
-                self.read_response0x81()
+    @staticmethod
+    def decode_history_segment(segment, history_type=HistoryDataType.PUMP_DATA, timestamps=None, history_filter=None,
+                               block_cache=None):
+        # Decompress, check and parse one segment
+        if block_cache is None:
+            return Medtronic600SeriesDriver.decode_events(Medtronic600SeriesDriver.decode_pump_segment(segment, history_type),
+                                                         timestamps, history_filter, True)
+        checksums = []
+        decoded_blocks = Medtronic600SeriesDriver.decode_pump_segment(segment, history_type, checksums)
+        block_keys = [(history_type, checksum, len(block)) for checksum, block in zip(checksums, decoded_blocks)]
+        return Medtronic600SeriesDriver.decode_events(decoded_blocks, timestamps, history_filter, True, block_cache, block_keys)
 
-                expected_segments = multi_packet_session.packets_to_fetch
+    @staticmethod
+    def decode_history_segment_worker(segment, history_type=HistoryDataType.PUMP_DATA, history_filter=None):
+        # decode_history_segment in a worker process: the timestamps are decoded here, not lazily in the parent
+        events = Medtronic600SeriesDriver.decode_history_segment(segment, history_type, None, history_filter)
+        for event in events:
+            event.timestamp
+        return events
+
+    def decode_history_segments(self, history_segments, history_type=HistoryDataType.PUMP_DATA, workers=None,
+                                timestamps=None, history_filter=None):
+        # Events of every segment, one list per segment in segment order (with the events post_process needs,
+        # if a history_filter is given).
+        # Segments are independent until post_process, so with workers > 1 they are decoded in parallel
+        # in a ProcessPoolExecutor (LZO, CRC, parsing and the timestamps are CPU bound, threads wouldn't run in parallel).
+        history_segments = list(history_segments)
+        if workers is None:
+            workers = self.HISTORY_DECODE_WORKERS
+        cpu_count = os.cpu_count() or 1
+        if workers == 0:
+            workers = cpu_count
+        workers = min(workers, len(history_segments))
+
+        if workers <= 1 or cpu_count == 1:
+            return [Medtronic600SeriesDriver.decode_history_segment(segment, history_type, timestamps, history_filter,
+                                                                    self.block_cache)
+                    for segment in history_segments]
+
+        logger.debug("Decoding {0} history segments with {1} workers".format(len(history_segments), workers))
+        # Each worker process has its own TimestampEngine (and no block_cache)
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            segment_events = list(executor.map(Medtronic600SeriesDriver.decode_history_segment_worker, history_segments,
+                                               itertools.repeat(history_type), itertools.repeat(history_filter)))
+        # (for the dates of the event data that are still decoded lazily)
+        timestamps = timestamps or TimestampEngine()
+        for events in segment_events:
+            for event in events:
+                event._timestamps = timestamps
+        return segment_events
+
+    def process_pump_history(self, history_segments, history_type=HistoryDataType.PUMP_DATA, workers=None,
+                             history_filter=None):
+        # workers: see decode_history_segments
+        # history_filter: HistoryEventFilter, only the events it accepts are returned
+        history_index = HistoryEventIndex()
+        timestamps = TimestampEngine()
+        for events in self.decode_history_segments(history_segments, history_type, workers, timestamps, history_filter):
+            history_index.add(events, post_process=False)
+        history_events = history_index.finish()
+        if history_filter is not None:
+            history_events = [x for x in history_events if history_filter.accepts(x)]
+        return history_events
 
-                logger.debug("Start multipacket session")
+    def process_archived_history(self, archive, history_type=HistoryDataType.PUMP_DATA, history_filter=None, pump_serial=None):
+        # process_pump_history over a HistoryArchive: only the blocks that overlap the time window of 'history_filter'
+        # (widened for post_process) are parsed
+        start = end = None
+        if history_filter is not None:
+            start, end = history_filter.correlation_window()
+        history_index = HistoryEventIndex()
+        timestamps = TimestampEngine()
+        history_index.add(self.decode_events(archive.read_blocks(history_type, pump_serial, start, end), timestamps,
+                                             history_filter, True), post_process=False)
+        history_events = history_index.finish()
+        if history_filter is not None:
+            history_events = [x for x in history_events if history_filter.accepts(x)]
+        return history_events
 
-            elif decrypted.message_type == ComDCommand.MULTIPACKET_SEGMENT_TRANSMISSION:
-                logger.debug("## getPumpHistory got MULTIPACKET_SEGMENT_TRANSMISSION")
+    def store_pump_history(self, history_segments, history_type=HistoryDataType.PUMP_DATA, store=None, workers=None,
+                           history_filter=None):
+        # process_pump_history that also saves the events in a HistoryEventStore, one bulk insert per segment
+        if store is None:
+            store = HistoryEventStore()
+        history_index = HistoryEventIndex()
+        timestamps = TimestampEngine()
+        segment_events = self.decode_history_segments(history_segments, history_type, workers, timestamps, history_filter)
+        for events in segment_events:
+            history_index.add(events, post_process=False)
+        history_events = history_index.finish()
+
+        pump_serial = self.session.pump_serial
+        for events in segment_events:
+            if history_filter is not None:
+                events = [x for x in events if history_filter.accepts(x)]
+            store.add_events(pump_serial, history_type, events)
+        if history_filter is not None:
+            history_events = [x for x in history_events if history_filter.accepts(x)]
+        return history_events
 
-                if multi_packet_session == None:
-                    logger.debug("multipacketSession not initiated before segment received")
-                if multi_packet_session.payload_complete():
-                    logger.debug("Multisession Complete - packet not needed")
-                else:
-                    if multi_packet_session.add_segment(decrypted):
-                        expected_segments = expected_segments - 1
+    def history_sync_window(self, request_type=HistoryDataType.PUMP_DATA):
+        # (date_start, date_end) for the next incremental sync: from the last synced record minus HISTORY_SYNC_OVERLAP_S
+        if self.history_sync is None:
+            self.history_sync = HistorySyncState()
+        last_rtc, fingerprints = self.history_sync.load(self.session.pump_serial, request_type)
+        now = datetime.datetime.now()
+        oldest = now - timedelta(seconds=Medtronic600SeriesDriver.HISTORY_SYNC_MAX_S)
+        if last_rtc is None:
+            date_start = now - timedelta(seconds=Medtronic600SeriesDriver.HISTORY_SYNC_FIRST_S)
+        else:
+            date_start = max(DateTimeHelper.date_from_rtc(last_rtc - Medtronic600SeriesDriver.HISTORY_SYNC_OVERLAP_S, self.offset), oldest)
+        return date_start, datetime.datetime.max
+
+    def history_sync_update(self, history_events, request_type=HistoryDataType.PUMP_DATA):
+        # Drops the events the last sync already returned (same raw record), moves the high-water mark.
+        # Call it once the events of the history_sync_window request are decoded; returns the new events.
+        if self.history_sync is None:
+            self.history_sync = HistorySyncState()
+        pump_serial = self.session.pump_serial
+        last_rtc, seen = self.history_sync.load(pump_serial, request_type)
+
+        # Events older than the overlap of the last sync were returned before it
+        delivered_before = None if last_rtc is None else last_rtc - Medtronic600SeriesDriver.HISTORY_SYNC_OVERLAP_S
+
+        new_events = []
+        fingerprints = {}
+        for event in history_events:
+            fingerprint = event.fingerprint
+            fingerprints[fingerprint] = event.rtc
+            if fingerprint not in seen and (delivered_before is None or event.rtc >= delivered_before):
+                new_events.append(event)
+
+        if fingerprints:
+            last_rtc = max(fingerprints.values()) if last_rtc is None else max(last_rtc, max(fingerprints.values()))
+            keep_from = last_rtc - Medtronic600SeriesDriver.HISTORY_SYNC_OVERLAP_S
+            # Records the next (overlapping) sync can get again
+            keep = set(x for x, rtc in fingerprints.items() if rtc >= keep_from)
+            self.history_sync.save(pump_serial, request_type, last_rtc, keep)
+        logger.info("# History sync: {0} events, {1} new, mark: {2}".format(len(history_events), len(new_events), last_rtc))
+        return new_events
+
+    def sync_pump_history(self, request_type=HistoryDataType.PUMP_DATA, history_filter=None, journal=None):
+        # Incremental history: only the events since the last sync of this pump and history type
+        date_start, date_end = self.history_sync_window(request_type)
+        history_pages = self.get_pump_history(date_start, date_end, request_type, journal)
+        return self.history_sync_update(self.process_pump_history(history_pages, request_type, history_filter=history_filter),
+                                        request_type)
 
-                    if multi_packet_session.payload_complete():
-                        logger.debug("Multisession Complete")
-                        ack_message = AckMultipacketRequestMessage(self.session, ComDCommand.MULTIPACKET_SEGMENT_TRANSMISSION)
-                        bayer_ack_message = ContourNextLinkBinaryMessage(CommandType.SEND_MESSAGE, self.session, ack_message.encode())
-                        self.send_message( bayer_ack_message.encode() )
-                        self.read_response0x81()
-
-                        # Save current segment
-                        for x in range(len(multi_packet_session.response)):
-                            segment.extend(multi_packet_session.response[x])
-
-                        all_segments.append(bytes(segment))
-                        segment = []
-
-            elif decrypted.message_type == ComDCommand.END_HISTORY_TRANSMISSION:
-                logger.debug("## getPumpHistory got END_HISTORY_TRANSMISSION")
-                transmission_completed = True
-            elif decrypted.message_type == ComDCommand.READ_BASAL_PATTERN_RESPONSE:
-                logger.debug("## getPumpHistory got READ_BASAL_PATTERN_RESPONSE")
-                all_segments.append(bytes(decrypted.response_payload)[1:])
-                transmission_completed = True
-            else:
-                logger.warning("## getPumpHistory !!! UNKNOWN MESSAGE !!!")
-                logger.warning("## getPumpHistory response.messageType: {0:x}".format(decrypted.message_type))
+    def get_pump_basal_pattern_current_number(self):
+        transfer = MultipacketTransfer(self, [ComDCommand.READ_BASAL_PATTERN_RESPONSE], end_on_high_speed_mode=True)
+        self.multipacket_transfer = transfer
+        all_segments = list(transfer.segments())
+        if transfer.end_message.message_type == ComDCommand.READ_BASAL_PATTERN_RESPONSE:
+            all_segments.append(bytes(transfer.end_message.response_payload)[1:])
+        transmission_completed = transfer.completed
 
         if transmission_completed:
             for segment in all_segments:
@@ -6175,3 +7820,453 @@ class Medtronic600SeriesDriver( object ):
             all_basal_patterns.update({NGPConstants.BASAL_PATTERN_NAME[i] : self.get_pump_basal_pattern_current_number()})
 
         return all_basal_patterns
+
+class CnlTransport( object ):
+    # The driver's link to the CNL (Medtronic600SeriesDriver.device), in USB frames of up to 64 bytes ('ABC' header):
+    # open() -> True if the CNL is there, read(max_length, timeout_ms) -> one frame, or [] after timeout_ms,
+    # write(frame), close(). The names (and get_*_string) are hidapi's. timeout_ms 0 doesn't wait: read() returns
+    # a frame that is already there or []. (hidapi's own read() blocks for timeout_ms 0, see HidTransport.read.)
+    def open(self):
+        return True
+
+    def close(self):
+        pass
+
+    def read(self, max_length, timeout_ms = 0):
+        raise NotImplementedError
+
+    def write(self, data):
+        raise NotImplementedError
+
+    def get_manufacturer_string(self):
+        return ''
+
+    def get_product_string(self):
+        return ''
+
+    def get_serial_number_string(self):
+        return ''
+
+class HidTransport( CnlTransport ):
+    # The CNL on local USB (hidapi)
+    def __init__(self, vendor_id = 0x1a79, product_id = 0x6210):
+        self.vendor_id = vendor_id
+        self.product_id = product_id
+        self.device = None
+
+    def open(self):
+        if hid is None:
+            logger.error("hidapi is not installed")
+            return False
+        for d in hid.enumerate(self.vendor_id, self.product_id):
+            if d['vendor_id'] == self.vendor_id and d['product_id'] == self.product_id:
+                self.device = hid.device()
+                self.device.open(self.vendor_id, self.product_id)
+
+                logger.debug("Manufacturer: %s" % self.device.get_manufacturer_string())
+                logger.debug("Product: %s" % self.device.get_product_string())
+                logger.debug("Serial No: %s" % self.device.get_serial_number_string())
+                return True
+        return False
+
+    def close(self):
+        self.device.close()
+
+    def read(self, max_length, timeout_ms = 0):
+        if timeout_ms > 0:
+            return self.device.read(max_length, timeout_ms = timeout_ms)
+        # hidapi waits for a frame with timeout_ms 0, in non-blocking mode it doesn't
+        self.device.set_nonblocking(1)
+        try:
+            return self.device.read(max_length)
+        finally:
+            self.device.set_nonblocking(0)
+
+    def write(self, data):
+        return self.device.write(data)
+
+    def get_manufacturer_string(self):
+        return self.device.get_manufacturer_string()
+
+    def get_product_string(self):
+        return self.device.get_product_string()
+
+    def get_serial_number_string(self):
+        return self.device.get_serial_number_string()
+
+class UsbReader( object ):
+    # Optional background reader of the CNL (Medtronic600SeriesDriver.start_usb_reader): a thread keeps draining the
+    # transport into a bounded queue of complete messages, so the CNL is read while the driver decrypts and decodes
+    # (no 'Full CNL receive buffer' during multipacket transfers). The transports aren't thread safe: the thread
+    # does the writes as well, between two reads of at most 'poll_ms'.
+    def __init__(self, device, max_messages = 256, poll_ms = 5):
+        self.device = device
+        self.poll_ms = poll_ms
+        self.messages = queue.Queue(max_messages)
+        self.writes = queue.Queue()
+        self.error = None
+        self.stopped = threading.Event()
+        self.thread = None
+        # Messages read, most messages waiting at once, times the queue was full (the thread waited for the driver)
+        self.messages_read = 0
+        self.max_queued = 0
+        self.full = 0
+
+    def __str__(self):
+        return "UsbReader: {0} messages, max queued: {1}, full: {2}".format(self.messages_read, self.max_queued, self.full)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='UsbReader', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        # Whatever the driver wrote last
+        self.write_frames()
+
+    def write(self, data):
+        if self.error is not None:
+            raise self.error
+        self.writes.put(bytes(data))
+
+    def get(self, timeout_ms):
+        # The next message, like Medtronic600SeriesDriver.read_message
+        try:
+            message = self.messages.get(timeout = timeout_ms / 1000.0)
+        except queue.Empty:
+            raise TimeoutException('Timeout waiting for message')
+        if message is None:
+            # The thread is gone, see 'error'
+            self.messages.put(None)
+            raise self.error
+        return message
+
+    def write_frames(self):
+        while True:
+            try:
+                frame = self.writes.get_nowait()
+            except queue.Empty:
+                return
+            self.device.write(frame)
+
+    def put(self, message):
+        if self.messages.full():
+            self.full += 1
+        while not self.stopped.is_set():
+            try:
+                self.messages.put(message, timeout = 0.1)
+                break
+            except queue.Full:
+                continue
+        self.max_queued = max(self.max_queued, self.messages.qsize())
+
+    def run(self):
+        try:
+            while not self.stopped.is_set():
+                self.write_frames()
+                data = self.device.read(Medtronic600SeriesDriver.USB_BLOCKSIZE, timeout_ms = self.poll_ms)
+                if not data:
+                    continue
+                try:
+                    message = Medtronic600SeriesDriver.assemble_message(self.device, Medtronic600SeriesDriver.READ_TIMEOUT_MS, data)
+                except TimeoutException:
+                    logger.error("## UsbReader: timeout waiting for the rest of a message")
+                    continue
+                self.messages_read += 1
+                self.put(message)
+        except Exception as e:
+            logger.error("## UsbReader: reading the CNL failed", exc_info = True)
+            self.error = e
+            self.put(None)
+
+class HidrawTransport( CnlTransport ):
+    # The CNL on Linux without hidapi: /dev/hidrawN ('path', or found by the USB ids in sysfs), waited for with epoll.
+    # Every wakeup drains all queued reports into a preallocated buffer of 'reports' 64 byte slots and read()
+    # hands them out from there, so a multipacket burst costs one poll and one read per report. read() returns
+    # a copy (bytes): the next drain fills the slots again.
+    SYSFS_HIDRAW = '/sys/class/hidraw'
+
+    def __init__(self, vendor_id = 0x1a79, product_id = 0x6210, path = None, reports = 256):
+        self.vendor_id = vendor_id
+        self.product_id = product_id
+        self.path = path
+        self.buffer = bytearray(reports * Medtronic600SeriesDriver.USB_BLOCKSIZE)
+        self.view = memoryview(self.buffer)
+        # Size of the report in every slot, slots filled and slot read next
+        self.sizes = [0] * reports
+        self.filled = 0
+        self.next = 0
+        self.uevent = {}
+        self.fd = None
+        self.reader = None
+        self.poll = None
+        # Reports drained and wakeups, for the report rate per wakeup
+        self.reports_read = 0
+        self.wakeups = 0
+
+    @classmethod
+    def find(cls, vendor_id, product_id):
+        # /dev/hidrawN of the first device with these USB ids, its uevent ({'HID_NAME': ..., ...})
+        if not os.path.isdir(cls.SYSFS_HIDRAW):
+            return None, {}
+        for name in sorted(os.listdir(cls.SYSFS_HIDRAW)):
+            try:
+                with open(os.path.join(cls.SYSFS_HIDRAW, name, 'device', 'uevent')) as uevent_file:
+                    uevent = dict(line.rstrip('\n').split('=', 1) for line in uevent_file if '=' in line)
+            except OSError:
+                continue
+            # HID_ID=0003:00001A79:00006210 (bus:vendor:product)
+            hid_id = uevent.get('HID_ID', '').split(':')
+            if len(hid_id) == 3 and int(hid_id[1], 16) == vendor_id and int(hid_id[2], 16) == product_id:
+                return os.path.join('/dev', name), uevent
+        return None, {}
+
+    def open(self):
+        path = self.path
+        if path is None:
+            path, self.uevent = self.find(self.vendor_id, self.product_id)
+            if path is None:
+                return False
+        self.open_fd(os.open(path, os.O_RDWR | os.O_NONBLOCK))
+        logger.debug("hidraw: {0} {1}".format(path, self.uevent.get('HID_NAME', '')))
+        return True
+
+    def open_fd(self, fd):
+        # A non-blocking file descriptor with one report per read(), e.g. an opened /dev/hidrawN
+        self.fd = fd
+        self.reader = io.FileIO(fd, 'rb', closefd = False)
+        self.poll = select.epoll()
+        self.poll.register(fd, select.EPOLLIN)
+        self.filled = 0
+        self.next = 0
+
+    def close(self):
+        self.poll.close()
+        self.reader.close()
+        os.close(self.fd)
+
+    def drain(self, timeout_ms):
+        # Waits up to timeout_ms for reports, then reads all queued ones into the buffer (False: timeout)
+        self.filled = 0
+        self.next = 0
+        if not self.poll.poll(timeout_ms / 1000.0 if timeout_ms >= 0 else -1):
+            return False
+        self.wakeups += 1
+        block_size = Medtronic600SeriesDriver.USB_BLOCKSIZE
+        while self.filled < len(self.sizes):
+            start = self.filled * block_size
+            size = self.reader.readinto(self.view[start:start + block_size])
+            # None: nothing more queued
+            if not size:
+                break
+            self.sizes[self.filled] = size
+            self.filled += 1
+        self.reports_read += self.filled
+        return self.filled > 0
+
+    def read(self, max_length, timeout_ms = 0):
+        if self.next == self.filled and not self.drain(timeout_ms):
+            return []
+        start = self.next * Medtronic600SeriesDriver.USB_BLOCKSIZE
+        size = min(self.sizes[self.next], max_length)
+        self.next += 1
+        return bytes(self.view[start:start + size])
+
+    def write(self, data):
+        data = bytes(data)
+        while True:
+            try:
+                return os.write(self.fd, data)
+            except BlockingIOError:
+                select.select([], [self.fd], [], 1.0)
+
+    def get_product_string(self):
+        return self.uevent.get('HID_NAME', '')
+
+    def get_serial_number_string(self):
+        return self.uevent.get('HID_UNIQ', '')
+
+class FrameSocket( object ):
+    # Batches of USB frames over a stream socket: [32bitBE] batch size, then per frame [8bit] size, frame
+    HEADER = struct.Struct('>I')
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = bytearray()
+        if sock.family in (socket.AF_INET, socket.AF_INET6):
+            # Batches are sent when due, not when Nagle decides
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    @staticmethod
+    def connect(address, timeout = None):
+        # address: (host, port) for TCP, a path for a Unix socket
+        if isinstance(address, str):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        sock.connect(address)
+        sock.settimeout(None)
+        return FrameSocket(sock)
+
+    @staticmethod
+    def listen(address):
+        if isinstance(address, str):
+            if os.path.exists(address):
+                os.remove(address)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(address)
+        sock.listen(1)
+        return sock
+
+    def send(self, frames):
+        batch = bytearray()
+        for frame in frames:
+            batch.append(len(frame))
+            batch += frame
+        self.sock.sendall(self.HEADER.pack(len(batch)) + batch)
+
+    def receive(self, timeout):
+        # The frames of the batches complete within 'timeout' seconds (may be none)
+        frames = []
+        deadline = time.monotonic() + timeout
+        while not frames:
+            if select.select([self.sock], [], [], max(deadline - time.monotonic(), 0))[0]:
+                data = self.sock.recv(65536)
+                if not data:
+                    raise ConnectionError("Bridge connection closed")
+                self.buffer += data
+            while len(self.buffer) >= self.HEADER.size:
+                size = self.HEADER.unpack_from(self.buffer, 0)[0]
+                if len(self.buffer) < self.HEADER.size + size:
+                    break
+                pos = self.HEADER.size
+                while pos < self.HEADER.size + size:
+                    frames.append(bytes(self.buffer[pos + 1:pos + 1 + self.buffer[pos]]))
+                    pos += 1 + self.buffer[pos]
+                del self.buffer[0:pos]
+            if time.monotonic() >= deadline:
+                break
+        return frames
+
+    def close(self):
+        self.sock.close()
+
+class SocketTransport( CnlTransport ):
+    # The CNL of a TransportBridge on another machine (or process), over TCP ((host, port)) or a Unix socket (path).
+    # Written frames wait for the next read (the driver always reads after a message) or until 'batch_frames'
+    # are there, and go out in one batch; the bridge sends the frames it read in batches as well.
+    def __init__(self, address, batch_frames = 32, connect_timeout = 10):
+        self.address = address
+        self.batch_frames = batch_frames
+        self.connect_timeout = connect_timeout
+        self.connection = None
+        self.pending = []
+        self.received = collections.deque()
+
+    def open(self):
+        try:
+            self.connection = FrameSocket.connect(self.address, self.connect_timeout)
+        except OSError:
+            logger.error("Cannot connect to the bridge {0}".format(self.address), exc_info = True)
+            return False
+        return True
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    def flush(self):
+        if self.pending:
+            self.connection.send(self.pending)
+            self.pending = []
+
+    def write(self, data):
+        self.pending.append(bytes(data))
+        if len(self.pending) >= self.batch_frames:
+            self.flush()
+        return len(data)
+
+    def read(self, max_length, timeout_ms = 0):
+        self.flush()
+        if not self.received:
+            self.received.extend(self.connection.receive(max(timeout_ms, 0) / 1000.0))
+        if not self.received:
+            return []
+        return list(self.received.popleft()[0:max_length])
+
+    def get_product_string(self):
+        return 'Bridge {0}'.format(self.address)
+
+class TransportBridge( object ):
+    # Agent next to the CNL: forwards the frames of 'transport' (the CNL on local USB if None) to one
+    # SocketTransport client at a time on 'address' ((host, port) or a Unix socket path), and the client's frames back.
+    # The transport is only read while a client is connected, every 'poll_ms' for the client's frames in between;
+    # the frames read together (up to 'batch_frames') go out as one batch.
+    def __init__(self, address, transport = None, poll_ms = 5, batch_frames = 32):
+        self.address = address
+        self.transport = transport if transport is not None else HidTransport()
+        self.poll_ms = poll_ms
+        self.batch_frames = batch_frames
+        self.listener = FrameSocket.listen(address)
+        self.stopped = threading.Event()
+        self.thread = None
+        self.frames_in = 0
+        self.frames_out = 0
+        self.batches_out = 0
+
+    @property
+    def port(self):
+        # The TCP port listened on (for address ('host', 0))
+        return self.listener.getsockname()[1]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve, name='TransportBridge', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.listener.close()
+
+    def serve(self):
+        if not self.transport.open():
+            logger.error("TransportBridge: no CNL")
+            return
+        try:
+            while not self.stopped.is_set():
+                if not select.select([self.listener], [], [], 0.2)[0]:
+                    continue
+                sock, peer = self.listener.accept()
+                logger.info("TransportBridge: client {0}".format(peer))
+                connection = FrameSocket(sock)
+                try:
+                    self.forward(connection)
+                except (ConnectionError, OSError):
+                    logger.info("TransportBridge: client {0} gone".format(peer))
+                finally:
+                    connection.close()
+        finally:
+            self.transport.close()
+
+    def forward(self, connection):
+        while not self.stopped.is_set():
+            for frame in connection.receive(0):
+                self.transport.write(frame)
+                self.frames_in += 1
+            frames = []
+            data = self.transport.read(Medtronic600SeriesDriver.USB_BLOCKSIZE, timeout_ms = self.poll_ms)
+            while data:
+                frames.append(bytes(data))
+                if len(frames) >= self.batch_frames:
+                    break
+                data = self.transport.read(Medtronic600SeriesDriver.USB_BLOCKSIZE, timeout_ms = 0)
+            if frames:
+                connection.send(frames)
+                self.frames_out += len(frames)
+                self.batches_out += 1
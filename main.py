@@ -16,14 +16,20 @@ import driver.cnl24lib as cnl24lib
 import binascii
 import datetime
 
-import pickle # needed for local history export
-
 if __name__ == '__main__':
 
     mt = cnl24lib.Medtronic600SeriesDriver()
 
     pump_status = {}
 
+    history_store = cnl24lib.HistoryEventStore()
+    history_archive = cnl24lib.HistoryArchive()
+    # Segments of downloads that broke off: the next run only requests the rest
+    history_journal = cnl24lib.HistoryJournal()
+    # Blocks of earlier reads aren't parsed again
+    mt.block_cache = cnl24lib.HistoryBlockCache(store=history_store)
+    mt.block_cache.warm_up()
+
     if mt.open_device():
         logger.info("Open USB")
 
@@ -58,38 +64,61 @@ if __name__ == '__main__':
                                 logger.info("Pump time: {0}".format(mt.pump_time))
                                 logger.info("Pump time drift: {0}".format(mt.pump_time_drift))
 
-                                # !!! Max timedelta = 10 days
-                                # start_date = datetime.datetime.now() - datetime.timedelta(days=10)
-                                # TODO find a solution how to set the time to the nearest minute
-                                start_date = datetime.datetime.now() - datetime.timedelta(minutes=30)
-                                # end_date = datetime.datetime.now() - datetime.timedelta(days=70)
-                                end_date = datetime.datetime.max
-
-                                # Sensor history = cnl24lib.HistoryDataType.SENSOR_DATA
-                                # Pump history = cnl24lib.HistoryDataType.PUMP_DATA
-                                history_type = cnl24lib.HistoryDataType.PUMP_DATA
-
-                                history_info = mt.get_pump_history_info(start_date, end_date, history_type)
-
-                                logger.info("ReadHistoryInfo Start : {0}".format(history_info.from_date))
-                                logger.info("ReadHistoryInfo End   : {0}".format(history_info.to_date))
-                                logger.info("ReadHistoryInfo Size  : {0}".format(history_info.length))
-                                logger.info("ReadHistoryInfo Block : {0}".format(history_info.blocks))
-
-
-                                history_pages = mt.get_pump_history(start_date, end_date, history_type)
-
-                                # Dump 'history_pages' for offline parse. See 'test_history.py'
-                                with open('history_data.dat', 'wb') as output:
-                                   pickle.dump(history_pages, output)
-
-                                events = mt.process_pump_history(history_pages, history_type)
+                                # Pump and sensor history in this EHSM session
+                                history_events = []
+                                for history_type in (cnl24lib.HistoryDataType.PUMP_DATA, cnl24lib.HistoryDataType.SENSOR_DATA):
+
+                                    # Incremental sync: from the last synced event (minus an overlap) to now.
+                                    # The first sync of a pump reads the last 24 hours, never more than 10 days.
+                                    start_date, end_date = mt.history_sync_window(history_type)
+
+                                    history_info = mt.get_pump_history_info(start_date, end_date, history_type)
+
+                                    logger.info("ReadHistoryInfo Type  : {0}".format(history_type))
+                                    logger.info("ReadHistoryInfo Start : {0}".format(history_info.from_date))
+                                    logger.info("ReadHistoryInfo End   : {0}".format(history_info.to_date))
+                                    logger.info("ReadHistoryInfo Size  : {0}".format(history_info.length))
+                                    logger.info("ReadHistoryInfo Block : {0}".format(history_info.blocks))
+
+                                    # Newest data first, in chunks sized from the info above and the transfer rate
+                                    history_pages = mt.get_pump_history_chunked(start_date, end_date, history_type, history_info,
+                                                                                journal=history_journal)
+                                    if not mt.history_plan.complete:
+                                        logger.warning("History incomplete: {0}".format(mt.history_plan))
+
+                                    # Raw segments for offline processing, see 'benchmark_history.py'
+                                    for page in history_pages:
+                                        history_archive.append(mt.session.pump_serial, history_type, page)
+
+                                    # Decoded events are saved in 'history_events.sqlite3' for offline queries. See 'test_history.py'
+                                    events = mt.store_pump_history(history_pages, history_type, history_store)
+                                    logger.info("Block cache: {0} hits, {1} misses".format(mt.block_cache.hits, mt.block_cache.misses))
+                                    # Only the events the previous syncs have not returned
+                                    history_events.append(mt.history_sync_update(events, history_type))
+
+                                # Sensor readings lost in the last 24 hours: request only their rtc windows again
+                                since = datetime.datetime.now() - datetime.timedelta(days=1)
+                                readings = history_store.sensor_glucose(mt.session.pump_serial, since)
+                                gap_events = history_store.query(mt.session.pump_serial,
+                                                                 [cnl24lib.NGPHistoryEvent.EVENT_TYPE.SENSOR_GLUCOSE_GAP], since)
+                                backfilled = mt.backfill_sensor_gaps(readings, gap_events, journal=history_journal)
+                                history_store.add_events(mt.session.pump_serial, cnl24lib.HistoryDataType.SENSOR_DATA, backfilled)
+                                history_events.append(backfilled)
+
+                                # Both histories, in time order
                                 print("# All events:")
-                                for ev in events:
+                                for ev in mt.merge_history(*history_events):
                                     print(ev)
                                 print("# End events")
 
 
+                                # Settings are only read again when they expired or the history shows a change
+                                mt.settings_cache = cnl24lib.PumpSettingsCache()
+                                for events in history_events:
+                                    mt.settings_cache.apply_history(mt.session.pump_serial, events)
+                                pump_settings = mt.get_pump_settings()
+                                print(pump_settings)
+
                                 # basal_pattern = mt.get_pump_basal_pattern()
                                 # print(basal_pattern)
 
@@ -14,29 +14,37 @@ logger = logging.getLogger(__name__)
 
 import driver.cnl24lib as cnl24lib
 import binascii
-
-import pickle # needed for local history export
+import datetime
 
 if __name__ == '__main__':
 
-    with open('history_data.dat', 'rb') as input_file:
-        history_pages = pickle.load(input_file)
+    # Events saved by main.py
+    history_store = cnl24lib.HistoryEventStore()
 
-    mt = cnl24lib.Medtronic600SeriesDriver()
-    events = mt.process_pump_history(history_pages, cnl24lib.HistoryDataType.PUMP_DATA)
     print ("# All events:")
-    for ev in events:
+    for stored_event in history_store.query():
+        if stored_event.event_type == cnl24lib.NGPHistoryEvent.EVENT_TYPE.GENERATED_SENSOR_GLUCOSE_READINGS_EXTENDED_ITEM:
+            continue # see the SENSOR_GLUCOSE_READINGS_EXTENDED event
+        ev = cnl24lib.HistoryEventStore.decode(stored_event)
         if ev.event_type != cnl24lib.NGPHistoryEvent.EVENT_TYPE.PLGM_CONTROLLER_STATE: # or ev.event_type == cnl24lib.NGPHistoryEvent.EVENT_TYPE.TIME_RESET:
         # if ev.event_type == cnl24lib.NGPHistoryEvent.EVENT_TYPE.ALARM_NOTIFICATION and "Don't parse data" in ev.alarm_string :
         # if ev.event_type == cnl24lib.NGPHistoryEvent.EVENT_TYPE.ALARM_NOTIFICATION:
         #     print (ev, binascii.hexlify(ev.event_data))
-            print (ev)
+            print (stored_event.timestamp, ev)
 
         # if ev.event_type != cnl24lib.NGPHistoryEvent.EVENT_TYPE.PLGM_CONTROLLER_STATE:
         #     print (ev )
 
     print ("# End events")
 
+    print ("# Boluses, last 7 days:")
+    for stored_event in history_store.boluses(days=7):
+        print (stored_event.timestamp, stored_event.payload)
+
+    print ("# Sensor glucose, last 24 hours:")
+    for stored_event in history_store.sensor_glucose(start_date=datetime.datetime.now() - datetime.timedelta(days=1)):
+        print (stored_event.timestamp, stored_event.payload['sg'])
+
     # ii = 0
     # for i in range(len(self.eventData)):
     #     if i >= 0x0B:
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+# Synthetic pump history for the tests: raw history records, blocks and UNMERGED_HISTORY_RESPONSE segments
+
+import driver.cnl24lib as cnl24lib
+import random
+import struct
+
+EVENT_TYPE = cnl24lib.NGPHistoryEvent.EVENT_TYPE
+
+BLOCK_SIZE = 2048
+
+# rtc 2021-02-28, offset like a real pump
+RTC_START = 667872000
+RTC_OFFSET = -1000000
+
+
+def event(event_type, rtc, body=b'', offset=RTC_OFFSET):
+    return struct.pack('>BBBII', event_type, 0, 0x0B + len(body), rtc, offset & 0xFFFFFFFF) + body
+
+
+def sensor_readings(rtc, readings=6, minutes=5, sg=None):
+    # SENSOR_GLUCOSE_READINGS_EXTENDED record, the newest reading at 'rtc'
+    body = struct.pack('>BBH', minutes, readings, 120)
+    for i in range(readings):
+        value = sg if sg is not None else random.randint(40, 400)
+        body += struct.pack('>HHBhBB', value, random.randint(0, 5000), 0, random.randint(-300, 300), 0, 0)
+    return event(EVENT_TYPE.SENSOR_GLUCOSE_READINGS_EXTENDED, rtc, body)
+
+
+def wizard_estimate(rtc, amount):
+    # BOLUS_WIZARD_ESTIMATE record with only the final estimate set
+    return event(EVENT_TYPE.BOLUS_WIZARD_ESTIMATE, rtc, bytes(0x26) + struct.pack('>I', amount))
+
+
+def normal_bolus(rtc, bolus_number, amount):
+    # Wizard estimate, programmed and delivered normal bolus
+    return [wizard_estimate(rtc - 60, amount),
+            event(EVENT_TYPE.NORMAL_BOLUS_PROGRAMMED, rtc, struct.pack('>BBBII', 1, bolus_number, 0, amount, 0)),
+            event(EVENT_TYPE.NORMAL_BOLUS_DELIVERED, rtc + 60, struct.pack('>BBBIII', 1, bolus_number, 0, amount, amount, 0))]
+
+
+def square_bolus(rtc, bolus_number, amount, duration=60, wizard_before=60):
+    # Wizard estimate, programmed square bolus and its delivery 'duration' minutes later
+    return [wizard_estimate(rtc - wizard_before, amount),
+            event(EVENT_TYPE.SQUARE_BOLUS_PROGRAMMED, rtc, struct.pack('>BBBIHI', 1, bolus_number, 0, amount, duration, 0)),
+            event(EVENT_TYPE.SQUARE_BOLUS_DELIVERED, rtc + duration * 60,
+                  struct.pack('>BBBIIHHI', 1, bolus_number, 0, amount, amount, duration, duration, 0))]
+
+
+def history(days=2, rtc_start=RTC_START, seed=1):
+    # Records of 'days' days, oldest first: controller state every 5 minutes, sensor readings every 30 minutes,
+    # basal every hour, a bolus every 4 hours
+    random.seed(seed)
+    records = []
+    bolus_number = 0
+    for minute in range(0, days * 24 * 60, 5):
+        rtc = rtc_start + minute * 60
+        records.append(event(EVENT_TYPE.PLGM_CONTROLLER_STATE, rtc, bytes(random.getrandbits(8) for _ in range(20))))
+        if minute % 30 == 0:
+            records.append(sensor_readings(rtc))
+        if minute % 60 == 0:
+            records.append(event(EVENT_TYPE.BASAL_SEGMENT_START, rtc, struct.pack('>BBI', 1, 2, 8500)))
+        if minute % 240 == 0:
+            bolus_number = (bolus_number + 1) & 0xFF
+            records += normal_bolus(rtc, bolus_number, random.randint(1, 100) * 500)
+        if minute % (24 * 60) == 0:
+            records.append(event(EVENT_TYPE.DAILY_TOTALS, rtc, bytes(0x61)))
+    return sorted(records, key=lambda x: struct.unpack_from('>I', x, 3)[0])
+
+
+def blocks(records):
+    # Decoded history blocks (records only, without padding, size and CCITT)
+    result = []
+    block = b''
+    for record in records:
+        if len(block) + len(record) > BLOCK_SIZE - 4:
+            result.append(block)
+            block = b''
+        block += record
+    if block:
+        result.append(block)
+    return result
+
+
+def segment(decoded_blocks, history_type=cnl24lib.HistoryDataType.PUMP_DATA):
+    # Uncompressed UNMERGED_HISTORY_RESPONSE segment
+    return cnl24lib.Medtronic600SeriesDriver.encode_pump_segment(decoded_blocks, history_type)
+
+
+def segments(records, blocks_per_segment=4, history_type=cnl24lib.HistoryDataType.PUMP_DATA):
+    decoded_blocks = blocks(records)
+    return [segment(decoded_blocks[i:i + blocks_per_segment], history_type)
+            for i in range(0, len(decoded_blocks), blocks_per_segment)]
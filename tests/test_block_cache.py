@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+# HistoryBlockCache: cached blocks are decoded to the same events as without the cache, also when
+# two different blocks have the same (history type, CCITT, length) key
+
+import driver.cnl24lib as cnl24lib
+import random
+import synthetic
+
+EVENT_TYPE = cnl24lib.NGPHistoryEvent.EVENT_TYPE
+
+
+def colliding_blocks():
+    # Two blocks of the same length and CCITT
+    rng = random.Random(2)
+    seen = {}
+    while True:
+        block = b''.join(synthetic.event(EVENT_TYPE.PLGM_CONTROLLER_STATE, synthetic.RTC_START + i * 300,
+                                         bytes(rng.getrandbits(8) for _ in range(20))) for i in range(3))
+        checksum = cnl24lib.MedtronicMessage.calculate_ccitt(block)
+        if checksum in seen and seen[checksum] != block:
+            return seen[checksum], block
+        seen[checksum] = block
+
+
+def events(mt, segments):
+    return [bytes(x.event_data) for x in mt.process_pump_history(segments)]
+
+
+def test_hits():
+    segments = synthetic.segments(synthetic.history(days=1))
+    mt = cnl24lib.Medtronic600SeriesDriver()
+    expected = events(mt, segments)
+    mt.block_cache = cnl24lib.HistoryBlockCache()
+    assert events(mt, segments) == expected
+    misses = mt.block_cache.misses
+    assert mt.block_cache.hits == 0 and misses == len(mt.block_cache) > 0
+    assert events(mt, segments) == expected
+    assert mt.block_cache.hits == misses and mt.block_cache.misses == misses
+
+
+def test_same_key_other_block():
+    first, second = colliding_blocks()
+    mt = cnl24lib.Medtronic600SeriesDriver()
+    mt.block_cache = cnl24lib.HistoryBlockCache()
+    for block in (first, second, first):
+        segment = synthetic.segment([block])
+        assert events(mt, [segment]) == events(cnl24lib.Medtronic600SeriesDriver(), [segment])
+    assert mt.block_cache.hits == 0 and mt.block_cache.misses == 3
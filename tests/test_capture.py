@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+# UsbRecorder / UsbReplay: a session recorded against the PumpEmulator plays back through the driver
+
+import datetime
+import driver.cnl24lib as cnl24lib
+import pytest
+import tools.cnl24emu as cnl24emu
+import tools.usbcapture as usbcapture
+from test_emulator import close_session, emulator, open_session
+
+
+@pytest.fixture(autouse=True)
+def work_dir(tmp_path, monkeypatch):
+    # The driver keeps the link keys in 'read_minimed.sqlite3' in the working directory
+    monkeypatch.chdir(tmp_path)
+
+
+def read_history(device):
+    mt = cnl24lib.Medtronic600SeriesDriver()
+    open_session(mt, device)
+    history_pages = mt.get_pump_history(datetime.datetime.now() - datetime.timedelta(days=5), datetime.datetime.now())
+    pump_time = mt.pump_time
+    close_session(mt)
+    return mt, pump_time, [bytes(x) for x in history_pages]
+
+
+def test_record_and_replay(tmp_path):
+    pump, records = emulator(latency_ms=20, loss=0.05)
+    path = str(tmp_path / 'session.cnlusb')
+    recorder = usbcapture.UsbRecorder(pump, path, clock=pump.clock)
+    mt, pump_time, history_pages = read_history(recorder)
+
+    captured = usbcapture.UsbCapture.records(path)
+    assert {x[0] for x in captured} >= {usbcapture.UsbCapture.READ, usbcapture.UsbCapture.WRITE}
+    assert captured[-1][1] == pytest.approx(pump.clock.monotonic(), abs=0.001)
+
+    replay = usbcapture.UsbReplay(path, speed=0, clock=cnl24emu.VirtualClock())
+    replay_mt, replay_pump_time, replay_pages = read_history(replay)
+    assert replay.completed
+    assert replay_mt.session.key == pump.LINK_KEY
+    assert replay_pump_time == pump_time
+    assert replay_pages == history_pages
+    assert [str(x) for x in replay_mt.process_pump_history(replay_pages)] == \
+           [str(x) for x in mt.process_pump_history(history_pages)]
+
+
+def test_replay_timing(tmp_path):
+    pump, records = emulator(days=1, latency_ms=50)
+    path = str(tmp_path / 'session.cnlusb')
+    read_history(usbcapture.UsbRecorder(pump, path, clock=pump.clock))
+
+    # As captured and twice as fast: the device's time is replayed, the driver's own time adds to it
+    for speed in (1.0, 2.0):
+        replay = usbcapture.UsbReplay(path, speed=speed, clock=cnl24emu.VirtualClock())
+        read_history(replay)
+        assert replay.completed
+        assert replay.elapsed == pytest.approx(replay.captured_time / speed, rel=0.05)
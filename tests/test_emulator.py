@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+# The driver against the PumpEmulator: a whole session, with the history as LZO compressed multipacket transfers
+
+import datetime
+import driver.cnl24lib as cnl24lib
+import pytest
+import synthetic
+import tools.cnl24emu as cnl24emu
+
+
+@pytest.fixture(autouse=True)
+def work_dir(tmp_path, monkeypatch):
+    # The driver keeps the link keys in 'read_minimed.sqlite3' in the working directory
+    monkeypatch.chdir(tmp_path)
+
+
+def open_session(mt, device):
+    assert mt.open_device(device)
+    mt.request_device_info()
+    mt.enter_control_mode()
+    mt.enter_passthrough_mode()
+    mt.open_connection()
+    mt.request_read_info()
+    mt.read_link_key()
+    assert mt.negotiate_channel()
+    mt.begin_ehsm()
+    mt.get_pump_time()
+
+
+def close_session(mt):
+    mt.finish_ehsm()
+    mt.close_connection()
+    mt.exit_passthrough_mode()
+    mt.exit_control_mode()
+    mt.close_device()
+
+
+def emulator(days=4, **kwargs):
+    pump = cnl24emu.PumpEmulator(seed=1, **kwargs)
+    records = synthetic.history(days=days, rtc_start=pump.rtc - days * 86400)
+    pump.add_history(cnl24lib.HistoryDataType.PUMP_DATA, records)
+    return pump, records
+
+
+def test_history_session():
+    pump, records = emulator(latency_ms=20, loss=0.05)
+    mt = cnl24lib.Medtronic600SeriesDriver()
+    open_session(mt, pump)
+    assert mt.session.key == pump.LINK_KEY
+    assert mt.session.radio_channel == pump.channel
+    history_pages = mt.get_pump_history(datetime.datetime.now() - datetime.timedelta(days=5), datetime.datetime.now())
+    close_session(mt)
+
+    assert len(history_pages) > 1
+    assert all(page[11] == 1 for page in history_pages) # compressed
+    # Lost packets were requested again
+    assert pump.lost_packets > 0 and pump.resent_packets >= pump.lost_packets
+    expected = [str(x) for x in mt.process_pump_history(synthetic.segments(records))]
+    assert [str(x) for x in mt.process_pump_history(history_pages)] == expected
+
+
+def test_uncompressed_history():
+    pump, records = emulator(days=1, compress=False)
+    mt = cnl24lib.Medtronic600SeriesDriver()
+    open_session(mt, pump)
+    history_pages = mt.get_pump_history(datetime.datetime.now() - datetime.timedelta(days=2), datetime.datetime.now())
+    close_session(mt)
+
+    assert all(page[11] == 0 for page in history_pages)
+    assert [bytes(x.event_data) for x in mt.process_pump_history(history_pages)] == \
+           [bytes(x.event_data) for x in mt.process_pump_history(synthetic.segments(records))]
+
+
+def test_combined_history():
+    pump, records = emulator(days=2)
+    sensor_records = [synthetic.sensor_readings(pump.rtc - 2 * 86400 + i * 1800) for i in range(96)]
+    pump.add_history(cnl24lib.HistoryDataType.SENSOR_DATA, sensor_records)
+    mt = cnl24lib.Medtronic600SeriesDriver()
+    open_session(mt, pump)
+    combined = list(mt.get_combined_history(datetime.datetime.now() - datetime.timedelta(days=3), datetime.datetime.now()))
+    close_session(mt)
+
+    timestamps = [x.timestamp for x in combined]
+    assert timestamps == sorted(timestamps)
+    expected = mt.process_pump_history(synthetic.segments(records)) + \
+        mt.process_pump_history(synthetic.segments(sensor_records, history_type=cnl24lib.HistoryDataType.SENSOR_DATA),
+                                cnl24lib.HistoryDataType.SENSOR_DATA)
+    assert sorted(str(x) for x in combined) == sorted(str(x) for x in expected)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+# HistoryArchive: appended segments are read back by time range, a torn append is dropped,
+# records archived again by overlapping polls are returned once
+
+import driver.cnl24lib as cnl24lib
+import os
+import struct
+import synthetic
+
+PUMP_DATA = cnl24lib.HistoryDataType.PUMP_DATA
+PUMP_SERIAL = 1234567
+
+
+def records_of(decoded_blocks):
+    records = []
+    for block in decoded_blocks:
+        pos = 0
+        while pos < len(block):
+            records.append(bytes(block[pos:pos + block[pos + 2]]))
+            pos += block[pos + 2]
+    return records
+
+
+def pump_time(record):
+    return sum(struct.unpack_from('>Ii', record, 3))
+
+
+def archive_of(path, segments):
+    archive = cnl24lib.HistoryArchive(path)
+    for segment in segments:
+        archive.append(PUMP_SERIAL, PUMP_DATA, segment)
+    return archive
+
+
+def test_read_back(tmp_path):
+    records = synthetic.history(days=2)
+    segments = synthetic.segments(records)
+    path = str(tmp_path / 'history.ngph')
+    archive_of(path, segments).close()
+
+    archive = cnl24lib.HistoryArchive(path)
+    assert len(archive.index) == len(segments)
+    assert records_of(archive.read_blocks()) == records
+    assert archive.read_blocks(pump_serial=PUMP_SERIAL + 1) == []
+    # A time range: the blocks that overlap it
+    start = pump_time(records[len(records) // 2])
+    end = start + 3600
+    decoded_blocks = archive.read_blocks(start=start, end=end)
+    assert len(decoded_blocks) < len(synthetic.blocks(records))
+    assert [x for x in records_of(decoded_blocks) if start <= pump_time(x) <= end] == \
+           [x for x in records if start <= pump_time(x) <= end]
+
+
+def test_torn_append(tmp_path):
+    records = synthetic.history(days=2)
+    segments = synthetic.segments(records)
+    path = str(tmp_path / 'history.ngph')
+    archive_of(path, segments).close()
+    # The last append broke off in its segment
+    os.truncate(path, os.path.getsize(path) - len(segments[-1]) // 2)
+
+    archive = cnl24lib.HistoryArchive(path)
+    assert len(archive.index) == len(segments) - 1
+    assert records_of(archive.read_blocks()) == records_of(synthetic.blocks(records)[:4 * (len(segments) - 1)])
+    # The segment appended again replaces the torn one
+    archive.append(PUMP_SERIAL, PUMP_DATA, segments[-1])
+    archive.close()
+    archive = cnl24lib.HistoryArchive(path)
+    assert len(archive.index) == len(segments)
+    assert records_of(archive.read_blocks()) == records
+
+
+def test_overlapping_polls(tmp_path):
+    records = synthetic.history(days=2)
+    middle = len(records) // 2
+    path = str(tmp_path / 'history.ngph')
+    # Every poll reads from a bit before the end of the last one; the last block of the first poll
+    # grows until the second one
+    archive = archive_of(path, [synthetic.segment(synthetic.blocks(records[:middle])[-2:]),
+                                synthetic.segment(synthetic.blocks(records[:middle + 50])[-3:]),
+                                synthetic.segment(synthetic.blocks(records[middle - 10:]))])
+    first = synthetic.blocks(records[:middle])[-2]
+    got = records_of(archive.read_blocks())
+    assert got == records[records.index(records_of([first])[0]):]
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+# HistoryChunkPlan: chunks cover the range newest first, sized by the history density and the transfer rate
+
+import datetime
+import driver.cnl24lib as cnl24lib
+
+HistoryChunkPlan = cnl24lib.HistoryChunkPlan
+
+NOW = datetime.datetime(2021, 3, 10, 12, 0, 0)
+SECOND = datetime.timedelta(seconds=1)
+
+
+def all_chunks(plan):
+    chunks = []
+    chunk = plan.next_chunk()
+    while chunk is not None:
+        chunks.append(chunk)
+        chunk = plan.next_chunk()
+    return chunks
+
+
+def test_chunks_cover_the_range():
+    start = NOW - datetime.timedelta(days=7)
+    # 2 KiB of history an hour: 20 s at 2 KiB/s is 20 hours of it
+    plan = HistoryChunkPlan(start, NOW, 7 * 24 * 2048, now=NOW)
+    chunks = all_chunks(plan)
+    assert chunks == plan.chunks
+    assert chunks[0][1] == NOW and chunks[-1][0] == start
+    for (older_start, older_end), (newer_start, newer_end) in zip(chunks[1:], chunks):
+        assert older_end == newer_start - SECOND
+    assert all(end - start == datetime.timedelta(hours=20) for start, end in chunks[:-1])
+    assert not plan.complete
+
+
+def test_chunk_size_limits():
+    start = NOW - datetime.timedelta(days=30)
+    # No history: one request as long as the pump allows
+    chunks = all_chunks(HistoryChunkPlan(start, NOW, 0, now=NOW))
+    assert chunks[0] == (NOW - datetime.timedelta(seconds=HistoryChunkPlan.MAX_CHUNK_S), NOW)
+    # Dense history, slow link: not less than MIN_CHUNK_S
+    plan = HistoryChunkPlan(NOW - datetime.timedelta(days=1), NOW, 10 ** 9, bytes_per_second=100, now=NOW)
+    assert plan.next_chunk() == (NOW - datetime.timedelta(seconds=HistoryChunkPlan.MIN_CHUNK_S), NOW)
+
+
+def test_open_end():
+    # datetime.max: up to now, the first chunk still ends at datetime.max
+    start = NOW - datetime.timedelta(days=2)
+    plan = HistoryChunkPlan(start, datetime.datetime.max, 2 * 24 * 2048, now=NOW)
+    assert plan.next_chunk() == (NOW - datetime.timedelta(hours=20), datetime.datetime.max)
+    assert plan.next_chunk() == (NOW - datetime.timedelta(hours=40) - SECOND, NOW - datetime.timedelta(hours=20) - SECOND)
+
+
+def test_chunks_adapt_to_the_transfer_rate():
+    start = NOW - datetime.timedelta(days=7)
+    plan = HistoryChunkPlan(start, NOW, 7 * 24 * 2048, now=NOW)
+    chunk = plan.next_chunk()
+    # 40960 bytes in 5 s instead of 20 s: four times the rate, the estimate goes half the way
+    plan.chunk_done(chunk, 5)
+    assert plan.bytes_per_second == 2048 * 2.5
+    start_2, end_2 = plan.next_chunk()
+    assert end_2 - start_2 == datetime.timedelta(hours=50)
+    # A slower chunk: smaller ones again
+    plan.chunk_done((start_2, end_2), 100)
+    start_3, end_3 = plan.next_chunk()
+    assert end_3 - start_3 < end_2 - start_2
+
+
+def test_complete_only_when_every_chunk_is_done():
+    start = NOW - datetime.timedelta(days=3)
+    plan = HistoryChunkPlan(start, NOW, 3 * 24 * 2048, now=NOW)
+    chunks = all_chunks(plan)
+    for chunk in chunks[:-1]:
+        plan.chunk_done(chunk, 20)
+    assert not plan.complete
+    plan.chunk_done(chunks[-1], 20)
+    assert plan.complete
+
+    plan = HistoryChunkPlan(start, NOW, 3 * 24 * 2048, now=NOW)
+    chunks = all_chunks(plan)
+    plan.chunk_failed(chunks[0])
+    for chunk in chunks[1:]:
+        plan.chunk_done(chunk, 20)
+    assert not plan.complete
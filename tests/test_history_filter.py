@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+# HistoryEventFilter: a filtered decode returns the events of an unfiltered decode that the filter accepts,
+# with the same post_process links
+
+import driver.cnl24lib as cnl24lib
+import synthetic
+
+EVENT_TYPE = cnl24lib.NGPHistoryEvent.EVENT_TYPE
+
+
+def pump_date(rtc):
+    return cnl24lib.DateTimeHelper.decode_date_time(rtc, synthetic.RTC_OFFSET)
+
+
+def describe(event):
+    programmed = getattr(event, 'programmedEvent', None)
+    wizard = getattr(programmed, 'bolusWizardEvent', None) or getattr(event, 'bolusWizardEvent', None)
+    return (str(event), getattr(event, 'canceled', None), getattr(event, 'programmed', None),
+            None if programmed is None else programmed.timestamp, None if wizard is None else wizard.timestamp)
+
+
+def check_filter(segments, history_filter):
+    mt = cnl24lib.Medtronic600SeriesDriver()
+    expected = [describe(x) for x in mt.process_pump_history(segments) if history_filter.accepts(x)]
+    got = [describe(x) for x in mt.process_pump_history(segments, history_filter=history_filter)]
+    assert got == expected
+    return got
+
+
+def test_time_window_keeps_links():
+    records = synthetic.history(days=2)
+    segments = synthetic.segments(records)
+    delivered = [x for x in cnl24lib.Medtronic600SeriesDriver().process_pump_history(segments)
+                 if x.event_type == EVENT_TYPE.NORMAL_BOLUS_DELIVERED]
+    for event in delivered[:3]:
+        start_date = pump_date(event.rtc - 30)
+        got = check_filter(segments, cnl24lib.HistoryEventFilter(start_date=start_date))
+        assert got[0][3] is not None # programmedEvent
+        check_filter(segments, cnl24lib.HistoryEventFilter(start_date=start_date, event_types=[
+            EVENT_TYPE.NORMAL_BOLUS_DELIVERED, EVENT_TYPE.NORMAL_BOLUS_PROGRAMMED]))
+
+
+def test_chained_links_before_the_window():
+    # The delivery is 8 hours after the bolus was programmed, the wizard estimate 2 minutes before that:
+    # the estimate is more than one correlation window before 'start'
+    rtc = synthetic.RTC_START + 3600
+    records = synthetic.square_bolus(rtc, 1, 25000, duration=480, wizard_before=120)
+    segments = [synthetic.segment(synthetic.blocks(records))]
+    delivered_rtc = rtc + 480 * 60
+    for history_filter in (cnl24lib.HistoryEventFilter(start_date=pump_date(delivered_rtc - 10)),
+                           cnl24lib.HistoryEventFilter(start_date=pump_date(delivered_rtc - 10),
+                                                       event_types=[EVENT_TYPE.SQUARE_BOLUS_DELIVERED])):
+        got = check_filter(segments, history_filter)
+        assert len(got) == 1
+        assert got[0][3] is not None and got[0][4] is not None
+
+
+def test_sensor_readings_in_the_window():
+    # The window ends between the readings of a record: the readings up to the end are decoded
+    rtc = synthetic.RTC_START + 3600
+    records = [synthetic.sensor_readings(rtc, readings=12), synthetic.sensor_readings(rtc + 3600, readings=12)]
+    segments = [synthetic.segment(synthetic.blocks(records))]
+    history_filter = cnl24lib.HistoryEventFilter(start_date=pump_date(rtc - 1200), end_date=pump_date(rtc + 1200))
+    got = check_filter(segments, history_filter)
+    # 5 readings of the first record (-20 to 0 minutes), 4 of the second one (+5 to +20 minutes)
+    assert len(got) == 9
+
+
+def test_type_filters():
+    segments = synthetic.segments(synthetic.history(days=2))
+    check_filter(segments, cnl24lib.HistoryEventFilter(event_types=[EVENT_TYPE.NORMAL_BOLUS_DELIVERED,
+                                                                    EVENT_TYPE.BOLUS_WIZARD_ESTIMATE]))
+    check_filter(segments, cnl24lib.HistoryEventFilter(exclude_event_types=[EVENT_TYPE.PLGM_CONTROLLER_STATE,
+                                                                            EVENT_TYPE.NORMAL_BOLUS_PROGRAMMED]))
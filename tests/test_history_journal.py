@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+# HistoryJournal: a history download that breaks off resumes from the journal, in the next session,
+# for a range that only overlaps the interrupted one
+
+import datetime
+import driver.cnl24lib as cnl24lib
+import pytest
+import struct
+import synthetic
+import tools.cnl24emu as cnl24emu
+from test_emulator import close_session, open_session
+
+PUMP_DATA = cnl24lib.HistoryDataType.PUMP_DATA
+
+
+@pytest.fixture(autouse=True)
+def work_dir(tmp_path, monkeypatch):
+    # The driver keeps the link keys in 'read_minimed.sqlite3' in the working directory
+    monkeypatch.chdir(tmp_path)
+
+
+class FailingPump( cnl24emu.PumpEmulator ):
+    # The radio link breaks off after 'packets' multipacket packets. Records the requested rtc ranges.
+    def __init__(self, **kwargs):
+        cnl24emu.PumpEmulator.__init__(self, seed=1, **kwargs)
+        self.packets = None
+        self.history_requests = []
+
+    def com_d_message(self, sequence_number, message_type, data):
+        if message_type == cnl24lib.ComDCommand.READ_HISTORY_REQUEST:
+            self.history_requests.append(struct.unpack_from('>BBII', data, 0)[2:4])
+        cnl24emu.PumpEmulator.com_d_message(self, sequence_number, message_type, data)
+
+    def send_com_d(self, sequence_number, message_type, data = b'', lossy = False):
+        if lossy and self.packets is not None:
+            if self.packets <= 0:
+                return
+            self.packets -= 1
+        cnl24emu.PumpEmulator.send_com_d(self, sequence_number, message_type, data, lossy)
+
+
+def read_history(pump, journal, start_date, end_date, packets=None):
+    # Segments of one session, until the link breaks off after 'packets'
+    pump.packets = packets
+    mt = cnl24lib.Medtronic600SeriesDriver()
+    open_session(mt, pump)
+    segments = []
+    try:
+        for segment in mt.iter_pump_history(start_date, end_date, PUMP_DATA, journal):
+            segments.append(bytes(segment))
+    except cnl24lib.TimeoutException:
+        pass
+    pump.packets = None
+    close_session(mt)
+    return segments, mt
+
+
+def history_pump(days=4):
+    pump = FailingPump()
+    records = synthetic.history(days=days, rtc_start=pump.rtc - days * 86400)
+    pump.add_history(PUMP_DATA, records)
+    return pump, records
+
+
+def events(segments):
+    return [str(x) for x in cnl24lib.Medtronic600SeriesDriver().process_pump_history(segments)]
+
+
+def test_resume_after_a_completed_segment(tmp_path):
+    pump, records = history_pump()
+    journal = cnl24lib.HistoryJournal(str(tmp_path / 'journal.sqlite3'))
+    start_date = datetime.datetime.now() - datetime.timedelta(days=5)
+    end_date = datetime.datetime.now()
+    # The first segment and part of the second one
+    first, mt = read_history(pump, journal, start_date, end_date, packets=45)
+    assert len(first) == 1
+    entries = journal.entries(mt.session.pump_serial, PUMP_DATA, 0, 0xFFFFFFFF)
+    assert len(entries) == 1 and journal.load_session(*entries[0]) is not None
+
+    # The next run plans its range from a later 'now'
+    second, mt = read_history(pump, journal, start_date + datetime.timedelta(minutes=10),
+                              end_date + datetime.timedelta(minutes=10))
+    assert second[0] == first[0]
+    # Only the rest was requested, from the last record of the journal segment on
+    assert pump.history_requests[-1][0] == mt.history_rtc_range(first, PUMP_DATA)[1]
+    assert events(second) == events(synthetic.segments(records))
+    assert journal.entries(mt.session.pump_serial, PUMP_DATA, 0, 0xFFFFFFFF) == []
+
+
+def test_resume_the_segment_in_flight(tmp_path):
+    pump, records = history_pump()
+    journal = cnl24lib.HistoryJournal(str(tmp_path / 'journal.sqlite3'))
+    start_date = datetime.datetime.now() - datetime.timedelta(days=5)
+    end_date = datetime.datetime.now()
+    first, mt = read_history(pump, journal, start_date, end_date, packets=20)
+    assert first == []
+
+    second, mt = read_history(pump, journal, start_date, end_date)
+    # The restored packets the pump sent again weren't needed
+    assert mt.multipacket_transfer.stats.duplicates >= 20
+    assert events(second) == events(synthetic.segments(records))
+
+
+def test_restored_packets_of_another_segment(tmp_path):
+    pump, records = history_pump()
+    journal = cnl24lib.HistoryJournal(str(tmp_path / 'journal.sqlite3'))
+    start_date = datetime.datetime.now() - datetime.timedelta(days=5)
+    end_date = datetime.datetime.now()
+    read_history(pump, journal, start_date, end_date, packets=20)
+    # Same size, other data
+    journal.c.execute('UPDATE sessions SET data = zeroblob(length(data))')
+    journal.conn.commit()
+
+    second, mt = read_history(pump, journal, start_date, end_date)
+    assert mt.multipacket_transfer.stats.resent_packets >= 20
+    assert events(second) == events(synthetic.segments(records))
+
+
+def test_missing_rtc_ranges():
+    missing_rtc_ranges = cnl24lib.Medtronic600SeriesDriver.missing_rtc_ranges
+    assert missing_rtc_ranges([], 0, 1000) == [(0, 1000)]
+    assert missing_rtc_ranges([(0, 400)], 100, 1000) == [(400, 1000)]
+    assert missing_rtc_ranges([(100, 200), (500, 600)], 0, 1000) == [(0, 100), (200, 500), (600, 1000)]
+    assert missing_rtc_ranges([(500, 600), (100, 550)], 0, 1000) == [(0, 100), (600, 1000)]
+    # One rtc only: a single request, not two that both return its records
+    assert missing_rtc_ranges([(300, 300)], 0, 1000) == [(0, 1000)]
+    assert missing_rtc_ranges([(0, 1000)], 100, 900) == []
+    assert missing_rtc_ranges([(2000, 3000)], 0, 1000) == [(0, 1000)]
+
+
+def test_purge(tmp_path):
+    path = str(tmp_path / 'journal.sqlite3')
+    key = (1234567, PUMP_DATA, 1000, 2000)
+    journal = cnl24lib.HistoryJournal(path)
+    journal.add_segment(key, b'segment')
+    assert cnl24lib.HistoryJournal(path).entries(1234567, PUMP_DATA, 1500, 3000) == [key]
+    assert cnl24lib.HistoryJournal(path).entries(1234567, PUMP_DATA, 2001, 3000) == []
+    assert cnl24lib.HistoryJournal(path, max_age=0).entries(1234567, PUMP_DATA, 0, 3000) == []
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+# HistoryEventStore: events stored once per pump-side key, queried by pump, type and time, removed by compact()
+
+import datetime
+import driver.cnl24lib as cnl24lib
+import synthetic
+
+EVENT_TYPE = cnl24lib.NGPHistoryEvent.EVENT_TYPE
+PUMP_DATA = cnl24lib.HistoryDataType.PUMP_DATA
+PUMP_SERIAL = 1234567
+
+
+def history_events(days=2):
+    return cnl24lib.Medtronic600SeriesDriver().process_pump_history(synthetic.segments(synthetic.history(days=days)))
+
+
+def describe(stored_events):
+    return [(x.event_type, x.rtc, bytes(x.raw)) for x in stored_events]
+
+
+def test_add_events_once(tmp_path):
+    store = cnl24lib.HistoryEventStore(str(tmp_path / 'events.sqlite3'))
+    events = history_events()
+    assert store.add_events(PUMP_SERIAL, PUMP_DATA, events) == len(events)
+    # The same history again, another pump's as well
+    assert store.add_events(PUMP_SERIAL, PUMP_DATA, events) == 0
+    assert store.add_events(PUMP_SERIAL + 1, PUMP_DATA, events[:10]) == 10
+    assert len(store.query(PUMP_SERIAL)) == len(events)
+    store.close()
+
+    # The events of a reopened store, ordered by time
+    stored = cnl24lib.HistoryEventStore(str(tmp_path / 'events.sqlite3')).query(PUMP_SERIAL)
+    assert sorted(describe(stored), key=lambda x: x[1]) == describe(stored)
+    assert sorted(describe(stored)) == sorted((x.event_type, x.rtc, bytes(x.event_data)) for x in events)
+
+
+def test_query_filters(tmp_path):
+    store = cnl24lib.HistoryEventStore(str(tmp_path / 'events.sqlite3'))
+    events = history_events()
+    store.add_events(PUMP_SERIAL, PUMP_DATA, events)
+    store.add_events(PUMP_SERIAL + 1, PUMP_DATA, events)
+
+    types = [EVENT_TYPE.NORMAL_BOLUS_DELIVERED, EVENT_TYPE.BASAL_SEGMENT_START]
+    start_date = events[len(events) // 3].timestamp
+    end_date = events[2 * len(events) // 3].timestamp
+    expected = [x for x in events if x.event_type in types and start_date <= x.timestamp <= end_date]
+    got = store.query(PUMP_SERIAL, types, start_date, end_date)
+    assert len(got) == len(expected) > 0
+    assert sorted(describe(got)) == sorted((x.event_type, x.rtc, bytes(x.event_data)) for x in expected)
+    assert all(x.pump_serial == PUMP_SERIAL for x in got)
+
+    assert len(store.query(PUMP_SERIAL, types, start_date, end_date, limit=3)) == 3
+    readings = store.sensor_glucose(PUMP_SERIAL, start_date, end_date)
+    assert readings and all(x.event_type == EVENT_TYPE.GENERATED_SENSOR_GLUCOSE_READINGS_EXTENDED_ITEM for x in readings)
+    # A stored row decodes to its event again
+    delivered = [x for x in got if x.event_type == EVENT_TYPE.NORMAL_BOLUS_DELIVERED][0]
+    assert cnl24lib.HistoryEventStore.decode(delivered).rtc == delivered.rtc
+    assert delivered.payload['delivered_amount'] == cnl24lib.HistoryEventStore.decode(delivered).delivered_amount
+
+
+def test_compact(tmp_path):
+    store = cnl24lib.HistoryEventStore(str(tmp_path / 'events.sqlite3'))
+    events = history_events()
+    store.add_events(PUMP_SERIAL, PUMP_DATA, events)
+    # Everything before the middle event
+    middle = sorted(x.timestamp for x in events)[len(events) // 2]
+    store.compact(max_age=datetime.datetime.now(datetime.timezone.utc) - middle + datetime.timedelta(seconds=60))
+    kept = store.query(PUMP_SERIAL)
+    assert len(kept) == len([x for x in events if x.timestamp >= middle])
+    assert kept[0].timestamp >= middle
+
+    store.compact()
+    assert len(store.query(PUMP_SERIAL)) == len(kept)
+
+
+def test_rekey_an_earlier_store(tmp_path):
+    # Earlier stores were unique on the timestamp: the same record decoded with another UTC offset was stored twice
+    path = str(tmp_path / 'events.sqlite3')
+    store = cnl24lib.HistoryEventStore(path)
+    events = history_events(days=1)
+    store.add_events(PUMP_SERIAL, PUMP_DATA, events)
+    store.c.execute('ALTER TABLE events RENAME TO events_new')
+    store.c.execute('''CREATE TABLE events ( pump_serial INTEGER, history_type INTEGER, event_type INTEGER,
+                       rtc INTEGER, rtc_offset INTEGER, timestamp REAL, fingerprint BLOB, raw BLOB, payload TEXT,
+                       UNIQUE ( pump_serial, event_type, fingerprint, timestamp ) )''')
+    store.c.execute('INSERT INTO events SELECT * FROM events_new')
+    store.c.execute('INSERT INTO events SELECT pump_serial, history_type, event_type, rtc, rtc_offset, timestamp + 3600, '
+                    'fingerprint, raw, payload FROM events_new')
+    store.c.execute('DROP TABLE events_new')
+    store.conn.commit()
+    store.close()
+
+    store = cnl24lib.HistoryEventStore(path)
+    assert sorted(describe(store.query(PUMP_SERIAL))) == sorted((x.event_type, x.rtc, bytes(x.event_data)) for x in events)
+    assert store.add_events(PUMP_SERIAL, PUMP_DATA, events) == 0
+    store.c.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    assert sorted(x[0] for x in store.c.fetchall()) == ['blocks', 'events']
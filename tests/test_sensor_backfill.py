@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+# backfill_sensor_gaps: the readings missing locally are requested once; gaps the pump has no readings for
+# either aren't requested again in the next sync
+
+import driver.cnl24lib as cnl24lib
+import pytest
+import synthetic
+from test_emulator import close_session, open_session
+import tools.cnl24emu as cnl24emu
+
+SENSOR_DATA = cnl24lib.HistoryDataType.SENSOR_DATA
+READING = cnl24lib.NGPHistoryEvent.EVENT_TYPE.GENERATED_SENSOR_GLUCOSE_READINGS_EXTENDED_ITEM
+
+
+@pytest.fixture(autouse=True)
+def work_dir(tmp_path, monkeypatch):
+    # The driver keeps the link keys in 'read_minimed.sqlite3' in the working directory
+    monkeypatch.chdir(tmp_path)
+
+
+def backfill(pump, readings, sync_state):
+    mt = cnl24lib.Medtronic600SeriesDriver()
+    mt.history_sync = sync_state
+    open_session(mt, pump)
+    requests = pump.requests[cnl24lib.ComDCommand.READ_HISTORY_REQUEST]
+    backfilled = mt.backfill_sensor_gaps(readings)
+    requests = pump.requests[cnl24lib.ComDCommand.READ_HISTORY_REQUEST] - requests
+    close_session(mt)
+    return backfilled, requests
+
+
+def test_gaps_are_requested_once(tmp_path):
+    pump = cnl24emu.PumpEmulator(seed=1)
+    start_rtc = pump.rtc - 86400
+    # A record of 6 readings every 30 minutes, the pump has none from hour 10 to 12 (sensor warm-up)
+    records = [synthetic.sensor_readings(start_rtc + i * 1800) for i in range(48) if not 20 <= i < 24]
+    pump.add_history(SENSOR_DATA, records)
+    readings = [x for x in cnl24lib.Medtronic600SeriesDriver().process_pump_history(
+                synthetic.segments(records, history_type=SENSOR_DATA), SENSOR_DATA) if x.event_type == READING]
+    # The readings of hour 4 are missing locally
+    lost = [x for x in readings if not start_rtc + 4 * 3600 <= x.rtc < start_rtc + 5 * 3600]
+    sync_state = cnl24lib.HistorySyncState(str(tmp_path / 'sync.sqlite3'))
+
+    backfilled, requests = backfill(pump, lost, sync_state)
+    assert requests == 2
+    assert sorted(x.rtc for x in backfilled) == sorted(x.rtc for x in readings if x not in lost)
+    assert all(x.backfilledData for x in backfilled)
+
+    # Next sync: only the warm-up gap is left, and it was requested already
+    backfilled, requests = backfill(pump, lost + backfilled, sync_state)
+    assert requests == 0 and backfilled == []
+
+    # A new gap is requested
+    lost = [x for x in readings if not start_rtc + 15 * 3600 <= x.rtc < start_rtc + 16 * 3600]
+    backfilled, requests = backfill(pump, lost, sync_state)
+    assert requests == 1 and len(backfilled) == 12
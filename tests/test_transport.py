@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+# CNL transports: read() with timeout_ms 0 doesn't wait, frames read stay valid
+
+import driver.cnl24lib as cnl24lib
+import os
+import socket
+
+
+class FakeHidDevice( object ):
+    # hidapi's device: read() with timeout_ms 0 waits for a frame unless the device is non-blocking
+    def __init__(self, replies = 3):
+        self.replies = replies
+        self.frames = []
+        self.nonblocking = 0
+
+    def set_nonblocking(self, nonblocking):
+        self.nonblocking = nonblocking
+
+    def read(self, max_length, timeout_ms = 0):
+        if self.frames:
+            return self.frames.pop(0)[0:max_length]
+        assert timeout_ms != 0 or self.nonblocking, "blocking read"
+        return []
+
+    def write(self, data):
+        # Every frame is answered with 'replies' frames
+        self.frames += [list(data[0:1]) + [i] * 63 for i in range(self.replies)]
+        return len(data)
+
+    def close(self):
+        pass
+
+
+class FakeHidTransport( cnl24lib.HidTransport ):
+    def open(self):
+        self.device = FakeHidDevice()
+        return True
+
+
+def test_hid_read_without_timeout():
+    transport = FakeHidTransport()
+    transport.open()
+    assert transport.read(64, timeout_ms = 0) == []
+    assert transport.device.nonblocking == 0
+    transport.write(b'\x00')
+    assert len(transport.read(64, timeout_ms = 0)) == 64
+
+
+def test_bridge_batches_hid_frames():
+    bridge = cnl24lib.TransportBridge(('127.0.0.1', 0), FakeHidTransport())
+    bridge.start()
+    client = cnl24lib.SocketTransport(('127.0.0.1', bridge.port))
+    try:
+        assert client.open()
+        client.write(b'\x05')
+        frames = [client.read(64, timeout_ms = 2000) for _ in range(3)]
+        assert [x[0:2] for x in frames] == [[5, 0], [5, 1], [5, 2]]
+        assert client.read(64, timeout_ms = 50) == []
+        assert bridge.batches_out == 1
+    finally:
+        client.close()
+        bridge.stop()
+
+
+def test_hidraw_reports_outlive_the_next_drain():
+    # A SOCK_SEQPACKET socket delivers one report per read(), like /dev/hidrawN
+    device, cnl = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    device.setblocking(False)
+    transport = cnl24lib.HidrawTransport(reports = 2)
+    transport.open_fd(os.dup(device.fileno()))
+    device.close()
+    try:
+        assert transport.read(64, timeout_ms = 0) == []
+        sent = [bytes([i]) * 64 for i in range(5)]
+        for frame in sent:
+            cnl.send(frame)
+        received = [transport.read(64, timeout_ms = 1000) for _ in sent]
+        assert received == sent
+        assert transport.wakeups == 3
+        assert transport.read(64, timeout_ms = 0) == []
+        transport.write(b'\x51' * 64)
+        assert cnl.recv(64) == b'\x51' * 64
+    finally:
+        transport.close()
+        cnl.close()
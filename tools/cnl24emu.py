@@ -0,0 +1,421 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+import logging
+logger = logging.getLogger(__name__)
+
+import driver.cnl24lib as cnl24lib
+import binascii
+import bisect
+import collections
+import datetime
+import heapq
+import lzo
+import random
+import struct
+
+# Contour Next Link 2.4 with a 600 series pump behind it, in-process: the driver runs against it without hardware.
+# Used by the tests in 'tests/' and by anyone working on the driver away from the pump:
+#   emulator = cnl24emu.PumpEmulator()
+#   emulator.add_history(cnl24lib.HistoryDataType.PUMP_DATA, records)
+#   mt.open_device(emulator)
+
+class VirtualClock( object ):
+    # Emulated time of a PumpEmulator, with the names of the time module: 'sleep' moves it instead of waiting
+    def __init__(self, start = 0.0):
+        self.now = start
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.now += seconds
+
+class PumpEmulator( cnl24lib.CnlTransport ):
+    # In-process Contour Next Link 2.4 with a 600 series pump behind it, a transport for
+    # Medtronic600SeriesDriver (open_device(PumpEmulator())) to run the driver without hardware.
+    # Answers the device info (ASTM) and control/passthrough commands, OPEN/CLOSE_CONNECTION, READ_INFO,
+    # REQUEST_LINK_KEY, the channel negotiation and the encrypted ComD requests (0x81 + 0x80 responses):
+    # EHSM, time, status, settings, history info and history as multipacket transfers (with resends).
+    # History: raw event records per HistoryDataType (add_history), sent back as LZO compressed segments like the pump
+    # does ('compress' False: uncompressed).
+    # Nothing blocks: a read that has to wait moves 'clock' (VirtualClock) instead, the pump rtc follows it.
+    # latency_ms: delay of every pump (0x80) message, one after the other like on the radio link.
+    # loss: probability that a multipacket packet gets lost (the driver has to ask for it again).
+    STICK_SERIAL = '6213-1234567'
+    STICK_MODEL = 'Bayer7350'
+    STICK_SN = 'BG1234567B'
+    LINK_MAC = 0x0023F70682123456
+    PUMP_MAC = 0x0023F745EE654321
+    LINK_KEY = b'\x5a\x13\xc8\x27\x90\x4e\xb1\x06\x7d\xe2\x38\xa4\x1f\x6b\xd5\x09'
+    RTC_OFFSET = -1000000
+
+    BLOCK_SIZE = 2048
+    PACKET_SIZE = 1000 # multipacket packet size
+    SEGMENT_BLOCKS = 16 # history blocks per multipacket session
+
+    def __init__(self, channel = 0x1A, rssi = 0x80, rtc = None, rtc_offset = RTC_OFFSET, latency_ms = 0, loss = 0.0,
+                 seed = None, clock = None, compress = True):
+        self.channel = channel
+        self.rssi = rssi
+        self.rtc_offset = rtc_offset
+        if rtc is None:
+            rtc = cnl24lib.DateTimeHelper.rtc_from_date(datetime.datetime.now(), rtc_offset)
+        self.latency_ms = latency_ms
+        self.loss = loss
+        self.compress = compress
+        self.random = random.Random(seed)
+        self.clock = clock if clock is not None else VirtualClock()
+        self.rtc_start = rtc - int(self.clock.monotonic())
+
+        # Encryption of the ComD messages: the same key and iv as the driver's session after the negotiation
+        self.session = cnl24lib.MedtronicCnlSession()
+        self.session._stick_serial = self.STICK_SERIAL
+        self.session.key = self.LINK_KEY
+        self.session.radio_channel = channel
+        self.cipher = cnl24lib.MedtronicMessage(session=self.session)
+
+        # HistoryDataType -> rtc of every record, records (in rtc order)
+        self.history_rtc = {cnl24lib.HistoryDataType.PUMP_DATA: [], cnl24lib.HistoryDataType.SENSOR_DATA: []}
+        self.history = {cnl24lib.HistoryDataType.PUMP_DATA: [], cnl24lib.HistoryDataType.SENSOR_DATA: []}
+
+        # Settings: basal pattern number -> [(rate * 10000, start in 30 min)], [(g/U * 10, U/exchange * 1000, start)],
+        # [(hi mg/dL, hi mmol/L * 10, lo mg/dL, lo mmol/L * 10, start)], [(mg/dL/U, mmol/L/U * 10, start)]
+        self.basal_patterns = {1: [(8500, 0), (10000, 12), (7500, 40)]}
+        self.carb_ratios = [(100, 1500, 0)]
+        self.bg_targets = [(120, 67, 90, 50, 0)]
+        self.sensitivity = [(50, 28, 0)]
+
+        self.opened = False
+        self.ehsm = False
+        # ComD message type -> count, of every request
+        self.requests = collections.Counter()
+        self.lost_packets = 0
+        self.resent_packets = 0
+
+        self._incoming = bytearray()
+        self._queue = []
+        self._queued = 0
+        self._pump_ready = 0.0
+        self._cnl_sequence_number = 0
+        # The history transfer in progress: its segments (packets), the first one is being sent
+        self._segments = []
+
+    @property
+    def rtc(self):
+        return self.rtc_start + int(self.clock.monotonic())
+
+    @property
+    def encoded_datetime(self):
+        return (self.rtc << 32) | (self.rtc_offset & 0xFFFFFFFF)
+
+    def add_history(self, history_type, records):
+        # records: raw history event records (NGPHistoryEvent.HEADER + data)
+        rtcs = self.history_rtc[history_type]
+        history = self.history[history_type]
+        for record in records:
+            rtc = cnl24lib.NGPHistoryEvent.HEADER.unpack_from(record, 0)[3]
+            index = bisect.bisect_right(rtcs, rtc)
+            rtcs.insert(index, rtc)
+            history.insert(index, bytes(record))
+
+    # CnlTransport
+    def open(self):
+        self.opened = True
+        return True
+
+    def close(self):
+        self.opened = False
+
+    def get_manufacturer_string(self):
+        return 'Bayer HealthCare LLC'
+
+    def get_product_string(self):
+        return 'Contour Next Link 2.4 (emulated)'
+
+    def get_serial_number_string(self):
+        return self.STICK_SN
+
+    def write(self, data):
+        data = bytes(data)
+        if data[0:3] != cnl24lib.Medtronic600SeriesDriver.MAGIC_HEADER:
+            logger.error("## PumpEmulator: invalid USB packet {0}".format(binascii.hexlify(data)))
+            return -1
+        self._incoming += data[4:4 + data[3]]
+
+        # Binary messages (0x51 and an envelope, unlike 'Q|') are complete with their payload size,
+        # anything else with a short packet
+        message = self._incoming
+        binary = message[0] == 0x51 and (len(message) >= 0x21 or data[3] == 60)
+        if binary and (len(message) < 0x21 or len(message) < 0x21 + struct.unpack_from('<I', message, 0x1C)[0]):
+            return len(data)
+        self._incoming = bytearray()
+
+        if binary:
+            self.binary_message(bytes(message))
+        else:
+            self.control_message(bytes(message))
+        return len(data)
+
+    def read(self, max_length, timeout_ms = 0):
+        now = self.clock.monotonic()
+        timeout = max(timeout_ms, 0) / 1000.0
+        if not self._queue or self._queue[0][0] > now + timeout:
+            if timeout > 0:
+                self.clock.sleep(timeout)
+            return []
+        ready, number, packet = heapq.heappop(self._queue)
+        if ready > now:
+            self.clock.sleep(ready - now)
+        return list(packet[0:max_length])
+
+    # CNL
+    def queue_message(self, message, ready = None):
+        # The message in 'ABC' USB packets of 60 bytes payload. Without a size of their own (0x80/0x81 messages),
+        # a message that ends on a packet boundary is followed by an empty packet.
+        if ready is None:
+            ready = self.clock.monotonic()
+        chunks = [message[i:i + 60] for i in range(0, len(message), 60)]
+        if len(message) % 60 == 0 and not (len(message) >= 0x21 and message[0x12] in (cnl24lib.CommandType.RECEIVE_MESSAGE,
+                                                                                  cnl24lib.CommandType.SEND_MESSAGE_RESPONSE)):
+            chunks.append(b'')
+        for chunk in chunks:
+            packet = struct.pack('>3sB', cnl24lib.Medtronic600SeriesDriver.MAGIC_HEADER, len(chunk)) + chunk
+            heapq.heappush(self._queue, (ready, self._queued, packet.ljust(cnl24lib.Medtronic600SeriesDriver.USB_BLOCKSIZE, b'\x00')))
+            self._queued += 1
+
+    def queue_binary_message(self, message_type, payload = b'', ready = None):
+        self.session.cnl_sequence_number = self._cnl_sequence_number
+        message = cnl24lib.ContourNextLinkBinaryMessage(message_type, self.session, payload)
+        self.queue_message(message.envelope + payload, ready)
+
+    def device_info_message(self):
+        record = 'H|\\^&|||{0}^01.24\\01.04\\09.02.20\\00.00^{1}^0000-0000000^{2}|A/M/0/C|||||P|1|'.format(
+            self.STICK_MODEL, self.STICK_SERIAL, self.STICK_SN)
+        frame = b'1' + record.encode('latin-1') + bytes([cnl24lib.asciiKey['ETB']])
+        checksum = '{0:02X}'.format(sum(frame) & 0xFF).encode('ascii')
+        return bytes([cnl24lib.asciiKey['STX']]) + frame + checksum + bytes([cnl24lib.asciiKey['CR'], cnl24lib.asciiKey['LF']])
+
+    def packed_link_key(self, serial_number):
+        # Inverse of ReadLinkKeyResponseMessage.link_key: every key byte followed by a flag byte (0x02: not inverted, next byte)
+        packed = bytearray(self.random.getrandbits(8) for i in range(55))
+        pos = cnl24lib.ord_hack(serial_number[-1:]) & 7
+        for key_byte in self.LINK_KEY:
+            packed[pos] = key_byte
+            packed[pos + 1] = 0x02
+            pos += 2
+        return bytes(packed)
+
+    def control_message(self, message):
+        if message == struct.pack('>B', 0x58):
+            self.queue_message(self.device_info_message())
+            self.queue_message(struct.pack('>B', cnl24lib.asciiKey['ENQ']))
+        elif message == struct.pack('>B', cnl24lib.asciiKey['NAK']):
+            self.queue_message(struct.pack('>B', cnl24lib.asciiKey['EOT']))
+        elif message == struct.pack('>B', cnl24lib.asciiKey['ENQ']):
+            self.queue_message(struct.pack('>B', cnl24lib.asciiKey['ACK']))
+        elif message == struct.pack('>B', cnl24lib.asciiKey['EOT']):
+            self.queue_message(struct.pack('>B', cnl24lib.asciiKey['ENQ']))
+        elif message in (b'W|', b'Q|', b'1|', b'0|'):
+            self.queue_message(struct.pack('>B', cnl24lib.asciiKey['ACK']))
+        else:
+            logger.warning("## PumpEmulator: unknown control message {0}".format(binascii.hexlify(message)))
+            self.queue_message(struct.pack('>B', cnl24lib.asciiKey['NAK']))
+
+    def binary_message(self, message):
+        message_type = message[0x12]
+        self._cnl_sequence_number = struct.unpack_from('<I', message, 0x13)[0]
+        payload = message[0x21:]
+
+        if message_type in (cnl24lib.CommandType.OPEN_CONNECTION, cnl24lib.CommandType.CLOSE_CONNECTION):
+            # A wrong hmac gets no response
+            if payload != binascii.unhexlify(self.session.hmac):
+                logger.error("## PumpEmulator: wrong hmac {0}".format(binascii.hexlify(payload)))
+                return
+            self.queue_binary_message(message_type)
+        elif message_type == cnl24lib.CommandType.READ_INFO:
+            self.queue_binary_message(message_type, struct.pack('>QQ', self.LINK_MAC, self.PUMP_MAC))
+        elif message_type == cnl24lib.CommandType.REQUEST_LINK_KEY:
+            self.queue_binary_message(cnl24lib.CommandType.REQUEST_LINK_KEY_RESPONSE, self.packed_link_key(self.STICK_SERIAL))
+        elif message_type == cnl24lib.CommandType.SEND_MESSAGE:
+            self.medtronic_message(payload)
+        else:
+            logger.warning("## PumpEmulator: unknown CNL command 0x{0:X}".format(message_type))
+
+    # Pump
+    def send_message_response(self, sequence_number):
+        # 55 | 0D | 00 04 | 00 00 00 00 03 00 01 | seq | state (0x02: ok)
+        self.queue_binary_message(cnl24lib.CommandType.SEND_MESSAGE_RESPONSE,
+                                  bytes([0x55, 0x0D, 0x00, 0x04, 0x00, 0x00, 0x00, 0x00, 0x03, 0x00, 0x01,
+                                         sequence_number & 0xFF, 0x02, 0x00, 0x00]))
+
+    def queue_pump_message(self, message):
+        # A 0x80 message, after the pump messages before it and 'latency_ms'
+        ready = max(self.clock.monotonic(), self._pump_ready) + self.latency_ms / 1000.0
+        self._pump_ready = ready
+        self.queue_binary_message(cnl24lib.CommandType.RECEIVE_MESSAGE, message, ready)
+
+    def medtronic_message(self, message):
+        command_action = message[0]
+        payload = message[2:-2]
+
+        if command_action == cnl24lib.CommandAction.JOIN_NETWORK:
+            medtronic_sequence_number, radio_channel = struct.unpack_from('<BB', payload, 0)
+            self.send_message_response(medtronic_sequence_number)
+            if radio_channel == self.channel:
+                # 55 | 2C | 00 04 | ... | 82 | ... | rssi | ... | 42 | ... | channel
+                response = bytearray(0x2E)
+                response[0:4] = bytes([0x55, 0x2C, 0x00, 0x04])
+                response[0x12] = 0x82
+                response[0x1A] = self.rssi
+                response[0x23] = 0x42
+                response[0x2B] = self.channel
+            else:
+                # 55 | 0B | 00 00 | 20 00 00 00 03 00 00 (no connect)
+                response = bytearray([0x55, 0x0B, 0x00, 0x00, 0x20, 0x00, 0x00, 0x00, 0x03, 0x00, 0x00, 0x00, 0x00])
+            self.queue_pump_message(bytes(response))
+
+        elif command_action == cnl24lib.CommandAction.TRANSMIT_PACKET:
+            pump_mac, medtronic_sequence_number, mode_flags, size = struct.unpack_from('<QBBB', payload, 0)
+            decrypted = self.cipher.decrypt(bytes(payload[11:11 + size]))
+            if struct.unpack('>H', decrypted[-2:])[0] != cnl24lib.MedtronicMessage.calculate_ccitt(decrypted[0:-2]):
+                # Garbage for the pump: no response at all
+                logger.error("## PumpEmulator: ComD message with a wrong CCITT")
+                return
+            self.send_message_response(medtronic_sequence_number)
+            com_d_sequence_number, message_type = struct.unpack_from('>BH', decrypted, 0)
+            self.com_d_message(com_d_sequence_number, message_type, decrypted[3:-2])
+
+        else:
+            logger.warning("## PumpEmulator: unknown command action 0x{0:X}".format(command_action))
+
+    def send_com_d(self, sequence_number, message_type, data = b'', lossy = False):
+        clear = struct.pack('>BH', sequence_number, message_type) + data
+        clear += struct.pack('>H', cnl24lib.MedtronicMessage.calculate_ccitt(clear))
+        if lossy and self.random.random() < self.loss:
+            self.lost_packets += 1
+            self._pump_ready = max(self.clock.monotonic(), self._pump_ready) + self.latency_ms / 1000.0
+            return
+        # 22 bytes envelope, then the encrypted ComD message
+        payload = bytes(22) + self.cipher.encrypt(clear)
+        message = struct.pack('<BB', 0x55, (len(payload) + 2) & 0xFF) + payload
+        self.queue_pump_message(message + struct.pack('<H', cnl24lib.MedtronicMessage.calculate_ccitt(message)))
+
+    def com_d_message(self, sequence_number, message_type, data):
+        self.requests[message_type] += 1
+
+        if message_type == cnl24lib.ComDCommand.HIGH_SPEED_MODE_COMMAND:
+            # Only the 0x81 response
+            self.ehsm = data[0] == 0x00
+
+        elif message_type == cnl24lib.ComDCommand.TIME_REQUEST:
+            self.send_com_d(sequence_number, cnl24lib.ComDCommand.TIME_RESPONSE, struct.pack('>BQ', 1, self.encoded_datetime))
+
+        elif message_type == cnl24lib.ComDCommand.READ_PUMP_STATUS_REQUEST:
+            status = bytearray(0x58 - 3)
+            status[0x34:0x3C] = struct.pack('>Q', self.encoded_datetime) # sensor_bgl_timestamp
+            status[0x4A:0x52] = struct.pack('>Q', self.encoded_datetime) # alert_date
+            self.send_com_d(sequence_number, cnl24lib.ComDCommand.READ_PUMP_STATUS_RESPONSE, bytes(status))
+
+        elif message_type == cnl24lib.ComDCommand.READ_BASAL_PATTERN_REQUEST:
+            items = self.basal_patterns.get(data[0], [])
+            response = struct.pack('>BB', data[0], len(items))
+            for rate, start in items:
+                response += struct.pack('>IB', rate, start)
+            self.send_com_d(sequence_number, cnl24lib.ComDCommand.READ_BASAL_PATTERN_RESPONSE, response)
+
+        elif message_type == cnl24lib.ComDCommand.READ_BOLUS_WIZARD_CARB_RATIOS_REQUEST:
+            response = struct.pack('>HB', 0, len(self.carb_ratios))
+            for item in self.carb_ratios:
+                response += struct.pack('>IIB', *item)
+            self.send_com_d(sequence_number, cnl24lib.ComDCommand.READ_BOLUS_WIZARD_CARB_RATIOS_RESPONSE, response)
+
+        elif message_type == cnl24lib.ComDCommand.READ_BOLUS_WIZARD_BG_TARGETS_REQUEST:
+            response = struct.pack('>HB', 0, len(self.bg_targets))
+            for item in self.bg_targets:
+                response += struct.pack('>HHHHB', *item)
+            self.send_com_d(sequence_number, cnl24lib.ComDCommand.READ_BOLUS_WIZARD_BG_TARGETS_RESPONSE, response)
+
+        elif message_type == cnl24lib.ComDCommand.READ_BOLUS_WIZARD_SENSITIVITY_FACTORS_REQUEST:
+            response = struct.pack('>HB', 0, len(self.sensitivity))
+            for item in self.sensitivity:
+                response += struct.pack('>HHB', *item)
+            self.send_com_d(sequence_number, cnl24lib.ComDCommand.READ_BOLUS_WIZARD_SENSITIVITY_FACTORS_RESPONSE, response)
+
+        elif message_type == cnl24lib.ComDCommand.READ_HISTORY_INFO_REQUEST:
+            history_type, range_type, from_rtc, to_rtc = struct.unpack_from('>BBII', data, 0)
+            first, last = self.history_range(history_type, from_rtc, to_rtc)
+            blocks = self.history_blocks(history_type, from_rtc, to_rtc)
+            start_rtc = self.history_rtc[history_type][first] if first < last else from_rtc
+            end_rtc = self.history_rtc[history_type][last - 1] if first < last else to_rtc
+            offset = self.rtc_offset & 0xFFFFFFFF
+            self.send_com_d(sequence_number, cnl24lib.ComDCommand.READ_HISTORY_INFO_RESPONSE,
+                            struct.pack('>BIQQ', history_type, len(blocks) * self.BLOCK_SIZE,
+                                        (start_rtc << 32) | offset, (end_rtc << 32) | offset))
+
+        elif message_type == cnl24lib.ComDCommand.READ_HISTORY_REQUEST:
+            history_type, range_type, from_rtc, to_rtc = struct.unpack_from('>BBII', data, 0)
+            blocks = self.history_blocks(history_type, from_rtc, to_rtc)
+            self._segments = []
+            for i in range(0, len(blocks), self.SEGMENT_BLOCKS):
+                block_payload = b''.join(blocks[i:i + self.SEGMENT_BLOCKS])
+                data = lzo.compress(block_payload, 1, False) if self.compress else block_payload
+                segment = struct.pack('>HBIIB', cnl24lib.ComDCommand.UNMERGED_HISTORY_RESPONSE, history_type,
+                                      len(data), len(block_payload), 1 if self.compress else 0) + data
+                self._segments.append([segment[j:j + self.PACKET_SIZE] for j in range(0, len(segment), self.PACKET_SIZE)])
+            self._com_d_sequence_number = sequence_number
+            self.next_segment()
+
+        elif message_type == cnl24lib.ComDCommand.ACK_MULTIPACKET_COMMAND:
+            acked = struct.unpack_from('>H', data, 0)[0]
+            if acked == cnl24lib.ComDCommand.INITIATE_MULTIPACKET_TRANSFER and self._segments:
+                self.send_packets(range(len(self._segments[0])))
+            elif acked == cnl24lib.ComDCommand.MULTIPACKET_SEGMENT_TRANSMISSION and self._segments:
+                self._segments.pop(0)
+                self.next_segment()
+
+        elif message_type == cnl24lib.ComDCommand.MULTIPACKET_RESEND_PACKETS:
+            packet_number, missing = struct.unpack_from('>HH', data, 0)
+            if self._segments:
+                packets = range(packet_number, min(packet_number + missing, len(self._segments[0])))
+                self.resent_packets += len(packets)
+                self.send_packets(packets)
+
+        else:
+            logger.warning("## PumpEmulator: unsupported ComD message 0x{0:X}".format(message_type))
+            self.send_com_d(sequence_number, cnl24lib.ComDCommand.NAK_COMMAND, struct.pack('>HB', message_type, 0x01))
+
+    # History
+    def history_range(self, history_type, from_rtc, to_rtc):
+        rtcs = self.history_rtc[history_type]
+        return bisect.bisect_left(rtcs, from_rtc), bisect.bisect_right(rtcs, to_rtc)
+
+    def history_blocks(self, history_type, from_rtc, to_rtc):
+        # The records of from_rtc..to_rtc in history blocks: records, padding, [16bitBE] size, [16bitBE] CCITT
+        first, last = self.history_range(history_type, from_rtc, to_rtc)
+        blocks = []
+        data = b''
+        for record in self.history[history_type][first:last]:
+            if len(data) + len(record) > self.BLOCK_SIZE - 4:
+                blocks.append(data)
+                data = b''
+            data += record
+        if data:
+            blocks.append(data)
+        return [block.ljust(self.BLOCK_SIZE - 4, b'\x00') + struct.pack('>HH', len(block), cnl24lib.MedtronicMessage.calculate_ccitt(block))
+                for block in blocks]
+
+    def next_segment(self):
+        if not self._segments:
+            self.send_com_d(self._com_d_sequence_number, cnl24lib.ComDCommand.END_HISTORY_TRANSMISSION)
+            return
+        packets = self._segments[0]
+        self.send_com_d(self._com_d_sequence_number, cnl24lib.ComDCommand.INITIATE_MULTIPACKET_TRANSFER,
+                        struct.pack('>IHHH', sum(len(packet) for packet in packets), self.PACKET_SIZE,
+                                    len(packets[-1]), len(packets)))
+
+    def send_packets(self, packet_numbers):
+        for packet_number in packet_numbers:
+            self.send_com_d(self._com_d_sequence_number, cnl24lib.ComDCommand.MULTIPACKET_SEGMENT_TRANSMISSION,
+                            struct.pack('>H', packet_number) + self._segments[0][packet_number], lossy = True)
+
@@ -0,0 +1,174 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+import logging
+logger = logging.getLogger(__name__)
+
+import driver.cnl24lib as cnl24lib
+import binascii
+import struct
+import threading
+import time
+
+# Capture and replay of the USB frames between the driver and the CNL, to reproduce a session without the pump:
+#   mt.open_device(usbcapture.UsbRecorder())                  # writes 'usb_capture.cnlusb'
+#   mt.open_device(usbcapture.UsbReplay('usb_capture.cnlusb')) # later, anywhere
+
+class UsbCapture( object ):
+    # Capture file of UsbRecorder: MAGIC, then one record per USB read or write, in order:
+    # [8bit] READ/WRITE/TIMEOUT, [32bitBE] microseconds since the record before (monotonic), [8bit] size, the frame.
+    # TIMEOUT: a read that got nothing.
+    MAGIC = b'CNLUSB01'
+    RECORD = struct.Struct('>BIB')
+    READ = 0x52
+    WRITE = 0x57
+    TIMEOUT = 0x54
+
+    @classmethod
+    def records(cls, path):
+        # [(kind, seconds since the capture started, frame)]
+        records = []
+        with open(path, 'rb') as capture_file:
+            data = capture_file.read()
+        if data[0:len(cls.MAGIC)] != cls.MAGIC:
+            raise cnl24lib.InvalidMessageError("'{0}' is not a USB capture".format(path))
+        pos = len(cls.MAGIC)
+        timestamp = 0
+        while pos + cls.RECORD.size <= len(data):
+            kind, delta, size = cls.RECORD.unpack_from(data, pos)
+            pos += cls.RECORD.size
+            timestamp += delta
+            records.append((kind, timestamp / 1000000.0, data[pos:pos + size]))
+            pos += size
+        return records
+
+class UsbRecorder( cnl24lib.CnlTransport ):
+    # Transport wrapper that writes every frame read or written to a UsbCapture file ('path'), for
+    # UsbReplay: Medtronic600SeriesDriver.open_device(UsbRecorder()).
+    # 'device': the CnlTransport to record, the CNL on local USB if None.
+    def __init__(self, device = None, path = 'usb_capture.cnlusb', clock = time):
+        self.device = device if device is not None else cnl24lib.HidTransport()
+        self.path = path
+        self.clock = clock
+        self.capture_file = None
+        self.last_time = None
+        self.lock = threading.Lock()
+
+    def open(self):
+        if not self.device.open():
+            return False
+        self.capture_file = open(self.path, 'wb')
+        self.capture_file.write(UsbCapture.MAGIC)
+        self.last_time = self.clock.monotonic()
+        return True
+
+    def record(self, kind, frame):
+        with self.lock:
+            now = self.clock.monotonic()
+            delta = min(int(round((now - self.last_time) * 1000000)), 0xFFFFFFFF)
+            # Only whole microseconds move on, the rest goes to the next record
+            self.last_time += delta / 1000000.0
+            self.capture_file.write(UsbCapture.RECORD.pack(kind, delta, len(frame)) + bytes(frame))
+
+    def read(self, max_length, timeout_ms = 0):
+        data = self.device.read(max_length, timeout_ms = timeout_ms)
+        if data:
+            self.record(UsbCapture.READ, bytearray(data))
+        else:
+            self.record(UsbCapture.TIMEOUT, b'')
+        return data
+
+    def write(self, data):
+        self.record(UsbCapture.WRITE, bytearray(data))
+        return self.device.write(data)
+
+    def close(self):
+        self.capture_file.close()
+        self.device.close()
+
+    def get_manufacturer_string(self):
+        return self.device.get_manufacturer_string()
+
+    def get_product_string(self):
+        return self.device.get_product_string()
+
+    def get_serial_number_string(self):
+        return self.device.get_serial_number_string()
+
+class UsbReplay( cnl24lib.CnlTransport ):
+    # Transport that plays a UsbCapture back. Every read returns the next captured frame (nothing for a
+    # captured timeout) at its captured time after the write before it, so the driver's own time counts as in
+    # the session, only the device's is replayed.
+    # speed: 1.0 as captured, 2.0 twice as fast, ..., 0 without waiting. 'clock': time or a VirtualClock.
+    # Writes are compared with the capture; requests built from the current date or config differ from it and
+    # are only counted in 'mismatches', the captured responses are played anyway.
+    def __init__(self, path = 'usb_capture.cnlusb', speed = 1.0, clock = time):
+        self.records = UsbCapture.records(path)
+        self.speed = speed
+        self.clock = clock
+        self.position = 0
+        self.mismatches = 0
+        self.started = None
+        # Captured and replay time of the last write
+        self.anchor = (0.0, None)
+        self.opened = False
+
+    @property
+    def captured_time(self):
+        # Length of the capture, seconds
+        return self.records[-1][1] if self.records else 0.0
+
+    @property
+    def elapsed(self):
+        # Replay time up to now, seconds
+        return self.clock.monotonic() - self.started if self.started is not None else 0.0
+
+    @property
+    def completed(self):
+        return self.position >= len(self.records)
+
+    def start(self):
+        if self.started is None:
+            self.started = self.clock.monotonic()
+            self.anchor = (0.0, self.started)
+
+    def open(self):
+        self.opened = True
+        return True
+
+    def close(self):
+        self.opened = False
+
+    def get_product_string(self):
+        return 'UsbReplay'
+
+    def read(self, max_length, timeout_ms = 0):
+        self.start()
+        if self.completed or self.records[self.position][0] == UsbCapture.WRITE:
+            # Nothing more was captured before the next write
+            self.clock.sleep(max(timeout_ms, 0) / 1000.0)
+            return []
+        kind, timestamp, frame = self.records[self.position]
+        self.position += 1
+        if self.speed:
+            delay = self.anchor[1] + (timestamp - self.anchor[0]) / self.speed - self.clock.monotonic()
+            if delay > 0:
+                self.clock.sleep(delay)
+        return list(frame[0:max_length])
+
+    def write(self, data):
+        self.start()
+        data = bytes(data)
+        # Reads the driver didn't do (e.g. a clear_message that got nothing) are skipped
+        while not self.completed and self.records[self.position][0] != UsbCapture.WRITE:
+            self.position += 1
+        if self.completed:
+            self.mismatches += 1
+            logger.warning("## UsbReplay: write {0} after the end of the capture".format(binascii.hexlify(data)))
+            return len(data)
+        kind, timestamp, frame = self.records[self.position]
+        self.position += 1
+        if frame != data:
+            self.mismatches += 1
+            logger.debug("## UsbReplay: write {0} differs from the capture {1}".format(binascii.hexlify(data), binascii.hexlify(frame)))
+        self.anchor = (timestamp, self.clock.monotonic())
+        return len(data)